@@ -1,7 +1,6 @@
 import cv2
 import torch
 import numpy as np
-from pyquaternion import Quaternion
 
 import traceback
 import time
@@ -10,6 +9,7 @@ import os
 
 import BeamNGRL
 from BeamNGRL.utils.visualisation import Vis
+from BeamNGRL.utils import transforms
 from beamngpy import BeamNGpy, Scenario, Vehicle
 from beamngpy.sensors import Lidar, Camera, Electrics, Accelerometer, Timer, Damage
 import threading
@@ -126,58 +126,18 @@ class agent():
     def ROS2BNG_bf_pos(self, pos, base_pos):
         return  (pos[1] + base_pos[1], -pos[0] + base_pos[1], pos[2] + base_pos[2])
 
+    ## these work on a single quaternion [4] or a batch [N, 4], see BeamNGRL.utils.transforms
     def rpy_from_quat(self, quat):
-        y = np.zeros(3)
-        y[0] = np.arctan2((2.0*(quat[2]*quat[3]+quat[0]*quat[1])) , (quat[0]**2 - quat[1]**2 - quat[2]**2 + quat[3]**2))
-        y[1] = -np.arcsin(2.0*(quat[1]*quat[3]-quat[0]*quat[2]));
-        y[2] = np.arctan2((2.0*(quat[1]*quat[2]+quat[0]*quat[3])) , (quat[0]**2 + quat[1]**2 - quat[2]**2 - quat[3]**2))
-        return y
+        return transforms.rpy_from_quat(quat)
 
     def quat_from_rpy(self, rpy):
-        u1 = np.cos(0.5*rpy[0]);
-        u2 = np.cos(0.5*rpy[1]);
-        u3 = np.cos(0.5*rpy[2]);
-        u4 = np.sin(0.5*rpy[0]);
-        u5 = np.sin(0.5*rpy[1]);
-        u6 = np.sin(0.5*rpy[2]);
-        quat = np.zeros(4)
-        quat[0] = u1*u2*u3+u4*u5*u6;
-        quat[1] = u4*u2*u3-u1*u5*u6;
-        quat[2] = u1*u5*u3+u4*u2*u6;
-        quat[3] = u1*u2*u6-u4*u5*u3;
-        return quat
+        return transforms.quat_from_rpy(rpy)
 
     def convert_beamng_to_REP103(self, rot):
-        rot = Quaternion(rot[2], -rot[0], -rot[1], -rot[3])
-        new = Quaternion([0,np.sqrt(2)/2,np.sqrt(2)/2,0])*rot
-        rot = Quaternion(-new[1], -new[3], -new[0], -new[2])
-        return rot
+        return transforms.convert_beamng_to_REP103(rot)
 
     def calc_Transform(self, quat):
-        q00 = quat[0]**2;
-        q11 = quat[1]**2;
-        q22 = quat[2]**2;
-        q33 = quat[3]**2;
-        q01 =  quat[0]*quat[1];
-        q02 =  quat[0]*quat[2];
-        q03 =  quat[0]*quat[3];
-        q12 =  quat[1]*quat[2];
-        q13 =  quat[1]*quat[3];
-        q23 =  quat[2]*quat[3];
-
-        Tbn = np.zeros((3,3)) # transform body->ned
-        Tbn[0][0] = q00 + q11 - q22 - q33;
-        Tbn[1][1] = q00 - q11 + q22 - q33;
-        Tbn[2][2] = q00 - q11 - q22 + q33;
-        Tbn[0][1] = 2*(q12 - q03);
-        Tbn[0][2] = 2*(q13 + q02);
-        Tbn[1][0] = 2*(q12 + q03);
-        Tbn[1][2] = 2*(q23 - q01);
-        Tbn[2][0] = 2*(q13 - q02);
-        Tbn[2][1] = 2*(q23 + q01);
-
-        Tnb = Tbn.transpose(); # transform ned->body
-        return Tnb, Tbn
+        return transforms.calc_Transform(quat)
 
     def attach_lidar(self, name, pos=(0,0,1.5), dir=(0,-1,0), up=(0,0,1), vertical_resolution=3, vertical_angle=26.9,
                      rays_per_second_per_scan=5000, update_frequency=10, max_distance=10.0):
@@ -268,7 +228,7 @@ class agent():
                 self.Tnb, self.Tbn = self.calc_Transform(self.quat)
                 self.vel_wf = np.copy(self.vel)
                 self.vel = np.matmul(self.Tnb, self.vel)
-                diff = self.quat/self.last_quat
+                diff = transforms.quat_divide(self.quat, self.last_quat)
                 self.last_quat = self.quat
                 self.G = np.array([diff[1]*2/self.dt, diff[2]*2/self.dt, diff[3]*2/self.dt])  # gx gy gz
                 self.G = np.matmul(self.Tnb, self.G)
@@ -283,17 +243,46 @@ class agent():
                 self.state = np.hstack((self.pos, self.rpy, self.vel, self.A, self.G, self.steering, self.thbr))
                 if(abs(self.rpy[0]) > np.pi/2 or abs(self.rpy[1]) > np.pi/2):
                     self.flipped_over = True
+                self.sensor_poll()
+        except Exception:
+            print(traceback.format_exc())
 
-                if self.camera:
-                    if self.timestamp - self.last_cam_time > 1/self.camera_fps:
-                        self.camera_poll(0)
-                        self.last_cam_time = self.timestamp
-                if self.lidar:
-                    if self.timestamp - self.last_lidar_time > 1/self.lidar_fps:
-                        self.lidar_poll(0)
-                        self.last_lidar_time = self.timestamp
-                        self.lidar_pts -= self.pos
-                        self.lidar_pts = np.matmul(self.lidar_pts, self.Tnb.T)
+    def sensor_poll(self):
+        if self.camera:
+            if self.timestamp - self.last_cam_time > 1/self.camera_fps:
+                self.camera_poll(0)
+                self.last_cam_time = self.timestamp
+        if self.lidar:
+            if self.timestamp - self.last_lidar_time > 1/self.lidar_fps:
+                self.lidar_poll(0)
+                self.last_lidar_time = self.timestamp
+                self.lidar_pts -= self.pos
+                self.lidar_pts = np.matmul(self.lidar_pts, self.Tnb.T)
+
+    def set_polled_state(self, poller, i):
+        ## takes row i of a vehicle_batch_poller that has just polled this agent's vehicle, instead of state_poll
+        try:
+            self.timestamp = poller.timestamp[i]
+            self.dt = poller.dt[i]
+            self.broken = poller.broken[i]
+            self.pos = poller.pos[i]
+            self.quat = poller.quat[i]
+            self.last_quat = self.quat
+            self.rpy = poller.rpy[i]
+            self.Tnb, self.Tbn = poller.Tnb[i], poller.Tbn[i]
+            self.vel_wf = poller.vel_wf[i]
+            self.last_vel_wf = np.copy(self.vel_wf)
+            self.vel = poller.vel[i]
+            self.A = poller.A[i]
+            self.last_A = np.copy(self.A)
+            self.G = poller.G[i]
+            self.avg_wheelspeed = poller.wheelspeed[i]
+            self.steering = poller.steering[i]
+            self.thbr = poller.thbr[i]
+            self.state = np.copy(poller.states[i])
+            if(abs(self.rpy[0]) > np.pi/2 or abs(self.rpy[1]) > np.pi/2):
+                self.flipped_over = True
+            self.sensor_poll()
         except Exception:
             print(traceback.format_exc())
 
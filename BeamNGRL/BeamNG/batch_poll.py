@@ -0,0 +1,118 @@
+import numpy as np
+
+from BeamNGRL.utils import transforms
+
+'''
+Polls the sensors of many vehicles (agents, traffic) for the cost of about one round trip to the simulator.
+beamngpy's vehicle.poll_sensors() sends its requests and waits for the answers before the next vehicle gets to send,
+so N vehicles cost N round trips. The connections match the answers to the requests by id (replies that come in
+out of order are kept until asked for), so poll_vehicles sends the requests of every vehicle first and only then collects
+the answers. Backends without that API (fake_beamng) are polled one vehicle after the other.
+'''
+
+def send_sensor_requests(vehicle):
+    ## same requests as beamngpy's Sensors.poll, returns the pending responses (None if the backend can't pipeline)
+    sensors = vehicle.sensors
+    if not hasattr(sensors, '_encode_requests') or getattr(vehicle, 'connection', None) is None:
+        return None
+    engine_reqs, vehicle_reqs = sensors._encode_requests(tuple(sensors._sensors.keys()))
+    engine_resp = vehicle.bng._send(engine_reqs) if engine_reqs['sensors'] else None
+    vehicle_resp = vehicle._send(vehicle_reqs) if vehicle_reqs['sensors'] else None
+    return engine_resp, vehicle_resp
+
+def receive_sensor_data(vehicle, pending):
+    if pending is None:
+        vehicle.poll_sensors()
+        return
+    sensor_data = dict()
+    for resp in pending:
+        if resp is not None:
+            sensor_data.update(resp.recv('SensorData')['data'])
+    sensors = vehicle.sensors
+    for name, data in sensors._decode_response(sensor_data).items():
+        sensors._sensors[name].replace(data)
+
+def poll_vehicles(vehicles):
+    pending = [send_sensor_requests(vehicle) for vehicle in vehicles]
+    for vehicle, resp in zip(vehicles, pending):
+        receive_sensor_data(vehicle, resp)
+
+
+class vehicle_batch_poller():
+    '''
+    Polls a fixed list of vehicles with poll_vehicles and turns the readings into stacked arrays in one vectorized pass:
+    pos, vel_wf (world frame), quat (REP103), rpy, Tnb, Tbn, vel (body frame), A, G, wheelspeed, steering, thbr, timestamp
+    and the [N, 17] REP103 states, row i belonging to vehicles[i]. The math is the same as the interfaces' state_poll,
+    with the acceleration always coming from velocity differences.
+    steering_max: steering wheel degrees at full lock, a scalar or one per vehicle.
+    '''
+    def __init__(self, vehicles, steering_max=260.0):
+        self.vehicles = list(vehicles)
+        self.N = len(self.vehicles)
+        self.steering_max = np.broadcast_to(np.asarray(steering_max, dtype=np.float64), (self.N,))
+        self.Gravity = np.array([0, 0, 9.81])
+        self.initialized = False
+        self.dt = np.full(self.N, 0.02)
+        self.timestamp = np.zeros(self.N)
+        self.last_quat = np.tile([1.0, 0, 0, 0], (self.N, 1))
+        self.vel_wf = np.zeros((self.N, 3))
+        self.last_vel_wf = np.zeros((self.N, 3))
+        self.A = np.tile(self.Gravity, (self.N, 1))
+        self.last_A = np.copy(self.A)
+        self.states = np.zeros((self.N, 17))
+        self.broken = [None]*self.N
+
+    def poll(self, steps=1):
+        poll_vehicles(self.vehicles)
+        self.update(steps)
+        return self.states
+
+    def update(self, steps=1):
+        ## convert the last readings of the vehicles, without polling them
+        if self.N == 0:
+            return self.states
+        states = [vehicle.state for vehicle in self.vehicles]
+        sensors = [vehicle.sensors for vehicle in self.vehicles]
+        electrics = np.array([[s['electrics']['wheelspeed'], s['electrics']['gear_index'], s['electrics']['steering'],
+                               s['electrics']['throttle'], s['electrics']['brake']] for s in sensors], dtype=np.float64)
+        time = np.array([s['timer']['time'] for s in sensors], dtype=np.float64)
+        self.broken = [s['damage']['part_damage'] for s in sensors]
+        self.pos = np.array([state['pos'] for state in states], dtype=np.float64)
+        self.vel_wf = np.array([state['vel'] for state in states], dtype=np.float64)
+        self.quat = transforms.convert_beamng_to_REP103(np.array([state['rotation'] for state in states], dtype=np.float64))
+        if not self.initialized:
+            self.last_quat = np.copy(self.quat)
+            self.last_vel_wf = np.copy(self.vel_wf)
+            self.timestamp = time
+            self.initialized = True
+
+        ## same as state_poll: the timestamp is updated first, so dt is the minimum step time
+        self.timestamp = time
+        self.dt = np.maximum(time - self.timestamp, 0.02*steps)
+        self.rpy = transforms.rpy_from_quat(self.quat)
+        self.Tnb, self.Tbn = transforms.calc_Transform(self.quat)
+        self.vel = np.einsum('nij,nj->ni', self.Tnb, self.vel_wf)
+
+        diff = transforms.quat_divide(self.quat, self.last_quat)
+        self.last_quat = self.quat
+        self.G = np.einsum('nij,nj->ni', self.Tnb, diff[:, 1:]*2/self.dt[:, None])
+
+        acc = (self.vel_wf - self.last_vel_wf)/self.dt[:, None]
+        self.last_vel_wf = np.copy(self.vel_wf)
+        self.A = 0.2*np.einsum('nij,nj->ni', self.Tnb, acc + self.Gravity) + 0.8*self.last_A
+        self.last_A = np.copy(self.A)
+
+        sign = np.sign(electrics[:, 1])
+        sign[sign == 0] = 1 ## don't consider 0 speed in neutral gear
+        self.wheelspeed = electrics[:, 0]*sign
+        self.steering = electrics[:, 2]/self.steering_max
+        self.thbr = electrics[:, 3] - electrics[:, 4]
+
+        self.states[:, :3] = self.pos
+        self.states[:, 3:6] = self.rpy
+        self.states[:, 6:9] = self.vel
+        self.states[:, 9:12] = self.A
+        self.states[:, 12:15] = self.G
+        self.states[:, 15] = self.steering
+        self.states[:, 16] = self.thbr
+        return self.states
@@ -1,7 +1,6 @@
 import cv2
 import torch
 import numpy as np
-from pyquaternion import Quaternion
 
 import traceback
 import time
@@ -12,9 +11,30 @@ from sys import platform, exit
 
 import BeamNGRL
 from BeamNGRL.utils.visualisation import Vis
-from beamngpy import BeamNGpy, Scenario, Vehicle
-from beamngpy.sensors import Lidar, Camera, Electrics, Accelerometer, Timer, Damage
+from BeamNGRL.utils import transforms
+from BeamNGRL.BeamNG.map_server import get_map_layers, IMAGE_RESOLUTION
+from BeamNGRL.BeamNG.bev_overlay import bev_overlay
+from BeamNGRL.BeamNG.sensor_recorder import sensor_recorder
+from BeamNGRL.BeamNG.headless_sim import headless_sim
+from BeamNGRL.BeamNG.sensor_thread import sensor_thread, camera_buffers, write_camera, lidar_buffers, write_lidar
+from BeamNGRL.BeamNG.lidar_preprocess import lidar_preprocessor
+from BeamNGRL.BeamNG import frame_skip
+from BeamNGRL.BeamNG.batch_poll import poll_vehicles
 import threading
+from types import SimpleNamespace
+from BeamNGRL.BeamNG import fake_beamngpy
+
+_beamngpy_backend = None
+
+def get_beamngpy_backend():
+    ## the beamngpy classes the interface builds the simulation from. fake_beamngpy provides the same names.
+    ## beamngpy is imported on first use, so that the fake backend works without it installed
+    global _beamngpy_backend
+    if _beamngpy_backend is None:
+        from beamngpy import BeamNGpy, Scenario, Vehicle
+        from beamngpy.sensors import Lidar, Camera, Electrics, Accelerometer, Timer, Damage
+        _beamngpy_backend = SimpleNamespace(BeamNGpy=BeamNGpy, Scenario=Scenario, Vehicle=Vehicle, Lidar=Lidar, Camera=Camera, Electrics=Electrics, Accelerometer=Accelerometer, Timer=Timer, Damage=Damage)
+    return _beamngpy_backend
 
 ROOT_PATH = Path(BeamNGRL.__file__).parent
 DATA_PATH = ROOT_PATH.parent / ('BeamNGRL/data' if platform == "win32" else 'data')
@@ -37,7 +57,10 @@ def get_beamng_default(
         vesc_config=None,
         burn_time=0.02,
         run_lockstep=False,
-        traffic_config=None
+        traffic_config=None,
+        fake_beamng=None,
+        port=64256,
+        async_mode=False
 ):
 
     if(start_pos is None):
@@ -53,9 +76,10 @@ def get_beamng_default(
     if "rotate" in map_config:
         map_rotate = map_config["rotate"]
 
-    bng = beamng_interface(BeamNG_path=beamng_path, remote=remote, host_IP=host_IP, enable_traffic=traffic_config["enable"])
+    bng = beamng_interface(BeamNG_path=beamng_path, port=port, async_mode=async_mode, remote=remote, host_IP=host_IP, fake_beamng=fake_beamng, enable_traffic=traffic_config["enable"])
     bng.set_map_attributes(
-        map_size=map_config["map_size"], resolution=map_config["map_res"], elevation_range=map_config["elevation_range"], path_to_maps=path_to_maps, rotate=map_rotate, map_name=map_config["map_name"]
+        map_size=map_config["map_size"], resolution=map_config["map_res"], elevation_range=map_config["elevation_range"], path_to_maps=path_to_maps, rotate=map_rotate, map_name=map_config["map_name"],
+        shared_map=map_config.get("shared_map", False)
     )
     bng.load_scenario(
         scenario_name=map_config["map_name"], car_make=car_make, car_model=car_model,
@@ -69,6 +93,8 @@ def get_beamng_default(
 
 ## this is the equivalent of None pizza with left beef joke. Yes I'd like one beamng simulator without the beamng simulator.
 ## https://en.wikipedia.org/wiki/None_pizza_with_left_beef
+## Dynamics is the dynamics class (e.g. SimpleCarDynamics), it is built for the whole map and advances num_vehicles cars per call.
+## returns a headless_sim, see headless_sim.py
 def get_beamng_nobeam(
         Dynamics,
         car_model='offroad',
@@ -86,7 +112,10 @@ def get_beamng_nobeam(
         vesc_config=None,
         burn_time=0.02,
         run_lockstep=False,
-        traffic_config=None
+        traffic_config=None,
+        Dynamics_config=None,
+        num_vehicles=1,
+        device="cpu"
 ):
 
     if(start_pos is None):
@@ -98,25 +127,24 @@ def get_beamng_nobeam(
     if(map_config is None):
         print("please provide a map_config! I can not spawn a car in the ether!")
         exit()
+    if(Dynamics_config is None):
+        print("please provide a Dynamics_config! I can not drive a car without dynamics!")
+        exit()
     map_rotate = False
     if "rotate" in map_config:
         map_rotate = map_config["rotate"]
 
-    bng = beamng_interface(BeamNG_path=beamng_path, use_beamng=False, dyn=Dynamics, enable_traffic=traffic_config["enable"])
-    bng.set_map_attributes(
-        map_size=map_config["map_size"], resolution=map_config["map_res"], elevation_range=map_config["elevation_range"], path_to_maps=path_to_maps, rotate=map_rotate
-    )
-    bng.load_scenario(
-        scenario_name=map_config["map_name"], car_make=car_make, car_model=car_model,
-        start_pos=start_pos, start_rot=start_quat, traffic_config=traffic_config
+    bng = headless_sim(
+        Dynamics, Dynamics_config, num_vehicles=num_vehicles, map_name=map_config["map_name"],
+        map_size=map_config["map_size"], resolution=map_config["map_res"], elevation_range=map_config["elevation_range"], path_to_maps=path_to_maps, rotate=map_rotate,
+        shared_map=map_config.get("shared_map", False), device=device
     )
-    bng.burn_time = burn_time
-    bng.set_lockstep(run_lockstep)
+    bng.reset(start_pos=start_pos, start_quat=start_quat)
     return bng
 
 
 class beamng_interface():
-    def __init__(self, BeamNG_path=BNG_HOME, host='localhost', port=64256, use_beamng=True, dyn=None, remote=False, host_IP=None, shell_mode=False, HITL_mode=False, async_mode=False, enable_traffic=False):
+    def __init__(self, BeamNG_path=BNG_HOME, host='localhost', port=64256, use_beamng=True, dyn=None, remote=False, host_IP=None, shell_mode=False, HITL_mode=False, async_mode=False, enable_traffic=False, fake_beamng=None):
         self.lockstep   = False
         self.lidar_list = []
         self.lidar_fps = 10
@@ -139,9 +167,14 @@ class beamng_interface():
         self.color      = None
         self.segmt      = None
         self.lidar_pts  = None
+        self.lidar_voxels = None
         self.Gravity    = np.array([0,0,9.81])
         self.state      = None
+        self.timestamp  = 0.0
+        self.recorder   = None
         self.BEV_center = np.zeros(3)
+        self.BEV_markers = []
+        self.overlay_async = False
         self.avg_wheelspeed = 0
         self.dt = 0.02
         self.last_whspd_error = 0
@@ -158,20 +191,35 @@ class beamng_interface():
         self.lidar = False
         self.use_sgmt = False
         self.steering_max = 260.0
+        self.async_mode = async_mode ## camera and lidar are polled on background threads, see sensor_thread.py
+        self.sensor_threads = {}
+        self.camera_time = None
+        self.lidar_time = None
 
         self.traffic_vehicles = {}
+        self.traffic_timestamp = {}
         self.traffic = enable_traffic
 
         self.use_beamng = use_beamng
-        if self.use_beamng:
+        self.backend = None
+        self.BeamNG_path = BeamNG_path
+        self.sim_host = host_IP if remote else host
+        self.sim_port = port
+        if self.use_beamng and fake_beamng:
+            ## no simulator, just a stand-in for benchmarking the interface. fake_beamng can be a dict of options, see fake_beamngpy.BeamNGpy
+            self.backend = fake_beamngpy
+            self.bng = self.backend.BeamNGpy(host, port, **(fake_beamng if type(fake_beamng) == dict else {}))
+            self.bng.open()
+        elif self.use_beamng:
+            self.backend = get_beamngpy_backend()
             if remote==True and host_IP is not None:
-                self.bng = BeamNGpy(host_IP, 64256, remote=True)
+                self.bng = self.backend.BeamNGpy(host_IP, port, remote=True)
                 self.bng.open(launch=False, deploy=False)
             elif remote==True and host_IP is None:
                 print("~Ara Ara! Trying to run BeamNG remotely without providing any host IP?")
                 exit()
             else:
-                self.bng = BeamNGpy(host, port, home=BeamNG_path, user=BeamNG_path + '/userfolder')
+                self.bng = self.backend.BeamNGpy(host, port, home=BeamNG_path, user=BeamNG_path + '/userfolder')
                 self.bng.open()
         elif shell_mode:
             self.dyn = dyn
@@ -189,9 +237,9 @@ class beamng_interface():
             self.state[3:6] = torch.from_numpy(self.rpy_from_quat(self.convert_beamng_to_REP103(start_rot)))
             return
 
-        self.scenario = Scenario(scenario_name, name="test integration")
+        self.scenario = self.backend.Scenario(scenario_name, name="test integration")
 
-        self.vehicle = Vehicle('ego_vehicle', model=car_make, partConfig='vehicles/'+ car_make + '/' + car_model + '.pc')
+        self.vehicle = self.backend.Vehicle('ego_vehicle', model=car_make, partConfig='vehicles/'+ car_make + '/' + car_model + '.pc')
 
         self.scenario.add_vehicle(self.vehicle, pos=(start_pos[0], start_pos[1], self.get_height(start_pos)),
                              rot_quat=(start_rot[0], start_rot[1], start_rot[2], start_rot[3]))
@@ -207,7 +255,7 @@ class beamng_interface():
                 print(vid)
                 traffic_start_pos = traffic_config["start_poses"][i]
                 traffic_start_quat = traffic_config["start_quats"][i]
-                self.traffic_vehicles[vid] = Vehicle(vid, model=traffic_config["car_makes"][i], partConfig='vehicles/'+ traffic_config["car_makes"][i] + '/' + traffic_config["car_models"][i] + '.pc')
+                self.traffic_vehicles[vid] = self.backend.Vehicle(vid, model=traffic_config["car_makes"][i], partConfig='vehicles/'+ traffic_config["car_makes"][i] + '/' + traffic_config["car_models"][i] + '.pc')
                 self.scenario.add_vehicle(self.traffic_vehicles[vid], pos=(traffic_start_pos[0], traffic_start_pos[1], self.get_height(traffic_start_pos)),
                     rot_quat=(traffic_start_quat[0], traffic_start_quat[1], traffic_start_quat[2], traffic_start_quat[3]))
 
@@ -219,9 +267,9 @@ class beamng_interface():
         if(hide_hud):
             self.bng.hide_hud()
         # Create an Electrics sensor and attach it to the vehicle
-        self.electrics = Electrics()
-        self.timer = Timer()
-        self.damage = Damage()
+        self.electrics = self.backend.Electrics()
+        self.timer = self.backend.Timer()
+        self.damage = self.backend.Damage()
         self.vehicle.attach_sensor('electrics', self.electrics)
         self.vehicle.attach_sensor('timer', self.timer)
         self.vehicle.attach_sensor('damage', self.damage)
@@ -234,9 +282,9 @@ class beamng_interface():
             self.traffic_timer = {}
             self.traffic_damage = {}
             for vid, v in self.traffic_vehicles.items():
-                self.traffic_electrics[vid] = Electrics()
-                self.traffic_timer[vid] = Timer()
-                self.traffic_damage[vid] = Damage()
+                self.traffic_electrics[vid] = self.backend.Electrics()
+                self.traffic_timer[vid] = self.backend.Timer()
+                self.traffic_damage[vid] = self.backend.Damage()
 
                 v.attach_sensor('electrics', self.traffic_electrics[vid])
                 v.attach_sensor('timer', self.traffic_timer[vid])
@@ -249,6 +297,12 @@ class beamng_interface():
 
         self.camera_config = camera_config
         self.lidar_config = lidar_config
+        self.sensor_bng = self.bng
+        sensors_enabled = (camera_config is not None and camera_config["enable"]) or (lidar_config is not None and lidar_config["enable"])
+        if self.async_mode and sensors_enabled and self.backend is not fake_beamngpy:
+            ## the sensor threads get their own connection, so their requests never interleave with the control loop's
+            self.sensor_bng = self.backend.BeamNGpy(self.sim_host, self.sim_port, home=self.BeamNG_path, remote=self.remote)
+            self.sensor_bng.open(launch=False, deploy=False)
         self.vesc_config = vesc_config
         if self.vesc_config is not None:
             self.steering_max = self.vesc_config["steering_degrees"]
@@ -269,6 +323,11 @@ class beamng_interface():
             self.attach_lidar("lidar", pos=lidar_pos, dir=self.lidar_config["dir"], up=self.lidar_config["up"], vertical_resolution=self.lidar_config["channels"],
                              vertical_angle = self.lidar_config["vertical_angle"], rays_per_second_per_scan=self.lidar_config["rays_per_second_per_scan"],
                              update_frequency=self.lidar_fps, max_distance=self.lidar_config["max_distance"])
+            self.lidar_preprocessor = lidar_preprocessor(map_size=2*self.map_size, elevation_range=self.elev_map_hgt,
+                                                         voxel_size=self.lidar_config.get("voxel_size", 0.1), capacity=self.lidar_config.get("voxel_capacity", 4096))
+
+        if self.async_mode:
+            self.start_sensor_threads()
 
         self.state_poll()
         self.flipped_over = False
@@ -278,28 +337,23 @@ class beamng_interface():
             self.bng.start_traffic(list(self.traffic_vehicles.values()))
             self.bng.switch_vehicle(self.vehicle)
 
-    def set_map_attributes(self, map_size = 16, resolution = 0.25, path_to_maps=DATA_PATH.__str__(), rotate=False, elevation_range=2.0, map_name="small_island"):
-        self.elevation_map_full = np.load(path_to_maps + f'/map_data/{map_name}/elevation_map.npy', allow_pickle=True)
-        self.color_map_full = cv2.imread(path_to_maps + f'/map_data/{map_name}/color_map.png')
-        self.segmt_map_full = cv2.imread(path_to_maps + f'/map_data/{map_name}/segmt_map.png')
-        self.path_map_full  = cv2.imread(path_to_maps + f'/map_data/{map_name}/paths.png')
+    def set_map_attributes(self, map_size = 16, resolution = 0.25, path_to_maps=DATA_PATH.__str__(), rotate=False, elevation_range=2.0, map_name="small_island", shared_map=False):
+        ## with shared_map the (resized) layers are loaded once per host and attached read-only from shared memory
+        layers = get_map_layers(map_name=map_name, resolution=resolution, path_to_maps=path_to_maps, shared=shared_map)
+        self.elevation_map_full = layers['elevation']
+        self.color_map_full = layers['color']
+        self.segmt_map_full = layers['segmt']
+        self.path_map_full  = layers['path']
+        self.inpaint_mask   = layers['inpaint']
+        self.path_distance_map_full = layers['path_distance'] ## signed distance to the trails in meters, float16
         self.image_shape    = self.color_map_full.shape
-        self.image_resolution = 0.1  # this is the original meters per pixel resolution of the image
+        self.image_resolution = IMAGE_RESOLUTION  # this is the original meters per pixel resolution of the image
         self.resolution     = resolution  # meters per pixel of the target map
         self.resolution_inv = 1/self.resolution  # pixels per meter
         self.map_size       = map_size/2  # 16 x 16 m grid around the car by default
         self.rotate = rotate
         self.elev_map_hgt = elevation_range
 
-        if(self.image_resolution != self.resolution):
-            scale_factor = self.image_resolution/self.resolution
-            new_shape = np.array(np.array(self.image_shape) * scale_factor, dtype=np.int32)
-            self.elevation_map_full = cv2.resize(self.elevation_map_full, (new_shape[0], new_shape[1]), cv2.INTER_AREA)
-            self.color_map_full = cv2.resize(self.color_map_full, (new_shape[0], new_shape[1]), cv2.INTER_AREA)
-            self.segmt_map_full = cv2.resize(self.segmt_map_full, (new_shape[0], new_shape[1]), cv2.INTER_AREA)
-            self.path_map_full  = cv2.resize(self.path_map_full, (new_shape[0], new_shape[1]), cv2.INTER_AREA)
-            self.image_shape    = (new_shape[0], new_shape[1])
-
         self.map_size_px = int(self.map_size*self.resolution_inv)
         self.map_size_px = (self.map_size_px, self.map_size_px)
         self.mask_size   = (2 * self.map_size_px[0], 2 * self.map_size_px[1])
@@ -307,15 +361,9 @@ class beamng_interface():
         self.mask        = cv2.circle(mask, self.map_size_px, self.map_size_px[0], 255, thickness=-1)
         self.mask_center = (self.map_size_px[0], self.map_size_px[1])
 
-        self.inpaint_mask = np.zeros_like(self.elevation_map_full, dtype=np.uint8)
-        index = np.where(self.elevation_map_full == 0)
-        self.inpaint_mask[index] = 255
-
-        # creates marker image
+        # marker sprites for get_BEV_overlay
         self.marker_width = int(self.map_size*self.resolution_inv/8)
-        self.overlay_image = np.zeros([self.marker_width, self.marker_width, 3])
-        cv2.rectangle(self.overlay_image, (int(self.marker_width / 3), 0), (int(self.marker_width * 2 / 3), self.marker_width), (255, 255, 255), -1) 
-        cv2.circle(self.overlay_image, (int(self.marker_width / 2), int(self.marker_width / 4)), int(self.marker_width / 4), (255, 255, 255), -1)
+        self.overlay = bev_overlay(self.marker_width)
 
     def get_map_bf_no_rp(self, map_img, gen_mask=False, inpaint_mask = None):
         ch = len(map_img.shape)
@@ -323,6 +371,8 @@ class beamng_interface():
             BEV = map_img[self.Y_min:self.Y_max, self.X_min:self.X_max, :]
         else:
             BEV = map_img[self.Y_min:self.Y_max, self.X_min:self.X_max]
+        if BEV.dtype == np.float16:
+            BEV = BEV.astype(np.float32) ## cv2 doesn't do float16, and the crop is small
 
         if inpaint_mask is not None:
             BEV = cv2.inpaint(BEV, inpaint_mask, ch, cv2.INPAINT_TELEA)
@@ -376,61 +426,22 @@ class beamng_interface():
         self.BEV_color = self.get_map_bf_no_rp(self.color_map_full, inpaint_mask=local_inpaint)  # crops circle, rotates into body frame
         self.BEV_heght = self.get_map_bf_no_rp(self.elevation_map_full, inpaint_mask=local_inpaint)
         self.BEV_segmt = self.get_map_bf_no_rp(self.segmt_map_full, inpaint_mask=local_inpaint)
-        self.BEV_path  = self.get_map_bf_no_rp(self.path_map_full)
-
-        # car overlay on map
-        marker_size = int(self.map_size*self.resolution_inv/16)
-        car_shapes = np.zeros_like(self.BEV_color, np.uint8)
-        car_shapes = np.pad(car_shapes, ((marker_size, marker_size), (marker_size, marker_size), (0, 0)), 'edge')
+        self.BEV_path  = np.copy(self.get_map_bf_no_rp(self.path_map_full)) ## the full map may be a read-only shared view
+        self.BEV_path_distance = self.get_map_bf_no_rp(self.path_distance_map_full)
 
+        # vehicle markers as (X, Y, yaw) in BEV pixels, drawn on demand by get_BEV_overlay
+        self.BEV_markers = []
         if self.traffic:
-            self.img_X_traffic = {} 
-            self.img_Y_traffic = {}
-
-            self.Y_min_traffic = {}
-            self.Y_max_traffic = {}
-
-            self.X_min_traffic = {}
-            self.X_max_traffic = {}
             for vid, v in self.traffic_vehicles.items():
                 if (vid in self.traffic_pos ):
-                    self.img_X_traffic[vid] = np.clip(int( self.traffic_pos[vid][0]*self.resolution_inv + self.image_shape[0]//2), self.map_size*self.resolution_inv, self.image_shape[0] - 1 - self.map_size*self.resolution_inv)
-                    self.img_Y_traffic[vid] = np.clip(int( self.traffic_pos[vid][1]*self.resolution_inv + self.image_shape[1]//2), self.map_size*self.resolution_inv, self.image_shape[0] - 1 - self.map_size*self.resolution_inv)
-
-                    self.Y_min_traffic[vid] = int(self.img_Y_traffic[vid] - self.Y_min - marker_size) + marker_size
-                    self.Y_max_traffic[vid] = int(self.img_Y_traffic[vid] - self.Y_min + marker_size) + marker_size
-
-                    self.X_min_traffic[vid] = int(self.img_X_traffic[vid] - self.X_min - marker_size) + marker_size
-                    self.X_max_traffic[vid] = int(self.img_X_traffic[vid] - self.X_min + marker_size) + marker_size
-
-                    self.traffic_marker_rotation = - self.traffic_rpy[vid][2] * 180 / np.pi + 90
-
-                    image_center = tuple(np.array(self.overlay_image.shape[1::-1]) / 2)
-                    rot_mat = cv2.getRotationMatrix2D(image_center, int(self.traffic_marker_rotation), 1.0)
-                    result = cv2.warpAffine(self.overlay_image, rot_mat, self.overlay_image.shape[1::-1], flags=cv2.INTER_LINEAR)
-
-                    car_shapes[self.Y_min_traffic[vid]:self.Y_max_traffic[vid], self.X_min_traffic[vid]:self.X_max_traffic[vid]] = result
+                    img_X_traffic = np.clip(int( self.traffic_pos[vid][0]*self.resolution_inv + self.image_shape[0]//2), self.map_size*self.resolution_inv, self.image_shape[0] - 1 - self.map_size*self.resolution_inv)
+                    img_Y_traffic = np.clip(int( self.traffic_pos[vid][1]*self.resolution_inv + self.image_shape[1]//2), self.map_size*self.resolution_inv, self.image_shape[0] - 1 - self.map_size*self.resolution_inv)
+                    self.BEV_markers.append((img_X_traffic - self.X_min, img_Y_traffic - self.Y_min, self.traffic_rpy[vid][2]))
 
         # adds marker for controlled car
-        self.Y_min_marker = int(self.img_Y - self.Y_min - self.map_size*self.resolution_inv/16) + marker_size
-        self.Y_max_marker = int(self.img_Y - self.Y_min + self.map_size*self.resolution_inv/16) + marker_size
-
-        self.X_min_marker = int(self.img_X - self.X_min - self.map_size*self.resolution_inv/16) + marker_size
-        self.X_max_marker = int(self.img_X - self.X_min + self.map_size*self.resolution_inv/16) + marker_size
-
-        self.marker_rotation = - self.rpy[2] * 180 / np.pi + 90
-
-        image_center = tuple(np.array(self.overlay_image.shape[1::-1]) / 2)
-        rot_mat = cv2.getRotationMatrix2D(image_center, int(self.marker_rotation), 1.0)
-        result = cv2.warpAffine(self.overlay_image, rot_mat, self.overlay_image.shape[1::-1], flags=cv2.INTER_LINEAR)
-
-        car_shapes[self.Y_min_marker:self.Y_max_marker, self.X_min_marker:self.X_max_marker] = result
-
-        # applies mask
-        car_shapes = car_shapes[marker_size:-marker_size, marker_size:-marker_size]
-        mask = car_shapes.astype(bool)
-
-        self.BEV_color[mask] = cv2.addWeighted(car_shapes, 0.7, self.BEV_color, 0.3, 0)[mask]
+        self.BEV_markers.append((self.img_X - self.X_min, self.img_Y - self.Y_min, self.rpy[2]))
+        if self.overlay_async:
+            self.overlay.submit(self.BEV_color, self.BEV_markers)
 
         self.BEV_center[:2] = self.pos[:2]
         self.BEV_center[2] = self.BEV_heght[self.map_size_px[0], self.map_size_px[1]]
@@ -440,6 +451,20 @@ class beamng_interface():
         self.BEV_normal = self.compute_surface_normals()
 
 
+    def get_BEV_overlay(self):
+        ## BEV_color with the vehicle markers drawn on top. This is only for visualization, so it is kept out of state_poll
+        if self.overlay_async:
+            image = self.overlay.latest()
+            if image is not None:
+                return image
+        return self.overlay.render(self.BEV_color, self.BEV_markers)
+
+    def set_overlay_async(self, overlay_async):
+        ## render the markers for every new BEV on a background thread; get_BEV_overlay then returns the latest rendered frame
+        self.overlay_async = overlay_async
+        if overlay_async:
+            self.overlay.start_thread()
+
     def compute_surface_normals(self):
         # Compute the gradient of the elevation map using the Sobel operator
         BEV_normal = np.copy(self.BEV_heght)
@@ -456,58 +481,18 @@ class beamng_interface():
         normals = cv2.resize(normals, (int(self.map_size_px[0]*2), int(self.map_size_px[0]*2)), cv2.INTER_AREA)
         return normals
 
+    ## these work on a single quaternion [4] or a batch [N, 4], see BeamNGRL.utils.transforms
     def rpy_from_quat(self, quat):
-        y = np.zeros(3)
-        y[0] = np.arctan2((2.0*(quat[2]*quat[3]+quat[0]*quat[1])) , (quat[0]**2 - quat[1]**2 - quat[2]**2 + quat[3]**2))
-        y[1] = -np.arcsin(2.0*(quat[1]*quat[3]-quat[0]*quat[2]));
-        y[2] = np.arctan2((2.0*(quat[1]*quat[2]+quat[0]*quat[3])) , (quat[0]**2 + quat[1]**2 - quat[2]**2 - quat[3]**2))
-        return y
+        return transforms.rpy_from_quat(quat)
 
     def quat_from_rpy(self, rpy):
-        u1 = np.cos(0.5*rpy[0]);
-        u2 = np.cos(0.5*rpy[1]);
-        u3 = np.cos(0.5*rpy[2]);
-        u4 = np.sin(0.5*rpy[0]);
-        u5 = np.sin(0.5*rpy[1]);
-        u6 = np.sin(0.5*rpy[2]);
-        quat = np.zeros(4)
-        quat[0] = u1*u2*u3+u4*u5*u6;
-        quat[1] = u4*u2*u3-u1*u5*u6;
-        quat[2] = u1*u5*u3+u4*u2*u6;
-        quat[3] = u1*u2*u6-u4*u5*u3;
-        return quat
+        return transforms.quat_from_rpy(rpy)
 
     def convert_beamng_to_REP103(self, rot):
-        rot = Quaternion(rot[2], -rot[0], -rot[1], -rot[3])
-        new = Quaternion([0,np.sqrt(2)/2,np.sqrt(2)/2,0])*rot
-        rot = Quaternion(-new[1], -new[3], -new[0], -new[2])
-        return rot
+        return transforms.convert_beamng_to_REP103(rot)
 
     def calc_Transform(self, quat):
-        q00 = quat[0]**2;
-        q11 = quat[1]**2;
-        q22 = quat[2]**2;
-        q33 = quat[3]**2;
-        q01 =  quat[0]*quat[1];
-        q02 =  quat[0]*quat[2];
-        q03 =  quat[0]*quat[3];
-        q12 =  quat[1]*quat[2];
-        q13 =  quat[1]*quat[3];
-        q23 =  quat[2]*quat[3];
-
-        Tbn = np.zeros((3,3)) # transform body->ned
-        Tbn[0][0] = q00 + q11 - q22 - q33;
-        Tbn[1][1] = q00 - q11 + q22 - q33;
-        Tbn[2][2] = q00 - q11 - q22 + q33;
-        Tbn[0][1] = 2*(q12 - q03);
-        Tbn[0][2] = 2*(q13 + q02);
-        Tbn[1][0] = 2*(q12 + q03);
-        Tbn[1][2] = 2*(q23 - q01);
-        Tbn[2][0] = 2*(q13 - q02);
-        Tbn[2][1] = 2*(q23 + q01);
-
-        Tnb = Tbn.transpose(); # transform ned->body
-        return Tnb, Tbn
+        return transforms.calc_Transform(quat)
 
     def increase_brightness(self, img, value=30):
         hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
@@ -523,7 +508,7 @@ class beamng_interface():
 
     def attach_lidar(self, name, pos=(0,0,1.5), dir=(0,-1,0), up=(0,0,1), vertical_resolution=3, vertical_angle=26.9,
                      rays_per_second_per_scan=5000, update_frequency=10, max_distance=10.0):
-        lidar = Lidar(name, self.bng, self.vehicle, pos = pos, dir=dir, up=up,requested_update_time=0.001, is_visualised=False,
+        lidar = self.backend.Lidar(name, self.sensor_bng, self.vehicle, pos = pos, dir=dir, up=up,requested_update_time=0.001, is_visualised=False,
                         vertical_resolution=3, vertical_angle=5, rays_per_second=vertical_resolution*rays_per_second_per_scan, max_distance=max_distance,
                         frequency=update_frequency, update_priority = 0,is_using_shared_memory=(not self.remote))
         self.lidar_list.append(lidar)
@@ -531,7 +516,7 @@ class beamng_interface():
 
     def attach_camera(self, name, pos=(0,-2,1.4), dir=(0,-1,0), up=(0,0,1), field_of_view_y=87, resolution=(640,480),
                       depth=True, color=True, annotation=False, instance=False, near_far_planes=(0.15,60.0), update_frequency = 30, static=False):
-        camera = Camera(name, self.bng, self.vehicle, pos=pos, dir=dir, up=up, field_of_view_y=field_of_view_y, resolution=resolution, update_priority=0,
+        camera = self.backend.Camera(name, self.sensor_bng, self.vehicle, pos=pos, dir=dir, up=up, field_of_view_y=field_of_view_y, resolution=resolution, update_priority=0,
                          is_render_colours=color, is_render_depth=depth, is_render_annotations=annotation,is_visualised=True,
                          requested_update_time=0.01, near_far_planes=near_far_planes, is_using_shared_memory=(not self.remote),
                          is_render_instance=instance,  is_static=static)
@@ -539,13 +524,15 @@ class beamng_interface():
         print("camera attached")
 
     def attach_accelerometer(self, pos=(0, 0.0,0.8)):
-        self.accel = Accelerometer('accel', self.bng, self.vehicle, pos =pos, requested_update_time=0.1, is_using_gravity=False)
+        self.accel = self.backend.Accelerometer('accel', self.bng, self.vehicle, pos =pos, requested_update_time=0.1, is_using_gravity=False)
         print("accel attached")
 
     def camera_poll(self, index):
         ## TODO: this function should "return" the images corresponding to that sensor, not just store them in "self.color/depth"
         try:
             camera_readings = self.camera_list[index].poll()
+            if self.recorder is not None:
+                self.recorder.record_camera(camera_readings)
             color = camera_readings['colour']
             self.color = cv2.cvtColor(color, cv2.COLOR_BGR2RGB)
             self.depth = camera_readings['depth']
@@ -558,10 +545,58 @@ class beamng_interface():
         ## TODO: this function should "return" the images corresponding to that sensor
         try:
             points = self.lidar_list[index].poll()
-            self.lidar_pts = np.copy(points['pointCloud'])
+            if self.recorder is not None:
+                self.recorder.record_lidar(points)
+            self.lidar_pts = points['pointCloud'] ## no copy, process_lidar writes the body frame cloud into its own buffer
         except Exception as e:
             print(traceback.format_exc())
 
+    def start_sensor_threads(self):
+        ## camera and lidar are polled on their own threads at their own fps, state_poll only picks up the latest frames (sensor_handoff)
+        if self.camera:
+            buffers = camera_buffers(self.camera_config["width"], self.camera_config["height"], annotation=self.use_sgmt)
+            self.camera_frame = {key: np.zeros_like(value) for key, value in buffers.items()}
+            self.color = np.zeros_like(buffers['colour'])
+            self.sensor_threads['camera'] = sensor_thread(self.camera_list[0], self.camera_fps, buffers, write_camera, name='camera')
+        if self.lidar:
+            ## room for twice the points a scan should have
+            capacity = int(2*self.lidar_config["channels"]*self.lidar_config["rays_per_second_per_scan"]/self.lidar_fps) + 1
+            buffers = lidar_buffers(capacity)
+            self.lidar_frame = {key: np.zeros_like(value) for key, value in buffers.items()}
+            self.sensor_threads['lidar'] = sensor_thread(self.lidar_list[0], self.lidar_fps, buffers, write_lidar, name='lidar')
+
+    def stop_sensor_threads(self):
+        for thread in self.sensor_threads.values():
+            thread.stop()
+        self.sensor_threads = {}
+
+    def sensor_handoff(self):
+        ## takes the newest frames from the sensor threads if there are new ones. camera_time/lidar_time are the wall clock times of the frames
+        if 'camera' in self.sensor_threads:
+            frame_time = self.sensor_threads['camera'].latest(self.camera_frame)
+            if frame_time is not None:
+                if self.recorder is not None:
+                    self.recorder.record_camera(self.camera_frame)
+                cv2.cvtColor(self.camera_frame['colour'], cv2.COLOR_BGR2RGB, dst=self.color)
+                self.depth = self.camera_frame['depth']
+                if self.use_sgmt:
+                    self.segmt = self.camera_frame['annotation']
+                self.camera_time = frame_time
+        if 'lidar' in self.sensor_threads:
+            frame_time = self.sensor_threads['lidar'].latest(self.lidar_frame)
+            if frame_time is not None:
+                points = self.lidar_frame['points'][:self.lidar_frame['count'][0]]
+                if self.recorder is not None:
+                    self.recorder.record_lidar({'pointCloud': points})
+                self.process_lidar(points)
+                self.lidar_time = frame_time
+
+    def process_lidar(self, points):
+        ## world frame scan -> body frame cloud in lidar_pts, and its voxel centroids inside the BEV window in lidar_voxels
+        ## (a fixed capacity buffer, see lidar_preprocess.py). Both are views of preallocated buffers, valid until the next scan
+        self.lidar_pts = self.lidar_preprocessor.transform(points, self.pos, self.Tnb)
+        self.lidar_voxels = self.lidar_preprocessor.downsample(self.lidar_pts)
+
     def Accelerometer_poll(self):
         ## TODO: this function should return the readings, not store them in a class variable to accomodate multi-agent simulation in the future.
         if not self.use_vel_diff:
@@ -590,40 +625,54 @@ class beamng_interface():
         else:
             self.paused = True ## assume initially paused
 
-    def handle_timing(self):
+    def handle_timing(self, steps=1):
         if(self.lockstep):
             if not self.paused:
                 self.bng.pause()
                 self.paused = True
-            self.bng.step(1)
+            self.bng.step(steps)
         else:
             if self.paused:
                 self.bng.resume()
                 self.paused = False
 
-    def state_poll(self):
+    def start_recording(self, path, camera=False, lidar=False):
+        ## records everything state_poll reads from the simulator until stop_recording, see sensor_recorder.py
+        self.recorder = sensor_recorder(path, camera=camera, lidar=lidar)
+
+    def stop_recording(self):
+        if self.recorder is not None:
+            self.recorder.save()
+            self.recorder = None
+
+    def vehicle_poll(self):
+        ## Polls the data of all sensors attached to the vehicle, and to the traffic cars in the same round trip (see batch_poll)
+        if self.traffic:
+            poll_vehicles([self.vehicle] + list(self.traffic_vehicles.values()))
+        else:
+            self.vehicle.poll_sensors()
+
+    def state_poll(self, steps=1):
         try:
             if(self.state_init == False):
                 assert self.burn_time != 0, "step time can't be 0"
                 self.bng.set_steps_per_second(int(1/self.burn_time)) ## maximum steps per second; we can only guarantee this if running on a high perf. system.
                 self.handle_timing()
                 self.Accelerometer_poll()
-                self.vehicle.poll_sensors() # Polls the data of all sensors attached to the vehicle
+                self.vehicle_poll()
+                if self.recorder is not None:
+                    self.recorder.record_vehicle(self.vehicle)
                 self.state_init = True
                 self.last_quat = self.convert_beamng_to_REP103(self.vehicle.state['rotation'])
                 self.timestamp = self.vehicle.sensors['timer']['time']
                 print("beautiful day, __init__?") ## being cheeky are we?
-
-                # polls traffic vehicles sensors
-                if self.traffic:
-                    for vid, v in self.traffic_vehicles.items():
-                        v.poll_sensors()
             else:
-                self.handle_timing()
+                self.handle_timing(steps)
                 self.Accelerometer_poll()
-                self.vehicle.poll_sensors() # Polls the data of all sensors attached to the vehicle
-                self.timestamp = self.vehicle.sensors['timer']['time'] ## time in seconds since the start of the simulation -- does not care about resets
-                self.dt = max(self.vehicle.sensors['timer']['time'] - self.timestamp, 0.02)
+                self.vehicle_poll()
+                if self.recorder is not None:
+                    self.recorder.record_vehicle(self.vehicle)
+                self.dt = max(self.vehicle.sensors['timer']['time'] - self.timestamp, self.burn_time*steps)
                 self.timestamp = self.vehicle.sensors['timer']['time'] ## time in seconds since the start of the simulation -- does not care about resets
                 self.broken = self.vehicle.sensors['damage']['part_damage'] ## this is useful for reward functions
                 self.pos = np.copy(self.vehicle.state['pos'])
@@ -633,7 +682,7 @@ class beamng_interface():
                 self.Tnb, self.Tbn = self.calc_Transform(self.quat)
                 self.vel_wf = np.copy(self.vel)
                 self.vel = np.matmul(self.Tnb, self.vel)
-                diff = self.quat/self.last_quat
+                diff = transforms.quat_divide(self.quat, self.last_quat)
                 self.last_quat = self.quat
                 self.G = np.array([diff[1]*2/self.dt, diff[2]*2/self.dt, diff[3]*2/self.dt])  # gx gy gz
                 self.G = np.matmul(self.Tnb, self.G)
@@ -649,9 +698,7 @@ class beamng_interface():
                 
                 # gets values for traffic sensors
                 if self.traffic:
-                    self.traffic_timestamp = {}
-                    self.traffic_dt = {}
-                    self.traffic_timestamp = {}
+                    self.traffic_dt = {} ## traffic_timestamp is kept from poll to poll, dt is the time since a car was last polled
                     self.traffic_broken = {}
                     self.traffic_pos = {}
                     self.traffic_vel = {}
@@ -661,39 +708,53 @@ class beamng_interface():
                     self.traffic_Tbn = {}
                     self.traffic_vel_wf = {}
                     self.traffic_vel = {}
+                    traffic_vids = []
                     for vid, v in self.traffic_vehicles.items():
-                        v.poll_sensors() # Polls the data of all sensors attached to the vehicle
                         if ((v.state["pos"][0] - self.pos[0]) ** 2 < self.map_size ** 2 and (v.state["pos"][1] - self.pos[1]) ** 2 < self.map_size ** 2):
-                            self.traffic_timestamp[vid] = v.sensors['timer']['time'] ## time in seconds since the start of the simulation -- does not care about resets
-                            self.traffic_dt[vid] = max(v.sensors['timer']['time'] - self.traffic_timestamp[vid], 0.02)
-                            self.traffic_timestamp[vid] = v.sensors['timer']['time'] ## time in seconds since the start of the simulation -- does not care about resets
+                            traffic_time = v.sensors['timer']['time'] ## time in seconds since the start of the simulation -- does not care about resets
+                            self.traffic_dt[vid] = max(traffic_time - self.traffic_timestamp.get(vid, traffic_time), self.burn_time*steps)
+                            self.traffic_timestamp[vid] = traffic_time
                             self.traffic_broken[vid] = v.sensors['damage']['part_damage'] ## this is useful for reward functions
                             self.traffic_pos[vid] = np.copy(v.state['pos'])
-                            self.traffic_vel[vid] = np.copy(v.state['vel'])
-                            self.traffic_quat[vid] = self.convert_beamng_to_REP103(np.copy(v.state['rotation']))
-                            self.traffic_rpy[vid] = self.rpy_from_quat(self.traffic_quat[vid])
-                            self.traffic_Tnb[vid], self.traffic_Tbn[vid] = self.calc_Transform(self.traffic_quat[vid])
-                            self.traffic_vel_wf[vid] = np.copy(self.traffic_vel[vid])
-                            self.traffic_vel[vid] = np.matmul(self.traffic_Tnb[vid], self.traffic_vel[vid])
+                            self.traffic_vel_wf[vid] = np.copy(v.state['vel'])
+                            traffic_vids.append(vid)
+
+                    if len(traffic_vids):
+                        ## frame conversion for all the traffic in range in one go
+                        traffic_quat = self.convert_beamng_to_REP103(np.array([self.traffic_vehicles[vid].state['rotation'] for vid in traffic_vids]))
+                        traffic_rpy = self.rpy_from_quat(traffic_quat)
+                        traffic_Tnb, traffic_Tbn = self.calc_Transform(traffic_quat)
+                        traffic_vel = np.einsum('nij,nj->ni', traffic_Tnb, np.array([self.traffic_vel_wf[vid] for vid in traffic_vids]))
+                        for i, vid in enumerate(traffic_vids):
+                            self.traffic_quat[vid] = traffic_quat[i]
+                            self.traffic_rpy[vid] = traffic_rpy[i]
+                            self.traffic_Tnb[vid], self.traffic_Tbn[vid] = traffic_Tnb[i], traffic_Tbn[i]
+                            self.traffic_vel[vid] = traffic_vel[i]
 
                 self.gen_BEVmap()
                 if(abs(self.rpy[0]) > np.pi/2 or abs(self.rpy[1]) > np.pi/2):
                     self.flipped_over = True
 
-                if self.camera:
-                    if self.timestamp - self.last_cam_time > 1/self.camera_fps:
-                        self.camera_poll(0)
-                        self.last_cam_time = self.timestamp
-                if self.lidar:
-                    if self.timestamp - self.last_lidar_time > 1/self.lidar_fps:
-                        self.lidar_poll(0)
-                        self.last_lidar_time = self.timestamp
-                        self.lidar_pts -= self.pos
-                        self.lidar_pts = np.matmul(self.lidar_pts, self.Tnb.T)
+                if self.async_mode:
+                    self.sensor_handoff() ## never waits on the simulator, the sensor threads do the polling
+                else:
+                    if self.camera:
+                        if self.timestamp - self.last_cam_time > 1/self.camera_fps:
+                            self.camera_poll(0)
+                            self.last_cam_time = self.timestamp
+                    if self.lidar:
+                        if self.timestamp - self.last_lidar_time > 1/self.lidar_fps:
+                            self.lidar_poll(0)
+                            self.last_lidar_time = self.timestamp
+                            self.process_lidar(self.lidar_pts)
         except Exception:
             print(traceback.format_exc())
 
 
+    def step_n(self, n, action=None, record=False, fill="linear", **ctrl_kwargs):
+        ## advances the simulation by n physics steps and polls once, see frame_skip.py
+        return frame_skip.step_n(self, n, action=action, record=record, fill=fill, **ctrl_kwargs)
+
     def scaled_PID_FF(self, Kp, Ki, Kd, FF_gain, FF, error, error_sigma, error_diff, last_error):
         error_sigma += error * self.dt
         error_sigma = np.clip(error_sigma, -1, 1) ## clip error_sigma to 10%
@@ -734,6 +795,51 @@ class beamng_interface():
         self.last_whspd_error = 0
         self.whspd_error_sigma = 0
         self.whspd_error_diff = 0
+        ## nothing from before the teleport carries over: the filters start over and step_n does not interpolate from the old pose
+        self.clear_state()
+        self.state_poll()
+
+    def clear_state(self):
+        ## forgets what state_poll carries from one poll to the next, so that the next poll starts over like the first one.
+        ## state stays None until the poll after that
+        self.state_init = False
+        self.state = None
+        self.timestamp = 0.0
+        self.dt = self.burn_time
+        self.A = np.array([0,0,9.81])
+        self.last_A = np.copy(self.A)
+        self.vel_wf = np.zeros(3)
+        self.last_vel_wf = np.zeros(3)
+        self.quat = np.array([1,0,0,0])
+        self.Tnb, self.Tbn = self.calc_Transform(self.quat)
+        self.last_quat = None
+        self.last_cam_time = 0
+        self.last_lidar_time = 0
+        self.camera_time = None
+        self.lidar_time = None
+        self.traffic_timestamp = {}
+        for thread in self.sensor_threads.values():
+            thread.skip() ## frames taken before the reset
+
+    def reinit(self, start_pos=None, start_quat=None):
+        ## readies a loaded scenario for a new run, as session_pool.py does when it hands out a running session:
+        ## the car is put on the ground at start_pos like in load_scenario, and nothing polled, filtered or recorded
+        ## during the previous run carries over
+        self.stop_recording()
+        if start_pos is not None:
+            self.start_pos = (start_pos[0], start_pos[1], self.get_height(start_pos))
+        if start_quat is not None:
+            self.start_quat = start_quat
+        self.reset(start_pos=self.start_pos, start_quat=self.start_quat)
+
+    def close(self):
+        ## stops the sensor threads and closes the connections to the simulator
+        self.stop_recording()
+        self.stop_sensor_threads()
+        sensor_bng = getattr(self, 'sensor_bng', None)
+        if sensor_bng is not None and sensor_bng is not self.bng:
+            sensor_bng.close()
+        self.bng.close()
 
 
     def step(self, action):
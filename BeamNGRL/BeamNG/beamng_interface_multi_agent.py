@@ -11,6 +11,10 @@ from sys import platform
 
 import BeamNGRL
 from BeamNGRL.utils.visualisation import Vis
+from BeamNGRL.BeamNG.map_server import get_map_layers, IMAGE_RESOLUTION
+from BeamNGRL.BeamNG.bev_overlay import bev_overlay
+from BeamNGRL.BeamNG.bev_batch import batch_bev_extractor
+from BeamNGRL.BeamNG.batch_poll import vehicle_batch_poller
 from beamngpy import BeamNGpy, Scenario, Vehicle
 from beamngpy.sensors import Lidar, Camera, Electrics, Accelerometer, Timer, Damage
 from BeamNGRL.BeamNG.agent import *
@@ -48,7 +52,8 @@ def get_beamng_default(
 
     bng = beamng_interface_multi_agent(BeamNG_path=beamng_path, remote=remote, host_IP=host_IP)
     bng.set_map_attributes(
-        map_size=map_config["map_size"], resolution=map_config["map_res"], elevation_range=map_config["elevation_range"], path_to_maps=path_to_maps, rotate=map_rotate, map_name=map_config["map_name"]
+        map_size=map_config["map_size"], resolution=map_config["map_res"], elevation_range=map_config["elevation_range"], path_to_maps=path_to_maps, rotate=map_rotate, map_name=map_config["map_name"],
+        shared_map=map_config.get("shared_map", False)
     )
     bng.load_scenario(
         scenario_name=map_config["map_name"], agents_config=agents_config,
@@ -88,7 +93,8 @@ def get_beamng_nobeam(
 
     bng = beamng_interface_multi_agent(BeamNG_path=beamng_path, use_beamng=False, dyn=Dynamics)
     bng.set_map_attributes(
-        map_size=map_config["map_size"], resolution=map_config["map_res"], elevation_range=map_config["elevation_range"], path_to_maps=path_to_maps, rotate=map_rotate
+        map_size=map_config["map_size"], resolution=map_config["map_res"], elevation_range=map_config["elevation_range"], path_to_maps=path_to_maps, rotate=map_rotate,
+        shared_map=map_config.get("shared_map", False)
     )
     bng.load_scenario(
         scenario_name=map_config["map_name"], agents_config=agents_config)
@@ -101,11 +107,14 @@ class beamng_interface_multi_agent():
     def __init__(self, BeamNG_path=BNG_HOME, host='localhost', port=64256, use_beamng=True, dyn=None, remote=False, host_IP=None, shell_mode=False, HITL_mode=False, async_mode=False):
         self.lockstep   = False
         self.BEV_center = np.zeros(3)
+        self.BEV_markers = []
+        self.overlay_async = False
         self.elev_map_hgt = 2.0
         self.paused = False
         self.remote = remote
 
         self.agents = {}
+        self.bev_extractor = None
 
         self.use_beamng = use_beamng
         if self.use_beamng:
@@ -163,33 +172,33 @@ class beamng_interface_multi_agent():
 
         for vid, agent in self.agents.items():
             agent.load_vehicle_sensors(camera_config=camera_config, lidar_config=lidar_config, accel_config=accel_config, vesc_config=vesc_config)
+        self.poller = vehicle_batch_poller([agent.vehicle for agent in self.agents.values()],
+                                           steering_max=[agent.steering_max for agent in self.agents.values()])
+        self.poller.update() ## the agents have just been polled, this sets the previous orientation and velocity
 
         self.bng.start_traffic(self.agents[vid].vehicle for vid in self.traffic_vids)
         self.bng.switch_vehicle(self.agents[self.ego_vid].vehicle)
 
         
-    def set_map_attributes(self, map_size = 16, resolution = 0.25, path_to_maps=DATA_PATH.__str__(), rotate=False, elevation_range=2.0, map_name="small_island"):
-        self.elevation_map_full = np.load(path_to_maps + f'/map_data/{map_name}/elevation_map.npy', allow_pickle=True)
-        self.color_map_full = cv2.imread(path_to_maps + f'/map_data/{map_name}/color_map.png')
-        self.segmt_map_full = cv2.imread(path_to_maps + f'/map_data/{map_name}/segmt_map.png')
-        self.path_map_full  = cv2.imread(path_to_maps + f'/map_data/{map_name}/paths.png')
+    def set_map_attributes(self, map_size = 16, resolution = 0.25, path_to_maps=DATA_PATH.__str__(), rotate=False, elevation_range=2.0, map_name="small_island", shared_map=False):
+        ## with shared_map the (resized) layers are loaded once per host and attached read-only from shared memory
+        layers = get_map_layers(map_name=map_name, resolution=resolution, path_to_maps=path_to_maps, shared=shared_map)
+        self.map_layers = layers
+        self.bev_extractor = None ## built lazily by gen_BEVmap_batch
+        self.elevation_map_full = layers['elevation']
+        self.color_map_full = layers['color']
+        self.segmt_map_full = layers['segmt']
+        self.path_map_full  = layers['path']
+        self.inpaint_mask   = layers['inpaint']
+        self.path_distance_map_full = layers['path_distance'] ## signed distance to the trails in meters, float16
         self.image_shape    = self.color_map_full.shape
-        self.image_resolution = 0.1  # this is the original meters per pixel resolution of the image
+        self.image_resolution = IMAGE_RESOLUTION  # this is the original meters per pixel resolution of the image
         self.resolution     = resolution  # meters per pixel of the target map
         self.resolution_inv = 1/self.resolution  # pixels per meter
         self.map_size       = map_size/2  # 16 x 16 m grid around the car by default
         self.rotate = rotate
         self.elev_map_hgt = elevation_range
 
-        if(self.image_resolution != self.resolution):
-            scale_factor = self.image_resolution/self.resolution
-            new_shape = np.array(np.array(self.image_shape) * scale_factor, dtype=np.int32)
-            self.elevation_map_full = cv2.resize(self.elevation_map_full, (new_shape[0], new_shape[1]), cv2.INTER_AREA)
-            self.color_map_full = cv2.resize(self.color_map_full, (new_shape[0], new_shape[1]), cv2.INTER_AREA)
-            self.segmt_map_full = cv2.resize(self.segmt_map_full, (new_shape[0], new_shape[1]), cv2.INTER_AREA)
-            self.path_map_full  = cv2.resize(self.path_map_full, (new_shape[0], new_shape[1]), cv2.INTER_AREA)
-            self.image_shape    = (new_shape[0], new_shape[1])
-
         self.map_size_px = int(self.map_size*self.resolution_inv)
         self.map_size_px = (self.map_size_px, self.map_size_px)
         self.mask_size   = (2 * self.map_size_px[0], 2 * self.map_size_px[1])
@@ -197,15 +206,9 @@ class beamng_interface_multi_agent():
         self.mask        = cv2.circle(mask, self.map_size_px, self.map_size_px[0], 255, thickness=-1)
         self.mask_center = (self.map_size_px[0], self.map_size_px[1])
 
-        self.inpaint_mask = np.zeros_like(self.elevation_map_full, dtype=np.uint8)
-        index = np.where(self.elevation_map_full == 0)
-        self.inpaint_mask[index] = 255
-
-        # creates marker image 
+        # marker sprites for get_BEV_overlay
         self.marker_width = int(self.map_size*self.resolution_inv/8)
-        self.overlay_image = np.zeros([self.marker_width, self.marker_width, 3])
-        cv2.rectangle(self.overlay_image, (int(self.marker_width / 3), 0), (int(self.marker_width * 2 / 3), self.marker_width), (255, 255, 255), -1) 
-        cv2.circle(self.overlay_image, (int(self.marker_width / 2), int(self.marker_width / 4)), int(self.marker_width / 4), (255, 255, 255), -1)
+        self.overlay = bev_overlay(self.marker_width)
 
     def get_map_bf_no_rp(self, map_img, gen_mask=False, inpaint_mask = None):
         ch = len(map_img.shape)
@@ -213,6 +216,8 @@ class beamng_interface_multi_agent():
             BEV = map_img[self.Y_min:self.Y_max, self.X_min:self.X_max, :]
         else:
             BEV = map_img[self.Y_min:self.Y_max, self.X_min:self.X_max]
+        if BEV.dtype == np.float16:
+            BEV = BEV.astype(np.float32) ## cv2 doesn't do float16, and the crop is small
 
         if inpaint_mask is not None:
             BEV = cv2.inpaint(BEV, inpaint_mask, ch, cv2.INPAINT_TELEA)
@@ -262,47 +267,21 @@ class beamng_interface_multi_agent():
         self.BEV_color = self.get_map_bf_no_rp(self.color_map_full, inpaint_mask=local_inpaint)  # crops circle, rotates into body frame
         self.BEV_heght = self.get_map_bf_no_rp(self.elevation_map_full, inpaint_mask=local_inpaint)
         self.BEV_segmt = self.get_map_bf_no_rp(self.segmt_map_full, inpaint_mask=local_inpaint)
-        self.BEV_path  = self.get_map_bf_no_rp(self.path_map_full)
-
-
-        # car overlay on map
-        marker_size = int(self.map_size*self.resolution_inv/16)
-        car_shapes = np.zeros_like(self.BEV_color, np.uint8)
-        car_shapes = np.pad(car_shapes, ((marker_size, marker_size), (marker_size, marker_size), (0, 0)), 'edge')
+        self.BEV_path  = np.copy(self.get_map_bf_no_rp(self.path_map_full)) ## the full map may be a read-only shared view
+        self.BEV_path_distance = self.get_map_bf_no_rp(self.path_distance_map_full)
 
-        self.img_X_agents = {} 
-        self.img_Y_agents = {}
 
-        self.Y_min_agents = {}
-        self.Y_max_agents = {}
-
-        self.X_min_agents = {}
-        self.X_max_agents = {}
+        # vehicle markers as (X, Y, yaw) in BEV pixels, drawn on demand by get_BEV_overlay
+        self.BEV_markers = []
         for vid, agent in self.agents.items():
-            self.img_X_agents[vid] = np.clip(int( agent.pos[0]*self.resolution_inv + self.image_shape[0]//2), self.map_size*self.resolution_inv, self.image_shape[0] - 1 - self.map_size*self.resolution_inv)
-            self.img_Y_agents[vid] = np.clip(int( agent.pos[1]*self.resolution_inv + self.image_shape[1]//2), self.map_size*self.resolution_inv, self.image_shape[0] - 1 - self.map_size*self.resolution_inv)
-
-            if ((self.img_X_agents[vid] - self.img_X) ** 2 < (self.map_size*self.resolution_inv) ** 2 and 
-                (self.img_Y_agents[vid] - self.img_Y) ** 2 < (self.map_size*self.resolution_inv) ** 2):
-                self.Y_min_agents[vid] = int(self.img_Y_agents[vid] - self.Y_min - marker_size) + marker_size
-                self.Y_max_agents[vid] = int(self.img_Y_agents[vid] - self.Y_min + marker_size) + marker_size
-
-                self.X_min_agents[vid] = int(self.img_X_agents[vid] - self.X_min - marker_size) + marker_size
-                self.X_max_agents[vid] = int(self.img_X_agents[vid] - self.X_min + marker_size) + marker_size
-
-                agent_marker_rotation = - agent.rpy[2] * 180 / np.pi + 90
+            img_X_agent = np.clip(int( agent.pos[0]*self.resolution_inv + self.image_shape[0]//2), self.map_size*self.resolution_inv, self.image_shape[0] - 1 - self.map_size*self.resolution_inv)
+            img_Y_agent = np.clip(int( agent.pos[1]*self.resolution_inv + self.image_shape[1]//2), self.map_size*self.resolution_inv, self.image_shape[0] - 1 - self.map_size*self.resolution_inv)
 
-                image_center = tuple(np.array(self.overlay_image.shape[1::-1]) / 2)
-                rot_mat = cv2.getRotationMatrix2D(image_center, int(agent_marker_rotation), 1.0)
-                result = cv2.warpAffine(self.overlay_image, rot_mat, self.overlay_image.shape[1::-1], flags=cv2.INTER_LINEAR)
-
-                car_shapes[self.Y_min_agents[vid]:self.Y_max_agents[vid], self.X_min_agents[vid]:self.X_max_agents[vid]] = result
-
-        # applies mask
-        car_shapes = car_shapes[marker_size:-marker_size, marker_size:-marker_size]
-        mask = car_shapes.astype(bool)
-
-        self.BEV_color[mask] = cv2.addWeighted(car_shapes, 0.7, self.BEV_color, 0.3, 0)[mask]
+            if ((img_X_agent - self.img_X) ** 2 < (self.map_size*self.resolution_inv) ** 2 and 
+                (img_Y_agent - self.img_Y) ** 2 < (self.map_size*self.resolution_inv) ** 2):
+                self.BEV_markers.append((img_X_agent - self.X_min, img_Y_agent - self.Y_min, agent.rpy[2]))
+        if self.overlay_async:
+            self.overlay.submit(self.BEV_color, self.BEV_markers)
 
         self.BEV_center[:2] = self.agents[self.ego_vid].pos[:2]
         self.BEV_center[2] = self.BEV_heght[self.map_size_px[0], self.map_size_px[1]]
@@ -312,6 +291,20 @@ class beamng_interface_multi_agent():
         self.BEV_normal = self.compute_surface_normals()
 
 
+    def gen_BEVmap_batch(self, vids=None):
+        ## BEV maps for all (or the given) agents in one pass, stacked along the first dim in the order of vids.
+        ## results are in self.BEV_batch; see batch_bev_extractor for how these differ from gen_BEVmap
+        if self.bev_extractor is None:
+            self.bev_extractor = batch_bev_extractor(self.map_layers, map_size=self.map_size*2, resolution=self.resolution,
+                                                     elevation_range=self.elev_map_hgt, rotate=self.rotate)
+        if vids is None:
+            vids = list(self.agents.keys())
+        pos = np.stack([self.agents[vid].pos for vid in vids])
+        yaw = np.array([self.agents[vid].rpy[2] for vid in vids])
+        self.BEV_batch = self.bev_extractor.extract(pos, yaw)
+        self.BEV_batch_vids = vids
+        return self.BEV_batch
+
     def increase_brightness(self, img, value=30):
         hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
         h, s, v = cv2.split(hsv)
@@ -324,6 +317,20 @@ class beamng_interface_multi_agent():
         img = cv2.cvtColor(final_hsv, cv2.COLOR_HSV2BGR)
         return img
 
+    def get_BEV_overlay(self):
+        ## BEV_color with the vehicle markers drawn on top. This is only for visualization, so it is kept out of state_poll
+        if self.overlay_async:
+            image = self.overlay.latest()
+            if image is not None:
+                return image
+        return self.overlay.render(self.BEV_color, self.BEV_markers)
+
+    def set_overlay_async(self, overlay_async):
+        ## render the markers for every new BEV on a background thread; get_BEV_overlay then returns the latest rendered frame
+        self.overlay_async = overlay_async
+        if overlay_async:
+            self.overlay.start_thread()
+
     def compute_surface_normals(self):
         # Compute the gradient of the elevation map using the Sobel operator
         BEV_normal = np.copy(self.BEV_heght)
@@ -370,8 +377,10 @@ class beamng_interface_multi_agent():
                 self.bng.resume()
                 self.paused = False
 
-        for vid, agent in self.agents.items():
-            agent.state_poll()
+        ## all the cars are polled together and converted in one pass, see batch_poll
+        self.poller.poll()
+        for i, agent in enumerate(self.agents.values()):
+            agent.set_polled_state(self.poller, i)
 
         self.gen_BEVmap()
 
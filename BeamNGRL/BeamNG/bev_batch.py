@@ -0,0 +1,109 @@
+import cv2
+import numpy as np
+
+
+class batch_bev_extractor():
+    '''
+    Extracts BEV maps for N vehicles in one pass.
+    Everything that gen_BEVmap recomputes per frame and per vehicle (inpainting, surface normals) is computed
+    once on the full map here, so a frame only costs a batched gather from the global layers:
+        color/segmt/path: [N, H, W, 3], elev/path_distance: [N, H, W], normal: [N, H, W, 3], center: [N, 3]
+    Differences w.r.t. gen_BEVmap: rotation uses nearest-neighbour sampling instead of bilinear,
+    the normals come from the full-res map instead of a 4x upsampled crop and are float32, and no markers are drawn.
+    '''
+    def __init__(self, layers, map_size=16, resolution=0.25, elevation_range=2.0, rotate=False):
+        self.resolution_inv = 1/resolution  # pixels per meter
+        self.map_size = map_size/2  # 16 x 16 m grid around the car by default
+        self.map_size_px = int(self.map_size*self.resolution_inv)
+        self.elev_map_hgt = elevation_range
+        self.rotate = rotate
+
+        ## inpaint the full map once instead of inpainting every crop
+        inpaint = layers['inpaint']
+        self.elevation_map_full = cv2.inpaint(layers['elevation'], inpaint, 2, cv2.INPAINT_TELEA)
+        self.color_map_full = cv2.inpaint(layers['color'], inpaint, 3, cv2.INPAINT_TELEA)
+        self.segmt_map_full = cv2.inpaint(layers['segmt'], inpaint, 3, cv2.INPAINT_TELEA)
+        self.path_map_full  = layers['path']
+        self.path_distance_map_full = layers['path_distance']
+        self.normal_map_full = self.compute_surface_normals(self.elevation_map_full)
+        self.image_shape = self.color_map_full.shape[:2]
+
+        ## pixel offsets of every BEV cell w.r.t. the vehicle, shared by all vehicles
+        offsets = np.arange(-self.map_size_px, self.map_size_px)
+        self.dY, self.dX = np.meshgrid(offsets, offsets, indexing='ij')
+        self.mask = (self.dX**2 + self.dY**2) <= self.map_size_px**2
+
+    def compute_surface_normals(self, elevation):
+        ## same operator as gen_BEVmap's normals, but on the full map. gen_BEVmap upsamples the crop 4x before the sobel,
+        ## which scales the gradients down by 4, so we do the same here.
+        elevation = cv2.GaussianBlur(elevation.astype(np.float32), (3,3), 0)
+        normal_x = -cv2.Sobel(elevation, cv2.CV_32F, 1, 0, ksize=3)/4
+        normal_y = -cv2.Sobel(elevation, cv2.CV_32F, 0, 1, ksize=3)/4
+        normal_z = np.ones_like(elevation)
+        normals = np.stack([normal_x, normal_y, normal_z], axis=-1)
+        normals /= np.linalg.norm(normals, axis=-1, keepdims=True)
+        return normals
+
+    def get_indices(self, pos, yaw):
+        ## same centering and clipping as gen_BEVmap, for all vehicles at once
+        lo = self.map_size_px
+        img_X = np.clip((pos[:, 0]*self.resolution_inv + self.image_shape[0]//2).astype(np.int64), lo, self.image_shape[0] - 1 - lo)
+        img_Y = np.clip((pos[:, 1]*self.resolution_inv + self.image_shape[1]//2).astype(np.int64), lo, self.image_shape[0] - 1 - lo)
+        if self.rotate:
+            ## inverse of cv2.getRotationMatrix2D(center, yaw, 1): for every output cell, find the source cell
+            ct = np.cos(yaw)[:, None, None]
+            st = np.sin(yaw)[:, None, None]
+            dX = np.rint(ct*self.dX - st*self.dY).astype(np.int64)
+            dY = np.rint(st*self.dX + ct*self.dY).astype(np.int64)
+        else:
+            dX = self.dX[None]
+            dY = self.dY[None]
+        rows = np.clip(img_Y[:, None, None] + dY, 0, self.image_shape[0] - 1)
+        cols = np.clip(img_X[:, None, None] + dX, 0, self.image_shape[1] - 1)
+        return rows*self.image_shape[1] + cols
+
+    def extract(self, pos, yaw):
+        pos = np.asarray(pos, dtype=np.float64).reshape((-1, 3))
+        yaw = np.asarray(yaw, dtype=np.float64).reshape(-1)
+        N = pos.shape[0]
+        index = self.get_indices(pos, yaw)
+        if index.shape[0] != N:
+            index = np.broadcast_to(index, (N,) + index.shape[1:])
+
+        BEV_color = self.color_map_full.reshape((-1, 3))[index]
+        BEV_segmt = self.segmt_map_full.reshape((-1, 3))[index]
+        BEV_path  = self.path_map_full.reshape((-1, 3))[index]
+        BEV_path_distance = self.path_distance_map_full.reshape(-1)[index].astype(np.float32)
+        BEV_heght = self.elevation_map_full.reshape(-1)[index]
+        BEV_normal = self.normal_map_full.reshape((-1, 3))[index]
+
+        if self.rotate:
+            outside = ~self.mask
+            BEV_color[:, outside] = 0
+            BEV_segmt[:, outside] = 0
+            BEV_path[:, outside] = 0
+            BEV_path_distance[:, outside] = 0
+            BEV_heght[:, outside] = 0
+            ## the normals have to be rotated along with the map
+            ct = np.cos(yaw)[:, None, None]
+            st = np.sin(yaw)[:, None, None]
+            normal_x = ct*BEV_normal[..., 0] + st*BEV_normal[..., 1]
+            normal_y = -st*BEV_normal[..., 0] + ct*BEV_normal[..., 1]
+            BEV_normal[..., 0] = normal_x
+            BEV_normal[..., 1] = normal_y
+
+        BEV_center = np.copy(pos)
+        BEV_center[:, 2] = BEV_heght[:, self.map_size_px, self.map_size_px]
+        BEV_heght -= BEV_center[:, 2, None, None].astype(BEV_heght.dtype)
+        BEV_heght = np.clip(BEV_heght, -self.elev_map_hgt, self.elev_map_hgt)
+        BEV_heght = np.nan_to_num(BEV_heght, copy=False, nan=0.0, posinf=self.elev_map_hgt, neginf=-self.elev_map_hgt)
+
+        return {
+            'color': BEV_color,
+            'elev': BEV_heght,
+            'segmt': BEV_segmt,
+            'path': BEV_path,
+            'path_distance': BEV_path_distance,
+            'normal': BEV_normal,
+            'center': BEV_center,
+        }
@@ -0,0 +1,85 @@
+import cv2
+import numpy as np
+
+import threading
+
+
+class bev_overlay():
+    '''
+    Draws vehicle markers on top of a BEV color map. This is purely cosmetic, so the interfaces only record
+    where the markers go (in BEV pixels) and leave the drawing to whoever wants to look at it, either on demand
+    through render() or on a visualization thread (start_thread/submit/latest).
+    The rotated marker sprites are precomputed for every heading bin.
+    '''
+    def __init__(self, marker_width, heading_bins=360, alpha=0.7):
+        self.marker_width = marker_width
+        self.heading_bins = heading_bins
+        self.alpha = alpha
+
+        overlay_image = np.zeros([self.marker_width, self.marker_width, 3])
+        cv2.rectangle(overlay_image, (int(self.marker_width / 3), 0), (int(self.marker_width * 2 / 3), self.marker_width), (255, 255, 255), -1)
+        cv2.circle(overlay_image, (int(self.marker_width / 2), int(self.marker_width / 4)), int(self.marker_width / 4), (255, 255, 255), -1)
+        self.overlay_image = overlay_image
+
+        image_center = tuple(np.array(overlay_image.shape[1::-1]) / 2)
+        self.sprites = np.zeros((heading_bins, marker_width, marker_width, 3), dtype=np.uint8)
+        for i in range(heading_bins):
+            rot_mat = cv2.getRotationMatrix2D(image_center, i * 360 / heading_bins, 1.0)
+            self.sprites[i] = cv2.warpAffine(overlay_image, rot_mat, overlay_image.shape[1::-1], flags=cv2.INTER_LINEAR)
+
+        self.thread = None
+        self.lock = threading.Condition()
+        self.pending = None
+        self.image = None
+
+    def get_sprite(self, yaw):
+        ## markers point along the heading; 0 yaw (east) is "up" in the sprite
+        rotation = int(- yaw * 180 / np.pi + 90)
+        return self.sprites[int((rotation % 360) * self.heading_bins / 360) % self.heading_bins]
+
+    def render(self, BEV_color, markers):
+        '''
+        BEV_color: HxWx3 uint8 image, left untouched.
+        markers: iterable of (X, Y, yaw) with X, Y the marker center in BEV pixels and yaw in radians.
+        '''
+        car_shapes = np.zeros_like(BEV_color, np.uint8)
+        h, w = car_shapes.shape[:2]
+        for X, Y, yaw in markers:
+            sprite = self.get_sprite(yaw)
+            y0 = int(Y) - self.marker_width // 2
+            x0 = int(X) - self.marker_width // 2
+            ## clip the sprite at the map edges
+            sy0, sx0 = max(0, -y0), max(0, -x0)
+            sy1 = self.marker_width - max(0, y0 + self.marker_width - h)
+            sx1 = self.marker_width - max(0, x0 + self.marker_width - w)
+            if sy0 >= sy1 or sx0 >= sx1:
+                continue
+            car_shapes[y0 + sy0:y0 + sy1, x0 + sx0:x0 + sx1] = sprite[sy0:sy1, sx0:sx1]
+
+        image = np.copy(BEV_color)
+        mask = car_shapes.astype(bool)
+        image[mask] = cv2.addWeighted(car_shapes, self.alpha, image, 1 - self.alpha, 0)[mask]
+        return image
+
+    def start_thread(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.render_loop, daemon=True)
+            self.thread.start()
+
+    def submit(self, BEV_color, markers):
+        ## only the latest frame is kept, older frames that were not rendered yet are dropped
+        with self.lock:
+            self.pending = (BEV_color, list(markers))
+            self.lock.notify()
+
+    def latest(self):
+        return self.image
+
+    def render_loop(self):
+        while True:
+            with self.lock:
+                while self.pending is None:
+                    self.lock.wait()
+                BEV_color, markers = self.pending
+                self.pending = None
+            self.image = self.render(BEV_color, markers)
@@ -0,0 +1,291 @@
+import numpy as np
+
+import time
+from types import SimpleNamespace
+
+from BeamNGRL.utils import transforms
+from BeamNGRL.BeamNG.sensor_recorder import sensor_recording
+
+'''
+Stand-in for the parts of beamngpy that the interfaces use (BeamNGpy, Scenario, Vehicle and the sensors), so that the
+interface overhead (state_poll, send_ctrl, gen_BEVmap, ...) can be measured without a running simulator.
+Select it with beamng_interface(fake_beamng=True) or fake_beamng={...options...}, options being the BeamNGpy kwargs below.
+Vehicles either follow a kinematic bicycle driven by the controls they receive (default), replay recorded states,
+or replay a sensor_recorder recording frame by frame.
+Every request to the "simulator" sleeps for `latency` seconds to mimic the round trip to BeamNG.
+'''
+
+class BeamNGpy():
+    '''
+    latency: seconds added to every request.
+    states: recorded states to replay, [T, 17] REP103 states as the interface produces them (or a path to a .npy of those).
+    record_dt: time between two recorded states.
+    recording: path to a sensor_recorder file. Every poll_sensors hands out the next recorded frame (looping at the end),
+               regardless of the controls and the simulation time, so the interface runs through it as fast as it can.
+    '''
+    def __init__(self, host='localhost', port=64256, home=None, user=None, remote=False, latency=0.0, states=None, record_dt=0.02, recording=None, **kwargs):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        if type(states) == str:
+            states = np.load(states)
+        self.states = None if states is None else np.asarray(states, dtype=np.float64)
+        self.record_dt = record_dt
+        self.recording = None if recording is None else sensor_recording(recording)
+        self.dt = 0.02
+        self.time = 0.0
+        self.paused = False
+        self.last_wall = time.time()
+        self.spawned = {}
+        self.requests = 0
+        self.closed = False
+        ## the api namespaces of newer beamngpy versions (bng.scenario.load(...), bng.vehicles.get_states(...), ...)
+        self.scenario = SimpleNamespace(load=self.load_scenario, start=self.start_scenario)
+        self.traffic = SimpleNamespace(start=self.start_traffic)
+        self.vehicles = SimpleNamespace(switch=self.switch_vehicle, get_states=self.get_vehicle_states)
+
+    def request(self):
+        ## every call that would go over the socket to the simulator
+        self.requests += 1
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+    def open(self, launch=True, deploy=True, **kwargs):
+        self.request()
+
+    def close(self):
+        self.request()
+        self.closed = True
+
+    def set_tod(self, tod):
+        self.request()
+
+    def set_deterministic(self):
+        self.request()
+
+    def hide_hud(self):
+        self.request()
+
+    def set_steps_per_second(self, sps):
+        self.request()
+        self.dt = 1/sps
+
+    def load_scenario(self, scenario):
+        self.request()
+        for vehicle in scenario.vehicles:
+            vehicle.bng = self
+            self.spawned[vehicle.vid] = vehicle
+
+    def start_scenario(self):
+        self.request()
+        self.last_wall = time.time()
+
+    def start_traffic(self, participants):
+        self.request()
+
+    def switch_vehicle(self, vehicle):
+        self.request()
+
+    def get_vehicle_states(self, vids):
+        ## positions and velocities of any number of vehicles in one request
+        self.request()
+        self.advance_realtime()
+        return {vid: dict(self.spawned[vid].state) for vid in vids}
+
+    def pause(self):
+        self.request()
+        self.advance_realtime()
+        self.paused = True
+
+    def resume(self):
+        self.request()
+        self.paused = False
+        self.last_wall = time.time()
+
+    def step(self, count, wait=True):
+        self.request()
+        self.advance(count)
+
+    def advance(self, count):
+        for _ in range(count):
+            self.time += self.dt
+            for vehicle in self.spawned.values():
+                vehicle.advance(self.dt)
+
+    def advance_realtime(self):
+        ## when not paused the simulation runs in real time, so we catch up with the wall clock on every request
+        if self.paused:
+            return
+        now = time.time()
+        count = int((now - self.last_wall)/self.dt)
+        self.last_wall += count*self.dt
+        self.advance(count)
+
+
+class Scenario():
+    def __init__(self, level, name, **kwargs):
+        self.level = level
+        self.name = name
+        self.vehicles = []
+
+    def add_vehicle(self, vehicle, pos=(0, 0, 0), rot_quat=(0, 0, 0, 1), **kwargs):
+        vehicle.set_pose(pos, rot_quat)
+        self.vehicles.append(vehicle)
+
+    def make(self, bng):
+        bng.request()
+
+
+class Vehicle():
+    WHEELBASE = 2.6
+    STEERING_MAX = 260.0 ## steering wheel degrees at full lock, same as the interface's default steering_max
+    STEER_ANGLE_MAX = 0.5 ## radians at the wheels at full lock
+
+    def __init__(self, vid, model=None, partConfig=None, **kwargs):
+        self.vid = vid
+        self.model = model
+        self.bng = None
+        self.attached = {}
+        self.sensors = {}
+        self.state = {}
+        self.throttle = 0.0
+        self.brake = 0.0
+        self.steering = 0.0
+        self.speed = 0.0
+        self.time = 0.0
+        self.frame = 0
+        self.set_pose((0, 0, 0), (0, 0, 0, 1))
+
+    def set_pose(self, pos, rot_quat):
+        self.pos = np.array(pos, dtype=np.float64)
+        self.rpy = transforms.rpy_from_quat(transforms.convert_beamng_to_REP103(rot_quat))
+        self.vel = np.zeros(3)
+        self.speed = 0.0
+        self.update_state()
+
+    def update_state(self):
+        quat = transforms.quat_from_rpy(self.rpy)
+        self.state = {
+            'pos': tuple(self.pos),
+            'vel': tuple(self.vel),
+            'rotation': tuple(transforms.convert_REP103_to_beamng(quat)),
+        }
+
+    def advance(self, dt):
+        self.time += dt
+        states = self.bng.states if self.bng is not None else None
+        if states is not None:
+            ## replay: the recorded states are REP103, position in the world frame and velocity in the body frame
+            state = states[int(self.time/self.bng.record_dt + 1e-6) % len(states)]
+            self.pos = np.copy(state[:3])
+            self.rpy = np.copy(state[3:6])
+            _, Tbn = transforms.calc_Transform(transforms.quat_from_rpy(self.rpy))
+            self.vel = np.matmul(Tbn, state[6:9])
+            self.speed = state[6]
+            if len(state) >= 17:
+                self.steering = -state[15]
+                self.throttle = max(state[16], 0)
+                self.brake = max(-state[16], 0)
+        else:
+            ## kinematic bicycle on a flat plane
+            accel = 8.0*self.throttle - 12.0*self.brake*np.sign(self.speed) - 0.3*self.speed
+            self.speed += accel*dt
+            yaw_rate = self.speed*np.tan(-self.steering*self.STEER_ANGLE_MAX)/self.WHEELBASE
+            self.rpy[2] = (self.rpy[2] + yaw_rate*dt + np.pi) % (2*np.pi) - np.pi
+            self.vel = self.speed*np.array([np.cos(self.rpy[2]), np.sin(self.rpy[2]), 0.0])
+            self.pos += self.vel*dt
+        self.update_state()
+
+    def attach_sensor(self, name, sensor):
+        self.attached[name] = sensor
+
+    def poll_sensors(self):
+        if self.bng is not None:
+            self.bng.request()
+            if self.bng.recording is not None:
+                self.state, sensors = self.bng.recording.frame(self.frame)
+                self.sensors = {name: sensors[name] for name in self.attached if name in sensors}
+                self.frame += 1
+                return
+            self.bng.advance_realtime()
+        for name, sensor in self.attached.items():
+            self.sensors[name] = sensor.read(self)
+
+    def control(self, throttle=None, brake=None, steering=None, **kwargs):
+        if self.bng is not None:
+            self.bng.request()
+        if throttle is not None:
+            self.throttle = throttle
+        if brake is not None:
+            self.brake = brake
+        if steering is not None:
+            self.steering = steering
+
+    def teleport(self, pos, rot_quat=None, reset=True):
+        if self.bng is not None:
+            self.bng.request()
+        if rot_quat is None:
+            rot_quat = self.state['rotation']
+        self.set_pose(pos, rot_quat)
+
+
+class Electrics():
+    def read(self, vehicle):
+        return {
+            'wheelspeed': abs(vehicle.speed),
+            'gear_index': -1 if vehicle.speed < 0 else 1,
+            'steering': -vehicle.steering*Vehicle.STEERING_MAX,
+            'throttle': vehicle.throttle,
+            'brake': vehicle.brake,
+        }
+
+class Timer():
+    def read(self, vehicle):
+        return {'time': vehicle.time}
+
+class Damage():
+    def read(self, vehicle):
+        return {'part_damage': {}}
+
+
+class Accelerometer():
+    def __init__(self, name, bng, vehicle, **kwargs):
+        self.bng = bng
+    def poll(self):
+        ## empty reading, the interface then keeps its last acceleration (it uses velocity differences by default anyway)
+        self.bng.request()
+        return {}
+
+class Camera():
+    def __init__(self, name, bng, vehicle, resolution=(640, 480), **kwargs):
+        self.bng = bng
+        self.vehicle = vehicle
+        self.resolution = resolution
+    def poll(self):
+        self.bng.request()
+        if self.bng.recording is not None:
+            readings = self.bng.recording.camera(max(self.vehicle.frame - 1, 0)) ## the reading of the last frame handed out, or of the first
+            if readings is not None:
+                return readings
+        width, height = self.resolution
+        return {
+            'colour': np.zeros((height, width, 3), dtype=np.uint8),
+            'depth': np.zeros((height, width), dtype=np.float32),
+            'annotation': np.zeros((height, width, 3), dtype=np.uint8),
+        }
+    def remove(self):
+        self.bng.request()
+
+class Lidar():
+    def __init__(self, name, bng, vehicle, **kwargs):
+        self.bng = bng
+        self.vehicle = vehicle
+    def poll(self):
+        self.bng.request()
+        if self.bng.recording is not None:
+            readings = self.bng.recording.lidar(max(self.vehicle.frame - 1, 0)) ## the reading of the last frame handed out, or of the first
+            if readings is not None:
+                return readings
+        return {'pointCloud': np.zeros((0, 3), dtype=np.float32)}
+    def remove(self):
+        self.bng.request()
@@ -0,0 +1,53 @@
+import numpy as np
+
+'''
+Frame skipping for the beamng interfaces (beamng_interface.py and beamng_interface_new.py): step_n advances the
+simulation by n physics steps and polls once, and fills in the frames it did not observe.
+'''
+
+def fill_skipped(last_state, last_timestamp, state, timestamp, n, fill="linear"):
+    ## states [n, state_dim] and timestamps [n] of the n steps from the last poll to this one, the last entry is the new poll
+    states = np.repeat(state[None], n, axis=0)
+    timestamps = np.full(n, timestamp)
+    if last_state is None or n == 1:
+        return states, timestamps ## nothing to interpolate from, e.g. right after a reset
+    w = np.arange(1, n + 1)/n
+    timestamps = last_timestamp + w*(timestamp - last_timestamp)
+    if fill == "linear":
+        delta = state - last_state
+        delta[3:6] = (delta[3:6] + np.pi) % (2*np.pi) - np.pi ## interpolate the angles the short way around
+        states = last_state + w[:, None]*delta
+        states[:, 3:6] = (states[:, 3:6] + np.pi) % (2*np.pi) - np.pi
+    elif fill == "last":
+        states[:-1] = last_state
+    else:
+        raise ValueError("fill has to be 'linear' or 'last', got {}".format(fill))
+    return states, timestamps
+
+def step_n(interface, n, action=None, record=False, fill="linear", **ctrl_kwargs):
+    '''
+    sends the control (if given, ctrl_kwargs go to send_ctrl), advances the simulation by n physics steps and polls once.
+    In lockstep mode this is a single bng.step(n) instead of n rounds of step + poll.
+    returns the new state, or with record=True (states [n, state_dim], timestamps [n]) with one entry per physics step.
+    The skipped steps are not observed, so they are either interpolated between the last and the new state (fill="linear")
+    or hold the last state (fill="last"). After a reset there is no last state, and the skipped steps hold the new one.
+    '''
+    if action is not None:
+        interface.send_ctrl(action, **ctrl_kwargs)
+    if not interface.lockstep:
+        ## the simulator runs on its own here, so all we can do is poll through the skipped frames like before
+        states, timestamps = [], []
+        for _ in range(n):
+            interface.state_poll()
+            states.append(np.copy(interface.state))
+            timestamps.append(interface.timestamp)
+        if record:
+            return np.array(states), np.array(timestamps)
+        return interface.state
+
+    last_state = None if interface.state is None else np.copy(interface.state)
+    last_timestamp = interface.timestamp
+    interface.state_poll(steps=n)
+    if not record:
+        return interface.state
+    return fill_skipped(last_state, last_timestamp, interface.state, interface.timestamp, n, fill)
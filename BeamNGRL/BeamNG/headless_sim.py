@@ -0,0 +1,106 @@
+import numpy as np
+import torch
+
+from pathlib import Path
+from sys import platform
+
+import BeamNGRL
+from BeamNGRL.utils import transforms
+from BeamNGRL.BeamNG.map_server import get_map_layers
+from BeamNGRL.BeamNG.bev_batch import batch_bev_extractor
+
+ROOT_PATH = Path(BeamNGRL.__file__).parent
+DATA_PATH = ROOT_PATH.parent / ('BeamNGRL/data' if platform == "win32" else 'data')
+
+'''
+Simulator-free stand-in for the interface that runs N independent cars on one of the MPPI dynamics models
+(control/UW_mppi/Dynamics, anything with the set_BEV/forward interface).
+The dynamics are built for the whole map instead of a BEV around the car and the cars take the place of the rollouts,
+so a single forward call advances all N cars in world coordinates. The observations are the gym env observations
+(height, normal, color, path, state) for all cars at once, gathered by batch_bev_extractor.
+'''
+
+class headless_sim():
+    def __init__(self, Dynamics, Dynamics_config, num_vehicles=1, map_name="small_island", map_size=16, resolution=0.25,
+                 elevation_range=2.0, rotate=False, path_to_maps=DATA_PATH.__str__(), shared_map=False, device="cpu", dtype=torch.float32):
+        layers = get_map_layers(map_name=map_name, resolution=resolution, path_to_maps=path_to_maps, shared=shared_map)
+        self.bev = batch_bev_extractor(layers, map_size=map_size, resolution=resolution, elevation_range=elevation_range, rotate=rotate)
+        self.N = num_vehicles
+        self.device = torch.device(device)
+        self.dtype = dtype
+        self.resolution_inv = 1/resolution
+        self.image_size = self.bev.image_shape[0]
+        self.dt = Dynamics_config["dt"]
+
+        ## the map images are centered on the world origin, which is exactly how the dynamics index their BEV,
+        ## so a "BEV" covering the whole map lets the dynamics work in world coordinates.
+        ## The dynamics recompute the size in pixels in float32, make sure that comes out as the image size.
+        full_map_size = np.float32(self.image_size*resolution)
+        while int(full_map_size/np.float32(resolution)) < self.image_size:
+            full_map_size = np.nextafter(full_map_size, np.float32(np.inf))
+        Map_config = {"map_size": float(full_map_size), "map_res": resolution}
+        MPPI_config = {"ROLLOUTS": num_vehicles, "TIMESTEPS": 1, "BINS": 1}
+        if issubclass(Dynamics, torch.nn.Module):
+            self.dyn = Dynamics(Dynamics_config, Map_config, MPPI_config, dtype=dtype, device=self.device)
+        else:
+            ## the pycuda model manages its own device and is always float32
+            self.dyn = Dynamics(Dynamics_config, Map_config, MPPI_config)
+        self.dyn.set_BEV(torch.from_numpy(self.bev.elevation_map_full).to(device=self.device, dtype=dtype),
+                         torch.from_numpy(self.bev.normal_map_full).to(device=self.device, dtype=dtype))
+
+        self.state = torch.zeros((self.N, 17), device=self.device, dtype=dtype)
+        self.timestamp = 0.0
+        self.start_pos = np.zeros((self.N, 3))
+        self.start_quat = np.tile([0, 0, 0, 1.0], (self.N, 1))
+        self.flipped_over = np.zeros(self.N, dtype=bool)
+        self.observations = None
+
+    def get_height(self, pos):
+        pos = np.asarray(pos, dtype=np.float64).reshape((-1, 3))
+        img_X = np.clip((pos[:, 0]*self.resolution_inv + self.image_size//2).astype(np.int64), 0, self.image_size - 1)
+        img_Y = np.clip((pos[:, 1]*self.resolution_inv + self.image_size//2).astype(np.int64), 0, self.image_size - 1)
+        return self.bev.elevation_map_full[img_Y, img_X]
+
+    def reset(self, start_pos=None, start_quat=None, index=None):
+        '''
+        puts the cars at start_pos ([3] or [n, 3]) with beamng's start_quat ([4] or [n, 4]) at rest.
+        index selects the cars to reset (all by default), the poses default to the last ones used.
+        '''
+        index = np.arange(self.N) if index is None else np.atleast_1d(index)
+        if start_pos is not None:
+            self.start_pos[index] = np.asarray(start_pos, dtype=np.float64)
+        if start_quat is not None:
+            self.start_quat[index] = np.asarray(start_quat, dtype=np.float64)
+        state = np.zeros((len(index), 17))
+        state[:, :2] = self.start_pos[index, :2]
+        state[:, 2] = self.get_height(self.start_pos[index])
+        state[:, 3:6] = transforms.rpy_from_quat(transforms.convert_beamng_to_REP103(self.start_quat[index]))
+        self.state[torch.from_numpy(index).to(self.device)] = torch.from_numpy(state).to(device=self.device, dtype=self.dtype)
+        self.flipped_over[index] = False
+        return self.observe()
+
+    def step(self, action, steps=1):
+        '''
+        action: [N, 2] (steering, throttle) in [-1, 1], same as the gym envs. Advances all cars by `steps` dynamics steps
+        (of Dynamics_config["dt"] each) with the same action and returns the observations after the last one.
+        '''
+        action = torch.as_tensor(action, device=self.device, dtype=self.dtype).reshape((self.N, 2))
+        action = torch.clamp(action, -1, 1)[None, :, None, :]
+        for _ in range(steps):
+            state = self.dyn.forward(self.state[None, :, None, :], action)
+            self.state = state.reshape((self.N, 17)).to(device=self.device, dtype=self.dtype)
+            self.timestamp += self.dt
+        return self.observe()
+
+    def observe(self):
+        state = self.state.cpu().numpy().astype(np.float64)
+        bev = self.bev.extract(state[:, :3], state[:, 5])
+        self.flipped_over |= (np.abs(state[:, 3]) > np.pi/2) | (np.abs(state[:, 4]) > np.pi/2)
+        self.observations = {
+            'height': bev['elev'],
+            'normal': bev['normal'],
+            'color':  bev['color'],
+            'path': bev['path'],
+            'state': state,
+        }
+        return self.observations
@@ -0,0 +1,67 @@
+import numpy as np
+
+
+class lidar_preprocessor():
+    '''
+    Moves a world frame point cloud into the body frame and reduces it to one point (the centroid) per occupied voxel
+    inside the BEV window (map_size x map_size x 2*elevation_range around the car).
+    transform() writes into preallocated work buffers (grown only when a scan is larger than every scan before it),
+    downsample() writes at most `capacity` centroids into the fixed buffer self.voxels and sets self.count.
+    The voxels are hashed to their index in the window grid. When the grid isn't much larger than the scan, the centroids
+    are accumulated with bincount over the whole grid (linear in the number of points), otherwise over the np.unique keys.
+    '''
+    def __init__(self, map_size=16, elevation_range=2.0, voxel_size=0.1, capacity=4096):
+        self.half_size = map_size/2
+        self.elevation_range = elevation_range
+        self.voxel_size = voxel_size
+        self.grid = (
+            int(np.ceil(map_size/voxel_size)),
+            int(np.ceil(map_size/voxel_size)),
+            int(np.ceil(2*elevation_range/voxel_size)),
+        )
+        self.cells = self.grid[0]*self.grid[1]*self.grid[2]
+        self.capacity = capacity
+        self.voxels = np.zeros((capacity, 3), dtype=np.float32)
+        self.count = 0
+        self.shifted = np.zeros((0, 3), dtype=np.float32)
+        self.body = np.zeros((0, 3), dtype=np.float32)
+        self.warned = False
+
+    def transform(self, points, pos, Tnb):
+        ## returns a view of the work buffer, valid until the next call
+        points = np.asarray(points).reshape((-1, 3))
+        n = len(points)
+        if n > len(self.body):
+            self.shifted = np.zeros((n, 3), dtype=np.float32)
+            self.body = np.zeros((n, 3), dtype=np.float32)
+        shifted = self.shifted[:n]
+        body = self.body[:n]
+        np.subtract(points, pos, out=shifted, casting='same_kind')
+        np.matmul(shifted, Tnb.T.astype(np.float32), out=body)
+        return body
+
+    def downsample(self, body):
+        ## body frame points [N, 3] -> voxel centroids, a view of self.voxels[:self.count]
+        offset = np.array([self.half_size, self.half_size, self.elevation_range], dtype=np.float32)
+        index = np.floor((body + offset)/self.voxel_size).astype(np.int64)
+        valid = np.all((index >= 0) & (index < self.grid), axis=1)
+        index = index[valid]
+        points = body[valid]
+        key = (index[:, 0]*self.grid[1] + index[:, 1])*self.grid[2] + index[:, 2]
+
+        if self.cells <= 4*len(key):
+            counts = np.bincount(key, minlength=self.cells)
+            occupied = np.flatnonzero(counts)
+            sums = np.stack([np.bincount(key, weights=points[:, i], minlength=self.cells)[occupied] for i in range(3)], axis=1)
+            counts = counts[occupied]
+        else:
+            _, inverse, counts = np.unique(key, return_inverse=True, return_counts=True)
+            sums = np.stack([np.bincount(inverse, weights=points[:, i], minlength=len(counts)) for i in range(3)], axis=1)
+
+        count = min(len(counts), self.capacity)
+        if count < len(counts) and not self.warned:
+            self.warned = True
+            print("{} occupied voxels, only keeping {}. Increase voxel_capacity or voxel_size".format(len(counts), count))
+        np.divide(sums[:count], counts[:count, None], out=self.voxels[:count], casting='same_kind')
+        self.count = count
+        return self.voxels[:count]
@@ -0,0 +1,201 @@
+import cv2
+import numpy as np
+
+import atexit
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+from sys import platform
+from multiprocessing import shared_memory, resource_tracker
+
+import BeamNGRL
+from BeamNGRL.tools.Path_Distance import compute_path_distance
+
+ROOT_PATH = Path(BeamNGRL.__file__).parent
+DATA_PATH = ROOT_PATH.parent / ('BeamNGRL/data' if platform == "win32" else 'data')
+IMAGE_RESOLUTION = 0.1 # this is the original meters per pixel resolution of the map images
+MAP_LAYERS = ['elevation', 'color', 'segmt', 'path', 'inpaint', 'path_distance']
+
+_served = {} ## maps served by this process, keyed by shared memory prefix
+_attached = {} ## maps attached by this process, keyed by shared memory prefix
+
+
+def load_map_layers(map_name="small_island", resolution=0.25, path_to_maps=DATA_PATH.__str__()):
+    '''
+    loads the full map layers from disk and resizes them to the target resolution (meters per pixel).
+    the inpaint mask marks the pixels where the elevation map has no data.
+    path_distance is the signed distance to the trails in meters (float16), precomputed by tools/Path_Distance.py.
+    '''
+    elevation = np.load(path_to_maps + f'/map_data/{map_name}/elevation_map.npy', allow_pickle=True)
+    color = cv2.imread(path_to_maps + f'/map_data/{map_name}/color_map.png')
+    segmt = cv2.imread(path_to_maps + f'/map_data/{map_name}/segmt_map.png')
+    path  = cv2.imread(path_to_maps + f'/map_data/{map_name}/paths.png')
+    if color is None:
+        raise FileNotFoundError(f"no map data found for {map_name} in {path_to_maps}/map_data")
+    try:
+        path_distance = np.load(path_to_maps + f'/map_data/{map_name}/path_distance.npy')
+    except FileNotFoundError:
+        print(f"no path_distance.npy for {map_name}, computing it from paths.png. Run tools/Path_Distance.py to do this offline")
+        path_distance = compute_path_distance(path, IMAGE_RESOLUTION)
+
+    if(IMAGE_RESOLUTION != resolution):
+        scale_factor = IMAGE_RESOLUTION/resolution
+        new_shape = np.array(np.array(color.shape) * scale_factor, dtype=np.int32)
+        elevation = cv2.resize(elevation, (new_shape[0], new_shape[1]), cv2.INTER_AREA)
+        color = cv2.resize(color, (new_shape[0], new_shape[1]), cv2.INTER_AREA)
+        segmt = cv2.resize(segmt, (new_shape[0], new_shape[1]), cv2.INTER_AREA)
+        path  = cv2.resize(path, (new_shape[0], new_shape[1]), cv2.INTER_AREA)
+        ## distances are in meters so they don't need rescaling, but cv2 can't resize float16
+        path_distance = cv2.resize(path_distance.astype(np.float32), (new_shape[0], new_shape[1]), cv2.INTER_AREA).astype(np.float16)
+
+    inpaint = np.zeros_like(elevation, dtype=np.uint8)
+    inpaint[elevation == 0] = 255
+
+    return {'elevation': elevation, 'color': color, 'segmt': segmt, 'path': path, 'inpaint': inpaint, 'path_distance': path_distance}
+
+
+def shm_prefix(map_name, resolution):
+    return f"bngrl_{map_name}_{int(round(resolution*1000))}"
+
+
+def _attach_block(name):
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    shm = shared_memory.SharedMemory(name=name)
+    ## attaching registers the block with this process' resource tracker, which would unlink it when we exit.
+    resource_tracker.unregister(shm._name, 'shared_memory')
+    return shm
+
+
+class map_server():
+    '''
+    loads a map once and publishes every layer as a POSIX shared memory block.
+    the blocks are unlinked when the serving process exits (or close() is called);
+    processes that are already attached keep their mapping, new processes have to wait for a new server.
+    '''
+    def __init__(self, map_name="small_island", resolution=0.25, path_to_maps=DATA_PATH.__str__()):
+        self.map_name = map_name
+        self.resolution = resolution
+        self.prefix = shm_prefix(map_name, resolution)
+        self.blocks = []
+        self.layers = {}
+
+        layers = load_map_layers(map_name=map_name, resolution=resolution, path_to_maps=path_to_maps)
+        meta = {}
+        try:
+            for layer, arr in layers.items():
+                shm = shared_memory.SharedMemory(name=f"{self.prefix}_{layer}", create=True, size=max(arr.nbytes, 1))
+                self.blocks.append(shm)
+                view = np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)
+                view[...] = arr
+                view.flags.writeable = False
+                self.layers[layer] = view
+                meta[layer] = {'shape': list(arr.shape), 'dtype': arr.dtype.str}
+            ## the meta block goes last; clients only see the map once every layer has been written.
+            meta_bytes = json.dumps(meta).encode('utf-8')
+            shm = shared_memory.SharedMemory(name=f"{self.prefix}_meta", create=True, size=8 + len(meta_bytes))
+            self.blocks.append(shm)
+            shm.buf[:8] = len(meta_bytes).to_bytes(8, 'little')
+            shm.buf[8:8 + len(meta_bytes)] = meta_bytes
+        except Exception:
+            self.close()
+            raise
+        atexit.register(self.close)
+
+    def close(self):
+        self.layers = {}
+        for shm in self.blocks:
+            try:
+                shm.close()
+            except BufferError:
+                pass ## someone in this process still holds a view, the mapping goes away with the process.
+            try:
+                shm.unlink()
+            except FileNotFoundError:
+                pass
+        self.blocks = []
+        _served.pop(self.prefix, None)
+
+
+def attach_map(map_name="small_island", resolution=0.25):
+    '''
+    attaches to a map published by a map_server. Returns a dict of read-only layer arrays.
+    raises FileNotFoundError if nobody is serving this map at this resolution.
+    '''
+    prefix = shm_prefix(map_name, resolution)
+    if prefix in _served:
+        return _served[prefix].layers
+    if prefix in _attached:
+        return _attached[prefix][0]
+
+    meta_shm = _attach_block(f"{prefix}_meta")
+    size = int.from_bytes(bytes(meta_shm.buf[:8]), 'little')
+    meta = json.loads(bytes(meta_shm.buf[8:8 + size]).decode('utf-8'))
+    meta_shm.close()
+
+    layers = {}
+    blocks = []
+    for layer, spec in meta.items():
+        shm = _attach_block(f"{prefix}_{layer}")
+        arr = np.ndarray(tuple(spec['shape']), dtype=np.dtype(spec['dtype']), buffer=shm.buf)
+        arr.flags.writeable = False
+        layers[layer] = arr
+        blocks.append(shm)
+    ## the blocks have to outlive the arrays, so we hold on to them for the lifetime of the process
+    _attached[prefix] = (layers, blocks)
+    return layers
+
+
+def serve_map(map_name="small_island", resolution=0.25, path_to_maps=DATA_PATH.__str__()):
+    prefix = shm_prefix(map_name, resolution)
+    if prefix not in _served:
+        _served[prefix] = map_server(map_name=map_name, resolution=resolution, path_to_maps=path_to_maps)
+    return _served[prefix]
+
+
+def get_map_layers(map_name="small_island", resolution=0.25, path_to_maps=DATA_PATH.__str__(), shared=False, timeout=10.0):
+    '''
+    returns the full map layers. With shared=False every caller gets its own copy (the old behavior).
+    With shared=True we attach to an existing server, or become the server if there isn't one yet.
+    '''
+    if not shared:
+        return load_map_layers(map_name=map_name, resolution=resolution, path_to_maps=path_to_maps)
+    try:
+        return attach_map(map_name=map_name, resolution=resolution)
+    except FileNotFoundError:
+        pass
+    try:
+        return serve_map(map_name=map_name, resolution=resolution, path_to_maps=path_to_maps).layers
+    except FileExistsError:
+        pass
+    ## another process beat us to it and is still writing the layers
+    start = time.time()
+    while True:
+        try:
+            return attach_map(map_name=map_name, resolution=resolution)
+        except FileNotFoundError:
+            if time.time() - start > timeout:
+                raise
+            time.sleep(0.05)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--map_name", type=str, default="small_island", help="name of the map to serve")
+    parser.add_argument("--map_res", type=float, nargs='+', default=[0.25], help="resolution(s) in meters per pixel to serve the map at")
+    parser.add_argument("--path_to_maps", type=str, default=DATA_PATH.__str__(), help="directory containing map_data/")
+    args = parser.parse_args()
+
+    servers = [serve_map(args.map_name, res, args.path_to_maps) for res in args.map_res]
+    for server in servers:
+        nbytes = sum(layer.nbytes for layer in server.layers.values())
+        print(f"serving {server.map_name} at {server.resolution} m/px as {server.prefix}_* ({nbytes/1e6:.1f} MB)")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    for server in servers:
+        server.close()
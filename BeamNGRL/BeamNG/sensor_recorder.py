@@ -0,0 +1,149 @@
+import numpy as np
+
+import json
+import shutil
+from pathlib import Path
+
+from BeamNGRL.utils.chunked_log import chunked_log, load_log, read_index, chunk_dir
+
+'''
+Records what state_poll reads from the simulator (vehicle.state and the sensor dicts, optionally camera and lidar frames)
+into one columnar .npz file, one array per field with one row per poll. fake_beamngpy can play a recording back through
+the interface (fake_beamng={"recording": path}), which gives deterministic inputs for benchmarking the interface and the
+BEV pipeline without a simulator.
+While recording, every chunk_rows rows are appended to chunked logs (see chunked_log.py) in <path>.parts/, so memory
+stays at about one chunk however long the session is; save packs the parts into the .npz and removes them.
+'''
+
+class sensor_recorder():
+    def __init__(self, path, camera=False, lidar=False, compress=True, chunk_rows=64):
+        self.path = Path(path)
+        self.camera = camera
+        self.lidar = lidar
+        self.compress = compress
+        self.chunk_rows = chunk_rows
+        self.parts = self.path.parent / (self.path.name + ".parts")
+        shutil.rmtree(self.parts, ignore_errors=True) ## left over from a recording that was never saved
+        self.parts.mkdir(parents=True)
+        self.damage_file = open(self.parts / "damage.jsonl", "w")
+        self.columns = {} ## rows not written to the parts yet
+        self.frames = 0
+
+    def append(self, name, value):
+        rows = self.columns.setdefault(name, [])
+        rows.append(value)
+        if len(rows) >= self.chunk_rows:
+            self.flush()
+
+    def flush(self):
+        for name, rows in self.columns.items():
+            if len(rows):
+                ## point clouds have different sizes, so they are concatenated, save turns the counts into offsets
+                data = np.concatenate(rows) if name == 'lidar_points' else np.stack(rows)
+                chunked_log(self.parts / (name + ".npy")).append(data)
+        self.columns = {name: [] for name in self.columns}
+        self.damage_file.flush()
+
+    def record_vehicle(self, vehicle):
+        state = vehicle.state
+        electrics = vehicle.sensors['electrics']
+        if self.frames == 0:
+            ## the set of electrics columns is fixed by the first frame, only plain numbers are kept
+            self.electrics_keys = [key for key, value in electrics.items() if isinstance(value, (int, float, bool, np.number))]
+        self.damage_file.write(json.dumps(vehicle.sensors['damage'], default=str) + "\n") ## one json line per frame
+        self.frames += 1
+        self.append('state_pos', np.array(state['pos'], dtype=np.float64))
+        self.append('state_vel', np.array(state['vel'], dtype=np.float64))
+        self.append('state_rotation', np.array(state['rotation'], dtype=np.float64))
+        self.append('electrics', np.array([electrics.get(key, np.nan) for key in self.electrics_keys], dtype=np.float64))
+        self.append('timer_time', vehicle.sensors['timer']['time'])
+
+    def record_camera(self, readings):
+        if not self.camera:
+            return
+        self.append('camera_frame', self.frames - 1) ## the vehicle frame this image goes with
+        for key in ['colour', 'depth', 'annotation']:
+            if key in readings and readings[key] is not None:
+                self.append('camera_' + key, np.array(readings[key])) ## copies, readings may be reused buffers
+
+    def record_lidar(self, readings):
+        if not self.lidar:
+            return
+        points = np.array(readings['pointCloud'], dtype=np.float32).reshape((-1, 3))
+        self.append('lidar_frame', self.frames - 1)
+        self.append('lidar_counts', len(points))
+        self.append('lidar_points', points)
+
+    def save(self):
+        self.flush()
+        self.damage_file.close()
+        if self.frames == 0:
+            print("nothing recorded, not writing {}".format(self.path))
+            shutil.rmtree(self.parts, ignore_errors=True)
+            return
+        ## the parts are memory-mapped, savez copies them into the file piece by piece
+        data = {}
+        for name in self.columns:
+            if read_index(chunk_dir(self.parts / (name + ".npy"))) is not None:
+                data[name] = load_log(self.parts / (name + ".npy"))
+        data['electrics_keys'] = np.array(self.electrics_keys)
+        with open(self.parts / "damage.jsonl") as f:
+            data['damage'] = np.array([line.rstrip("\n") for line in f])
+        if 'lidar_counts' in data:
+            data['lidar_offsets'] = np.cumsum(np.concatenate([[0], data.pop('lidar_counts')]))
+            if 'lidar_points' not in data:
+                data['lidar_points'] = np.zeros((0, 3), dtype=np.float32) ## only empty scans
+        if self.compress:
+            np.savez_compressed(self.path, **data)
+        else:
+            np.savez(self.path, **data)
+        del data
+        shutil.rmtree(self.parts)
+        print("saved {} frames to {}".format(self.frames, self.path))
+
+
+class sensor_recording():
+    '''
+    a recording loaded back into memory. frame(i) gives vehicle.state and the sensor dicts in the shape beamngpy returns them.
+    '''
+    def __init__(self, path):
+        with np.load(path) as data:
+            self.data = {name: data[name] for name in data.files}
+        self.frames = len(self.data['timer_time'])
+        self.electrics_keys = [str(key) for key in self.data['electrics_keys']]
+        self.damage = [json.loads(str(damage)) for damage in self.data['damage']]
+
+    def frame(self, i):
+        i = i % self.frames
+        state = {
+            'pos': self.data['state_pos'][i],
+            'vel': self.data['state_vel'][i],
+            'rotation': self.data['state_rotation'][i],
+        }
+        sensors = {
+            'electrics': dict(zip(self.electrics_keys, self.data['electrics'][i].tolist())),
+            'timer': {'time': float(self.data['timer_time'][i])},
+            'damage': self.damage[i],
+        }
+        return state, sensors
+
+    def latest_index(self, name, i):
+        ## index of the last camera/lidar reading taken at or before vehicle frame i, None if there is none
+        if name + '_frame' not in self.data:
+            return None
+        frames = self.data[name + '_frame']
+        index = np.searchsorted(frames, i % self.frames, side='right') - 1
+        return None if index < 0 else index
+
+    def camera(self, i):
+        index = self.latest_index('camera', i)
+        if index is None:
+            return None
+        return {key: self.data['camera_' + key][index] for key in ['colour', 'depth', 'annotation'] if 'camera_' + key in self.data}
+
+    def lidar(self, i):
+        index = self.latest_index('lidar', i)
+        if index is None:
+            return None
+        offsets = self.data['lidar_offsets']
+        return {'pointCloud': self.data['lidar_points'][offsets[index]:offsets[index + 1]]}
@@ -0,0 +1,104 @@
+import numpy as np
+
+import threading
+import time
+import traceback
+
+
+class sensor_thread():
+    '''
+    Polls one sensor at `fps` on a background thread, so the control loop never waits on the simulator for images or point clouds.
+    Every reading is copied into the back one of two preallocated buffer sets by write(readings, buffers), which then
+    becomes the front set under a lock. latest(out) copies the front set into the caller's (preallocated) arrays and
+    returns the wall clock time of that reading, or None if there is nothing new since the last call.
+    '''
+    def __init__(self, sensor, fps, buffers, write, name="sensor"):
+        self.sensor = sensor
+        self.period = 1/fps
+        self.write = write
+        self.buffers = [buffers, {key: np.zeros_like(value) for key, value in buffers.items()}]
+        self.front = 0
+        self.frame = 0
+        self.read_frame = 0
+        self.timestamp = None
+        self.lock = threading.Lock()
+        self.running = True
+        self.thread = threading.Thread(target=self.poll_loop, name=name, daemon=True)
+        self.thread.start()
+
+    def poll_loop(self):
+        next_time = time.time()
+        while self.running:
+            try:
+                readings = self.sensor.poll()
+                ## the back buffers are only ever touched by this thread, so the copy happens outside the lock
+                if self.write(readings, self.buffers[1 - self.front]):
+                    with self.lock:
+                        self.front = 1 - self.front
+                        self.frame += 1
+                        self.timestamp = time.time()
+            except Exception:
+                print(traceback.format_exc())
+            next_time += self.period
+            delay = next_time - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_time = time.time() ## running behind, don't try to catch up with a burst of polls
+
+    def latest(self, out):
+        with self.lock:
+            if self.frame == self.read_frame:
+                return None
+            for key, value in self.buffers[self.front].items():
+                np.copyto(out[key], value)
+            self.read_frame = self.frame
+            return self.timestamp
+
+    def skip(self):
+        ## drops the current reading, latest returns None until the next one comes in
+        with self.lock:
+            self.read_frame = self.frame
+
+    def stop(self):
+        self.running = False
+        self.thread.join(timeout=2*self.period + 1)
+
+
+def camera_buffers(width, height, annotation=False):
+    buffers = {
+        'colour': np.zeros((height, width, 3), dtype=np.uint8),
+        'depth': np.zeros((height, width), dtype=np.float32),
+    }
+    if annotation:
+        buffers['annotation'] = np.zeros((height, width, 3), dtype=np.uint8)
+    return buffers
+
+def write_camera(readings, buffers):
+    for key, buffer in buffers.items():
+        if readings.get(key) is None:
+            return False ## incomplete frame, keep the last one
+        np.copyto(buffer, np.asarray(readings[key]).reshape(buffer.shape), casting='unsafe')
+    return True
+
+def lidar_buffers(capacity):
+    ## point clouds change size from scan to scan, so they go into a fixed capacity buffer along with the point count
+    return {
+        'points': np.zeros((capacity, 3), dtype=np.float32),
+        'count': np.zeros(1, dtype=np.int64),
+    }
+
+_lidar_clip_warned = False
+
+def write_lidar(readings, buffers):
+    global _lidar_clip_warned
+    if readings.get('pointCloud') is None:
+        return False
+    points = np.asarray(readings['pointCloud']).reshape((-1, 3))
+    count = min(len(points), len(buffers['points']))
+    if count < len(points) and not _lidar_clip_warned:
+        _lidar_clip_warned = True
+        print("lidar scan has {} points, only keeping the first {}".format(len(points), count))
+    buffers['points'][:count] = points[:count]
+    buffers['count'][0] = count
+    return True
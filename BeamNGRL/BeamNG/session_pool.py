@@ -0,0 +1,82 @@
+import json
+import atexit
+
+'''
+Keeps simulator sessions (an interface with its BeamNGpy connection and loaded scenario) alive between experiment runs
+in the same process, so a run that asks for the same level, car and sensors gets the running session back with the car
+reset to its start pose (beamng_interface.reinit), instead of launching BeamNG and loading the level again.
+There is one session per simulator (host, port): asking for a different setup on the same simulator closes the old session first.
+get_session takes the arguments of get_beamng_default; Experiments/Run_queue.py runs several experiment configs on one session.
+
+    bng_interface = get_session(car_model=..., start_pos=..., start_quat=..., map_config=..., ...)
+    ...
+    close_sessions() ## when done with the simulator
+'''
+
+## these change between runs without reloading anything
+RESET_ARGS = ["start_pos", "start_quat", "burn_time", "run_lockstep"]
+
+class session_pool():
+    '''
+    factory: builds a new session from the get_session kwargs, beamng_interface.get_beamng_default by default.
+    '''
+    def __init__(self, factory=None):
+        if factory is None:
+            from BeamNGRL.BeamNG.beamng_interface import get_beamng_default
+            factory = get_beamng_default
+        self.factory = factory
+        self.sessions = {} ## (host, port) -> (setup key, interface)
+        self.created = 0
+        self.reused = 0
+
+    def setup_key(self, kwargs):
+        setup = {key: value for key, value in kwargs.items() if key not in RESET_ARGS}
+        return json.dumps(setup, sort_keys=True, default=str)
+
+    def slot(self, kwargs):
+        host = kwargs.get("host_IP") if kwargs.get("remote", False) else "localhost"
+        return (host, kwargs.get("port", 64256))
+
+    def get(self, **kwargs):
+        slot = self.slot(kwargs)
+        key = self.setup_key(kwargs)
+        if slot in self.sessions:
+            old_key, bng = self.sessions[slot]
+            if old_key == key:
+                self.reused += 1
+                bng.burn_time = kwargs.get("burn_time", 0.02)
+                bng.set_lockstep(kwargs.get("run_lockstep", False))
+                bng.reinit(start_pos=kwargs.get("start_pos"), start_quat=kwargs.get("start_quat"))
+                return bng
+            self.close(bng)
+        bng = self.factory(**kwargs)
+        self.created += 1
+        self.sessions[slot] = (key, bng)
+        return bng
+
+    def close(self, bng=None):
+        ## closes the given session, or all of them
+        for slot, (key, session) in list(self.sessions.items()):
+            if bng is None or session is bng:
+                del self.sessions[slot]
+                try:
+                    session.close() ## sensor threads and both simulator connections
+                except Exception as e:
+                    print("failed to close the session on {}:{}: {}".format(slot[0], slot[1], e))
+
+
+_pool = None
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        _pool = session_pool()
+        atexit.register(_pool.close)
+    return _pool
+
+def get_session(**kwargs):
+    return get_pool().get(**kwargs)
+
+def close_sessions():
+    if _pool is not None:
+        _pool.close()
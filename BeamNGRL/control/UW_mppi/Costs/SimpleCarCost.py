@@ -39,6 +39,12 @@ class SimpleCarCost(torch.nn.Module):
         self.BEVmap_normal = torch.zeros((self.BEVmap_size_px.item(), self.BEVmap_size_px.item(), 3), dtype=self.dtype, device=self.d)
         self.BEVmap_center = torch.zeros(3, dtype=self.dtype, device=self.d)
         self.BEVmap_path = torch.zeros_like(self.BEVmap_normal)
+        self.BEVmap_path_distance = torch.zeros_like(self.BEVmap)
+        self.use_path_distance = False
+        if "path_dist_scale" in Cost_config:
+            self.path_dist_scale = torch.tensor(Cost_config["path_dist_scale"], dtype=self.dtype, device=self.d)
+        else:
+            self.path_dist_scale = torch.tensor(1.6, dtype=self.dtype, device=self.d) ## about how far the blur in paths.png reaches off the trail
 
         self.GRAVITY = torch.tensor(9.8, dtype=self.dtype, device=self.d)
 
@@ -57,6 +63,15 @@ class SimpleCarCost(torch.nn.Module):
         self.BEVmap_normal = BEVmap_normal
         self.BEVmap_path = BEV_path  # translate the state into the center of the costmap.
 
+    @torch.jit.export
+    def set_path_distance(self, BEV_path_distance):
+        '''
+        BEV_path_distance is the robot-centric signed distance to the trails in meters (BEV_path_distance from the interface).
+        Once this is set the path cost comes from the distance instead of the BEV_path image.
+        '''
+        self.BEVmap_path_distance = BEV_path_distance
+        self.use_path_distance = True
+
     @torch.jit.export
     def set_goal(self, goal_state):
         self.goal_state = goal_state[:2]
@@ -115,11 +130,18 @@ class SimpleCarCost(torch.nn.Module):
         # state_cost = torch.square(self.BEVmap_path[img_Y, img_X,0])
         # evaluate state cost using footprint
         # state cost is the maximum state cost of all the footprint points
-        state_cost = torch.zeros_like(x)
-        state_cost = torch.max(state_cost, torch.square(self.BEVmap_path[fly_px, flx_px,0]))
-        state_cost = torch.max(state_cost, torch.square(self.BEVmap_path[fry_px, frx_px,0]))
-        state_cost = torch.max(state_cost, torch.square(self.BEVmap_path[bly_px, blx_px,0]))
-        state_cost = torch.max(state_cost, torch.square(self.BEVmap_path[bry_px, brx_px,0]))
+        if self.use_path_distance:
+            ## distance of the farthest footprint corner, so the cost follows the heading of the car w.r.t. the trail
+            corner_dist = torch.max(self.BEVmap_path_distance[fly_px, flx_px], self.BEVmap_path_distance[fry_px, frx_px])
+            corner_dist = torch.max(corner_dist, self.BEVmap_path_distance[bly_px, blx_px])
+            corner_dist = torch.max(corner_dist, self.BEVmap_path_distance[bry_px, brx_px])
+            state_cost = torch.square(torch.clamp(corner_dist/self.path_dist_scale, 0, 1))
+        else:
+            state_cost = torch.zeros_like(x)
+            state_cost = torch.max(state_cost, torch.square(self.BEVmap_path[fly_px, flx_px,0]))
+            state_cost = torch.max(state_cost, torch.square(self.BEVmap_path[fry_px, frx_px,0]))
+            state_cost = torch.max(state_cost, torch.square(self.BEVmap_path[bly_px, blx_px,0]))
+            state_cost = torch.max(state_cost, torch.square(self.BEVmap_path[bry_px, brx_px,0]))
         state_cost = state_cost + self.stop_w*torch.clamp( ( (1/self.BEVmap_normal[img_Y, img_X, 2]) - (self.critical_SA)), 0, 10) ## lethal costs go here.
 
         vel_cost = torch.clamp((vx - self.speed_target),0, 100)
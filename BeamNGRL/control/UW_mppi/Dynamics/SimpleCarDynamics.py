@@ -106,9 +106,9 @@ class SimpleCarDynamics(torch.nn.Module):
         heading = torch.stack([cy, sy, torch.zeros_like(yaw)], dim=3) ## heading is a unit vector --ergo, all cross products will be unit vectors and don't need normalization
 
         # Calculate the cross product of the heading and normal vectors to get the vector perpendicular to both
-        left = torch.cross(normal, heading)
+        left = torch.cross(normal, heading, dim=-1)
         # Calculate the cross product of the right and normal vectors to get the vector perpendicular to both and facing upwards
-        forward = torch.cross(left, normal)
+        forward = torch.cross(left, normal, dim=-1)
         # Calculate the roll angle (rotation around the forward axis)
         roll = torch.asin(left[...,2])
         # Calculate the pitch angle (rotation around the right axis)
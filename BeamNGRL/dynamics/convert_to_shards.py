@@ -0,0 +1,65 @@
+import argparse
+import shutil
+import tqdm
+import numpy as np
+from glob import glob
+from pathlib import Path
+from BeamNGRL import DATASETS_PATH
+from BeamNGRL.dynamics.utils.shard_utils import ShardWriter, shard_path, TRAJ_FIELDS, BEV_FIELDS
+from BeamNGRL.utils.bev_codec import load_bev
+
+## Packs the per-sample files of existing datasets (data/datasets/<name>/<split>/trajectories, bev_*) into shards,
+## see utils/shard_utils.py. get_datasets uses the shards as soon as a split has them.
+##   python convert_to_shards.py --dataset small_grid_mppi
+
+
+def convert_split(split_path: Path, samples_per_shard: int, remove_files: bool = False):
+    traj_path = split_path / 'trajectories'
+    num_files = len(glob(traj_path.__str__() + "/*.npy"))
+    if num_files == 0:
+        print(f'no trajectories in {split_path}, skipping...')
+        return
+
+    # Written next to the split and renamed when complete, so an interrupted run is never picked up as a dataset
+    out_path = shard_path(split_path)
+    tmp_path = out_path.with_name('shards.tmp')
+    if tmp_path.exists():
+        shutil.rmtree(tmp_path)
+    writer = ShardWriter(tmp_path, samples_per_shard)
+
+    # Same numbering as DynamicsDataset.add_data
+    for i in tqdm.tqdm(range(num_files)):
+        inp_name = f'{i:05d}.npy'
+        traj_input = np.load(traj_path / inp_name, allow_pickle=True).item()
+        sample = {k: np.asarray(traj_input[k]) for k in TRAJ_FIELDS}
+        for bev_type in BEV_FIELDS:
+            bevmap = load_bev(split_path / bev_type / inp_name)
+            h, w = bevmap.shape[:2]
+            sample[bev_type] = bevmap.reshape((h, w, -1))
+        writer.add(sample)
+    writer.close()
+
+    if out_path.exists():
+        shutil.rmtree(out_path)
+    tmp_path.rename(out_path)
+    print(f'{split_path}: {num_files} samples in {len(writer.index["shards"])} shards')
+
+    if remove_files:
+        for name in ['trajectories'] + BEV_FIELDS:
+            shutil.rmtree(split_path / name, ignore_errors=True)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--dataset', type=str, nargs='+', required=True, help='dataset name(s) in data/datasets')
+    parser.add_argument('--samples_per_shard', type=int, default=4096)
+    parser.add_argument('--remove_files', action='store_true', help='delete the per-sample files once converted')
+
+    args = parser.parse_args()
+
+    for name in args.dataset:
+        dataset_path = DATASETS_PATH / name
+        for split_path in sorted(p for p in dataset_path.iterdir() if (p / 'trajectories').is_dir()):
+            convert_split(split_path, args.samples_per_shard, args.remove_files)
@@ -7,8 +7,12 @@ from glob import glob
 from PIL import Image
 from BeamNGRL import *
 from .utils.dataset_utils import from_np
+from .utils.shard_utils import ShardReader, has_shards, shard_path, TRAJ_FIELDS
+from .utils.window_utils import WindowReader, has_windows, window_path
+from .utils.meta_utils import has_metadata, load_metadata, select_samples
+from BeamNGRL.utils.bev_codec import load_bev
 from collections import defaultdict
-from typing import List
+from typing import Callable, List, Union
 
 
 def get_datasets(
@@ -22,6 +26,7 @@ def get_datasets(
     state_input_key: str = None,
     control_input_key: str = None,
     ctx_input_keys: List = None,
+    sample_filter: Union[str, Callable] = None,
 ):
 
     # get dataset stats
@@ -30,7 +35,14 @@ def get_datasets(
 
     grid_size = map_cfg['map_size'] // map_cfg['map_res']
 
-    train_ds = DynamicsDataset(
+    # Packed shards (see convert_to_shards.py) or windows (process_data_new.py --windowed) when the dataset has them
+    dataset_class = DynamicsDataset
+    if has_shards(dataset_path / 'train'):
+        dataset_class = ShardDataset
+    elif has_windows(dataset_path / 'train'):
+        dataset_class = WindowDataset
+
+    train_ds = dataset_class(
         dataset_path=dataset_path,
         split='train',
         grid_size=grid_size,
@@ -40,9 +52,10 @@ def get_datasets(
         state_input_key=state_input_key,
         ctrl_input_key=control_input_key,
         ctx_input_keys=ctx_input_keys,
+        sample_filter=sample_filter,
     )
 
-    valid_ds = DynamicsDataset(
+    valid_ds = dataset_class(
         dataset_path=dataset_path,
         split='valid',
         grid_size=grid_size,
@@ -51,6 +64,7 @@ def get_datasets(
         state_input_key=state_input_key,
         ctrl_input_key=control_input_key,
         ctx_input_keys=ctx_input_keys,
+        sample_filter=sample_filter,
     )
 
     train_loader = DataLoader(
@@ -75,6 +89,7 @@ class DynamicsDataset(Dataset):
             state_input_key: str = None,
             ctrl_input_key: str = None,
             ctx_input_keys: List = None,
+            sample_filter: Union[str, Callable] = None,
     ):
 
         super().__init__()
@@ -93,6 +108,11 @@ class DynamicsDataset(Dataset):
         self.add_data(seq_path)
         self.num_files = len(self.traj_files)
 
+        # Samples used, all of them or those passing the filter on the metadata table (see utils/meta_utils.py)
+        self.indices = np.arange(self.num_files)
+        if sample_filter is not None:
+            self.indices = self.select(seq_path, sample_filter)
+
         self.state_input_key = state_input_key
         self.ctrl_input_key = ctrl_input_key
         self.ctx_input_keys = ctx_input_keys
@@ -114,19 +134,33 @@ class DynamicsDataset(Dataset):
                 self.bev_files[bev_type].append(basepath / bev_type / inp_name)
             self.traj_files.append(traj_path / inp_name)
 
+    def select(self, basepath, sample_filter):
+        if not has_metadata(basepath):
+            raise ValueError(f'{basepath} has no sample metadata to filter, run process_data_new.py --metadata_only')
+        metadata = load_metadata(basepath)
+        if len(metadata['sequence_id']) != self.num_files:
+            raise ValueError(f'metadata of {basepath} lists {len(metadata["sequence_id"])} samples, not {self.num_files}')
+        indices = select_samples(metadata, sample_filter)
+        print(f'{self.split}: {len(indices)} of {self.num_files} samples pass "{sample_filter}"')
+        return indices
+
     def __len__(self):
-        return int(self.num_files)
+        return len(self.indices)
 
     def get_bevmap(self, bev_type, idx):
-        bevmap = np.load(self.bev_files[f'{bev_type}'][idx])
+        bevmap = load_bev(self.bev_files[f'{bev_type}'][idx]) ## .npz if the dataset was written with a bev_codec
         h, w = bevmap.shape[:2]
         return bevmap.reshape((h, w, -1))
 
+    def load_sample(self, t):
+        traj_input = np.load(self.traj_files[t], allow_pickle=True).item()
+        bev_input_dict = {bev_type: self.get_bevmap(bev_type, t) for bev_type in self.bev_list}
+        return traj_input, bev_input_dict
+
     def __getitem__(self, t):
 
         # Load input files
-        traj_input = np.load(self.traj_files[t], allow_pickle=True).item()
-        bev_input_dict = {bev_type: self.get_bevmap(bev_type, t) for bev_type in self.bev_list}
+        traj_input, bev_input_dict = self.load_sample(int(self.indices[t]))
 
         curr_time = traj_input['timestamp']
         state = traj_input['state']
@@ -140,9 +174,9 @@ class DynamicsDataset(Dataset):
         future_states = traj_input['future_states']
         future_ctrls = traj_input['future_controls']
 
-        # Relative timestamps (to current time)
-        past_ts -= curr_time
-        future_ts -= curr_time
+        # Relative timestamps (to current time), not in place: samples may be views into the dataset files
+        past_ts = past_ts - curr_time
+        future_ts = future_ts - curr_time
         curr_time = 0.
 
 
@@ -215,6 +249,7 @@ class DynamicsDataset(Dataset):
         rotate_angle = np.random.uniform(-np.deg2rad(90), np.deg2rad(90))
 
         # Current pose: augment yaw angle
+        curr_state = np.copy(curr_state)
         curr_state[5] += rotate_angle
 
         # Trajectories: rotate about current pose
@@ -227,4 +262,49 @@ class DynamicsDataset(Dataset):
 
         # bev_dict = {k: self.rotate_bevmap(bm, rotate_angle) for k, bm in bev_dict.items()}
 
-        return curr_state, past_states, future_states, bev_dict
\ No newline at end of file
+        return curr_state, past_states, future_states, bev_dict
+
+
+class ShardDataset(DynamicsDataset):
+    '''
+    DynamicsDataset over packed shards (<split>/shards, written by convert_to_shards.py): every sample is a set of
+    views into memory-mapped files instead of a pickled trajectory and three bev files.
+    '''
+
+    def add_data(self, basepath):
+
+        self.bev_list = [
+            'bev_color',
+            'bev_elev',
+            'bev_normal',
+        ]
+
+        self.shards = ShardReader(shard_path(basepath))
+        self.traj_files = range(len(self.shards))
+
+    def load_sample(self, t):
+        sample = self.shards.get(t)
+        traj_input = {k: sample[k] for k in TRAJ_FIELDS}
+        bev_input_dict = {bev_type: sample[bev_type] for bev_type in self.bev_list}
+        return traj_input, bev_input_dict
+
+
+class WindowDataset(DynamicsDataset):
+    '''
+    DynamicsDataset over a windowed dataset (<split>/windows, written by process_data_new.py --windowed): every raw
+    sequence is stored once and the past/current/future windows are sliced out of it when a sample is read.
+    '''
+
+    def add_data(self, basepath):
+
+        self.bev_list = [
+            'bev_color',
+            'bev_elev',
+            'bev_normal',
+        ]
+
+        self.windows = WindowReader(window_path(basepath))
+        self.traj_files = range(len(self.windows))
+
+    def load_sample(self, t):
+        return self.windows.get(t)
@@ -13,24 +13,12 @@ import argparse
 from datetime import datetime
 from BeamNGRL import MPPI_CONFIG_PTH, DATA_PATH, ROOT_PATH, LOGS_PATH
 import time
-from typing import List
+from BeamNGRL.utils.chunked_log import update_log
 import gc ## import group chat?
 
 
 ## I used the MPPI to train a model which I then use to collect more data. makes perfect sense.
 
-def update_npy_datafile(buffer: List, filepath):
-    buff_arr = np.array(buffer)
-    if filepath.is_file():
-        # Append to existing data file
-        data_arr = np.load(filepath, allow_pickle=True)
-        data_arr = np.concatenate((data_arr, buff_arr), axis=0)
-        np.save(filepath, data_arr)
-    else:
-        np.save(filepath, buff_arr)
-    return [] # empty buffer
-
-
 def collect_mppi_data(args):
 
     with open(MPPI_CONFIG_PTH / 'MPPI_config.yaml') as f:
@@ -173,6 +161,7 @@ def collect_mppi_data(args):
 
                 controller.Dynamics.set_BEV(BEV_height_tn, BEV_normal_tn)
                 controller.Costs.set_BEV(BEV_height_tn, BEV_normal_tn, BEV_path_tn)
+                controller.Costs.set_path_distance(torch.from_numpy(bng.BEV_path_distance).to(device=device, dtype=dtype))
                 controller.Costs.set_goal(
                     torch.from_numpy(np.copy(goal) - np.copy(pos)).to(device=device, dtype=dtype)
                 )  # you can also do this asynchronously
@@ -235,14 +224,14 @@ def collect_mppi_data(args):
 
                     print("\nSaving data...")
                     print(f"time: {ts}")
-                    timestamps = update_npy_datafile(timestamps, output_path / "timestamps.npy")
-                    state_data = update_npy_datafile(state_data, output_path / "state.npy")
-                    # path_data = update_npy_datafile(path_data, output_path / "bev_path.npy")
-                    # color_data = update_npy_datafile(color_data, output_path / "bev_color.npy")
-                    # segmt_data = update_npy_datafile(segmt_data, output_path / "bev_segmt.npy")
-                    # elev_data = update_npy_datafile(elev_data, output_path / "bev_elev.npy")
-                    # normal_data = update_npy_datafile(normal_data, output_path / "bev_normal.npy")
-                    reset_data = update_npy_datafile(reset_data, output_path / "reset.npy")
+                    timestamps = update_log(timestamps, output_path / "timestamps.npy")
+                    state_data = update_log(state_data, output_path / "state.npy")
+                    # path_data = update_log(path_data, output_path / "bev_path.npy")
+                    # color_data = update_log(color_data, output_path / "bev_color.npy")
+                    # segmt_data = update_log(segmt_data, output_path / "bev_segmt.npy")
+                    # elev_data = update_log(elev_data, output_path / "bev_elev.npy")
+                    # normal_data = update_log(normal_data, output_path / "bev_normal.npy")
+                    reset_data = update_log(reset_data, output_path / "reset.npy")
 
                     gc.collect()
                     save_prompt_time += float(args.save_every_n_sec)
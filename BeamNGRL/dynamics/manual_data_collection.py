@@ -13,24 +13,12 @@ import argparse
 from datetime import datetime
 from BeamNGRL import MPPI_CONFIG_PTH, DATA_PATH, ROOT_PATH, LOGS_PATH
 import time
-from typing import List
+from BeamNGRL.utils.chunked_log import update_log
 import gc ## import group chat?
 
 
 ## I used the MPPI to train a model which I then use to collect more data. makes perfect sense.
 
-def update_npy_datafile(buffer: List, filepath):
-    buff_arr = np.array(buffer)
-    if filepath.is_file():
-        # Append to existing data file
-        data_arr = np.load(filepath, allow_pickle=True)
-        data_arr = np.concatenate((data_arr, buff_arr), axis=0)
-        np.save(filepath, data_arr)
-    else:
-        np.save(filepath, buff_arr)
-    return [] # empty buffer
-
-
 def collect_mppi_data(args):
 
     dtype = torch.float
@@ -108,9 +96,9 @@ def collect_mppi_data(args):
 
                 print("\nSaving data...")
                 print(f"time: {ts}")
-                timestamps = update_npy_datafile(timestamps, output_path / "timestamps.npy")
-                state_data = update_npy_datafile(state_data, output_path / "state.npy")
-                reset_data = update_npy_datafile(reset_data, output_path / "reset.npy")
+                timestamps = update_log(timestamps, output_path / "timestamps.npy")
+                state_data = update_log(state_data, output_path / "state.npy")
+                reset_data = update_log(reset_data, output_path / "reset.npy")
                 gc.collect()
                 save_prompt_time += float(args.save_every_n_sec)
 
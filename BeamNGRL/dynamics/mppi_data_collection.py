@@ -13,20 +13,8 @@ import argparse
 from datetime import datetime
 from BeamNGRL import MPPI_CONFIG_PTH, DATA_PATH, ROOT_PATH
 import time
-from typing import List
-import gc
-
-
-def update_npy_datafile(buffer: List, filepath):
-    buff_arr = np.array(buffer)
-    if filepath.is_file():
-        # Append to existing data file
-        data_arr = np.load(filepath, allow_pickle=True)
-        data_arr = np.concatenate((data_arr, buff_arr), axis=0)
-        np.save(filepath, data_arr)
-    else:
-        np.save(filepath, buff_arr)
-    return [] # empty buffer
+from BeamNGRL.utils.log_writer import background_log_writer
+from BeamNGRL.utils.bev_codec import bev_codec
 
 
 def collect_mppi_data(args):
@@ -95,13 +83,9 @@ def collect_mppi_data(args):
 
         bng.set_lockstep(True)
 
-        timestamps = []
-        state_data = []
-        color_data = []
-        elev_data = []
-        segmt_data = []
-        path_data = []
-        normal_data = []
+        ## frames are written to the logs on a background thread, see log_writer.py
+        codec = bev_codec(color=None, segmt=None, path=None) if args.compress_bev else None ## images can't be compressed in fixed size rows
+        writer = background_log_writer(output_path, queue_size=args.queue_size, policy=args.queue_policy, codec=codec)
 
         start = None
         running = True
@@ -124,6 +108,7 @@ def collect_mppi_data(args):
                 if terminate:
                     print("done!")
                     bng.send_ctrl(np.zeros(2))
+                    writer.close()
                     time.sleep(5)
                     exit()
 
@@ -141,6 +126,7 @@ def collect_mppi_data(args):
 
                 controller.Dynamics.set_BEV(BEV_height_tn, BEV_normal_tn)
                 controller.Costs.set_BEV(BEV_height_tn, BEV_normal_tn, BEV_path_tn)
+                controller.Costs.set_path_distance(torch.from_numpy(bng.BEV_path_distance).to(device=device, dtype=dtype))
                 controller.Costs.set_goal(
                     torch.from_numpy(np.copy(goal) - np.copy(pos)).to(device=device, dtype=dtype)
                 )  # you can also do this asynchronously
@@ -171,28 +157,22 @@ def collect_mppi_data(args):
                 )
 
                 # Aggregate Data
-                timestamps.append(ts)
-                state_data.append(state)
-                color_data.append(BEV_color)
-                elev_data.append(BEV_height)
-                segmt_data.append(BEV_segmt)
-                path_data.append(BEV_path)
-                normal_data.append(BEV_normal)
+                writer.write({
+                    "timestamps": ts,
+                    "state": state,
+                    "bev_color": BEV_color,
+                    "bev_elev": BEV_height,
+                    "bev_segmt": BEV_segmt,
+                    "bev_path": BEV_path,
+                    "bev_normal": BEV_normal,
+                })
 
                 if ts >= save_prompt_time or \
                     ts - start > args.duration:
 
                     print("\nSaving data...")
-                    print(f"time: {ts}")
-                    timestamps = update_npy_datafile(timestamps, output_path / "timestamps.npy")
-                    state_data = update_npy_datafile(state_data, output_path / "state.npy")
-                    path_data = update_npy_datafile(path_data, output_path / "bev_path.npy")
-                    color_data = update_npy_datafile(color_data, output_path / "bev_color.npy")
-                    segmt_data = update_npy_datafile(segmt_data, output_path / "bev_segmt.npy")
-                    elev_data = update_npy_datafile(elev_data, output_path / "bev_elev.npy")
-                    normal_data = update_npy_datafile(normal_data, output_path / "bev_normal.npy")
-
-                    gc.collect()
+                    print(f"time: {ts}, frames written: {writer.written}, dropped: {writer.dropped}")
+                    writer.flush()
                     save_prompt_time += float(args.save_every_n_sec)
 
                 if ts - start > args.duration:
@@ -211,6 +191,7 @@ def collect_mppi_data(args):
             except Exception:
                 print(traceback.format_exc())
 
+        writer.close()
         bng.bng.close()
 
 
@@ -225,6 +206,9 @@ if __name__ == "__main__":
     parser.add_argument('--duration', type=int, default=30)
     parser.add_argument('--save_every_n_sec', type=int, default=15)
     parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--queue_size', type=int, default=64, help='frames waiting to be written before the queue policy kicks in')
+    parser.add_argument('--queue_policy', type=str, default='block', help='block, drop_newest or drop_oldest when the writer falls behind')
+    parser.add_argument('--compress_bev', action='store_true', help='store bev_elev as float16 and bev_normal octahedral-encoded, see bev_codec.py')
     args = parser.parse_args()
 
     collect_mppi_data(args)
@@ -1,64 +1,78 @@
 import argparse
 import yaml
 from pathlib import Path
-import math
 import tqdm
 import multiprocessing
-import gc
 from utils.dataset_utils import *
 from utils.vis_utils import *
 from BeamNGRL import *
-from collections import defaultdict
+from BeamNGRL.utils.bev_codec import bev_codec, save_bev
+from utils.window_utils import save_sequence, remove_sequence, window_path, has_windows, WindowReader
+from utils.stats_utils import DatasetStats, SplitSamples, scan_stats
+from utils.meta_utils import sample_metadata, allocate_metadata, write_metadata_index, save_metadata, scan_metadata, MetadataSlots, META_COLUMNS
+from utils.shard_utils import shard_path, read_shard_index, allocate_shards, field_spec, write_shard_index, ShardSlots, TRAJ_FIELDS, BEV_FIELDS
 import os
+import json
+import hashlib
+import shutil
+from functools import partial
 
-def calc_data_stats(dataset_path):
+def calc_data_stats(dataset_path, workers=8, chunk_size=1000):
+    # Stats of the train split from a parallel scan of the samples, whichever way they are stored
+    split_path = dataset_path / 'train'
+    num_samples = len(SplitSamples(split_path))
+    chunks = [(split_path, i, min(i + chunk_size, num_samples)) for i in range(0, num_samples, chunk_size)]
 
-    out_dir = dataset_path.__str__()
+    print(f'\nCalc. dataset stats...')
 
-    print(f'\nCalc. trajectory stats...')
+    stats = DatasetStats()
+    with multiprocessing.get_context('spawn').Pool(workers) as pool:
+        for chunk_stats in tqdm.tqdm(pool.imap_unordered(scan_stats_chunk, chunks), total=len(chunks)):
+            stats.merge(chunk_stats)
+    stats.save(dataset_path)
 
-    stats = {
-        'mean:state': [],
-        'mean:control': [],
-        'std:state': [],
-        'std:control': [],
-    }
-
-    traj_input_files = get_files(out_dir, "train/trajectories")
-    for fn in tqdm.tqdm(traj_input_files):
-        traj = np.load(fn, allow_pickle=True).item()
 
-        state_traj, control_traj = get_full_traj(traj)
-        stats['mean:state'].append(state_traj.mean(0))
-        stats['std:state'].append(state_traj.std(0))
-        stats['mean:control'].append(control_traj.mean(0))
-        stats['std:control'].append(control_traj.std(0))
+def scan_stats_chunk(chunk):
+    return scan_stats(*chunk)
 
-    stats = {k: np.array(v).mean(0) for k, v in stats.items()}
-    for name, value in stats.items():
-        print(f'{name} -- {value}')
 
-    print(f'\nCalc. bev stats...')
+def sample_origins(split_path):
+    # Raw sequence names and (sequence, keyframe) of every sample of a split, (-1, -1) where they are not known
+    num_samples = len(SplitSamples(split_path))
+    if has_windows(split_path):
+        reader = WindowReader(window_path(split_path))
+        counts = [s['keyframes'] for s in reader.index['sequences']]
+        frames = [np.load(window_path(split_path) / name / 'keyframes.npy') for name in reader.sequences]
+        jobs = np.stack([np.repeat(np.arange(len(counts)), counts), np.concatenate(frames + [np.zeros(0, dtype=np.int64)])], axis=1)
+        return reader.sequences, jobs
+    plan = read_plan(split_path)
+    if plan is not None and 'sequence_names' in plan:
+        jobs = np.load(split_path / 'generation_jobs.npy')
+        if len(jobs) == num_samples:
+            return plan['sequence_names'], jobs
+    return [], np.full((num_samples, 2), -1, dtype=np.int64)
 
-    bev_stats = defaultdict(list)
 
-    def get_bev_stats(type):
-        bev_input_files = get_files(out_dir, f"train/bev_{type}")
-        for fn in tqdm.tqdm(bev_input_files):
-            bev_map = np.load(fn)
-            bev_stats[f'mean:bev_{type}'].append(bev_map.mean())
-            bev_stats[f'std:bev_{type}'].append(bev_map.std())
-            # print(f'{type}', bev_map.mean(), bev_map.std())
+def calc_metadata(split_path, map_name=None, workers=8, chunk_size=1000):
+    # Per-sample metadata of a split from a parallel scan of the samples, for windowed or older datasets
+    names, jobs = sample_origins(split_path)
+    num_samples = len(jobs)
+    columns = {'sequence': jobs[:, 0], 'frame': jobs[:, 1]}
+    columns.update({column: np.zeros(num_samples, dtype=META_COLUMNS[column]) for column in META_COLUMNS if column not in columns})
+    starts = list(range(0, num_samples, chunk_size))
+    chunks = [(split_path, i, min(i + chunk_size, num_samples)) for i in starts]
 
-    [get_bev_stats(t) for t in ['color', 'elev', 'normal']]
+    print(f'\nCalc. metadata of {split_path}...')
 
-    bev_stats = {k: np.array(v).mean() for k, v in bev_stats.items()}
-    for name, value in bev_stats.items():
-        print(f'{name} -- {value}')
+    with multiprocessing.get_context('spawn').Pool(workers) as pool:
+        for start, chunk_columns in zip(starts, tqdm.tqdm(pool.imap(scan_metadata_chunk, chunks), total=len(chunks))):
+            for column, values in chunk_columns.items():
+                columns[column][start:start + len(values)] = values
+    save_metadata(split_path, columns, [{'name': name, 'map': map_name} for name in names])
 
-    stats.update(bev_stats)
 
-    np.save(dataset_path / 'input_stats.npy', stats, allow_pickle=True)
+def scan_metadata_chunk(chunk):
+    return scan_metadata(*chunk)
 
 
 def process_data(kwargs, save_vis=False):
@@ -117,17 +131,402 @@ def process_data(kwargs, save_vis=False):
     }
 
 
+def plan_keyframes(states_seq, reset_seq, past_traj_len, future_traj_len, skip_frames, grid_size, map_res):
+    # Keyframes (every skip_frames) whose past/future window has no reset and stays within the map, all at once
+    num_frames = states_seq.shape[0]
+    window_len = past_traj_len + future_traj_len + 1
+    keyframes = np.arange(0, num_frames, skip_frames, dtype=np.int64)
+    keyframes = keyframes[(keyframes >= past_traj_len) & (keyframes + future_traj_len < num_frames)]
+    if len(keyframes) == 0:
+        return keyframes
+
+    # Resets: count in [start, stop) from a cumulative sum, the window extends skip_frames past the future traj
+    reset_count = np.concatenate(([0], np.cumsum(np.asarray(reset_seq).reshape(num_frames, -1).any(axis=1))))
+    start = keyframes - past_traj_len
+    stop = np.minimum(keyframes + future_traj_len + skip_frames, num_frames)
+    no_reset = reset_count[stop] == reset_count[start]
+
+    # Map limits: max. radius (in pixels) of the base-frame trajectory, see project_traj_to_map(mode='radius')
+    posns = np.asarray(states_seq[:, :2])
+    windows = np.lib.stride_tricks.sliding_window_view(posns, window_len, axis=0)[start] # K, 2, window_len
+    offsets = ((windows - posns[keyframes][..., None]) / map_res).astype(np.int32)
+    traj_rad = np.sqrt((offsets**2).sum(axis=1))
+    in_range = traj_rad.max(axis=1) < grid_size // 2
+
+    print(f'{len(keyframes)} windows: {np.sum(~no_reset)} with resets, '
+          f'{np.sum(no_reset & ~in_range)} exceeding map limits, {np.sum(no_reset & in_range)} kept')
+    return keyframes[no_reset & in_range]
+
+
+def load_sequence(sequence_path):
+    # Raw data of a sequence (memory-mapped logs)
+    timestamps = load_timestamps('timestamps.npy', sequence_path)
+    return {
+        'timestamps': timestamps,
+        'states': get_state_trajectory('state.npy', sequence_path, timestamps),
+        'controls': get_controls('state.npy', sequence_path),
+        'bev_color': load_bev_map('bev_color.npy', sequence_path),
+        'bev_elev': load_bev_map('bev_elev.npy', sequence_path),
+        'bev_normal': load_bev_map('bev_normal.npy', sequence_path),
+        'reset': load_reset_data('reset.npy', sequence_path),
+    }
+
+
+def window_jobs(cfg, grid_size, seq, keyframes, frame_idxs):
+    past_traj_len = cfg['past_traj_len']
+    future_traj_len = cfg['future_traj_len']
+
+    # Define data elements for processing, windows of all keyframes at once: K, past + future + 1
+    data_idxs = keyframes[:, None] + np.arange(-past_traj_len, future_traj_len + 1)[None]
+
+    # Base w.r.t world coord.
+    base_frames = np.asarray(seq['states'][keyframes, :6])
+
+    traj_ts = seq['timestamps'][data_idxs]
+    traj_controls = seq['controls'][data_idxs]
+
+    # Base-frame Trajectories
+    traj_states = seq['states'][data_idxs]
+    traj_states[..., :3] = traj_states[..., :3] - base_frames[:, None, :3]
+
+    return [{
+        'cfg': cfg,
+        'grid_size': grid_size,
+        'frame_idx': int(frame_idxs[k]),
+        'base_frame': base_frames[k],
+        'traj_ts': traj_ts[k],
+        'traj_states': traj_states[k],
+        'traj_controls': traj_controls[k],
+        'bev_color': np.array(seq['bev_color'][keyframe_idx]), # copies, the logs are read-only
+        'bev_elev': np.array(seq['bev_elev'][keyframe_idx]),
+        'bev_normal': np.array(seq['bev_normal'][keyframe_idx]),
+    } for k, keyframe_idx in enumerate(keyframes)]
+
+
+def sample_record(ret):
+    # Processed window as a shard record
+    sample = {k: ret['trajectory'][k] for k in TRAJ_FIELDS}
+    for bev_type in BEV_FIELDS:
+        h, w = ret[bev_type].shape[:2]
+        sample[bev_type] = ret[bev_type].reshape((h, w, -1))
+    return sample
+
+
+def read_plan(split_path):
+    plan_file = split_path / 'generation.json'
+    if not plan_file.is_file():
+        return None
+    with open(plan_file) as f:
+        return json.load(f)
+
+
+def write_plan(split_path, plan):
+    tmp_file = split_path / 'generation.json.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump(plan, f)
+    os.replace(tmp_file, split_path / 'generation.json')
+
+
+# Worker process state, kept for the whole run: workers only get sample indices and read everything else themselves
+_worker = {}
+
+
+def init_worker(cfg):
+    _worker['cfg'] = cfg
+    _worker['splits'] = {}
+    _worker['sequence'] = (None, None)
+
+
+def worker_split(split_path):
+    if split_path not in _worker['splits']:
+        plan = read_plan(Path(split_path))
+        split = {
+            'plan': plan,
+            'jobs': np.load(Path(split_path) / 'generation_jobs.npy'),
+            'done': np.load(Path(split_path) / 'generation_done.npy', mmap_mode='r+'),
+        }
+        split['metadata'] = MetadataSlots(split_path)
+        if plan['per_sample_files']:
+            split['codec'] = bev_codec.from_config(plan['bev_codec'])
+        else:
+            split['shards'] = ShardSlots(shard_path(split_path), plan['shards'])
+        _worker['splits'][split_path] = split
+    return _worker['splits'][split_path]
+
+
+def worker_sequence(sequence_path):
+    # Only the sequence being processed is kept open
+    if _worker['sequence'][0] != sequence_path:
+        _worker['sequence'] = (sequence_path, load_sequence(Path(sequence_path)))
+    return _worker['sequence'][1]
+
+
+def save_sample(split_path, split, ret):
+    frame_idx = int(ret['frame_idx'])
+    if 'shards' in split:
+        split['shards'].put(frame_idx, sample_record(ret))
+    else:
+        np.save(split_path / 'trajectories' / f'{frame_idx:05d}.npy', ret['trajectory'], allow_pickle=True)
+        for bev_type in BEV_FIELDS:
+            save_bev(split_path / bev_type / f'{frame_idx:05d}.npy', bev_type, ret[bev_type], split['codec'])
+
+    vis_image = ret['vis_image']
+    if vis_image is not None:
+        vis_image.save(split_path / 'vis_images' / f'{frame_idx:05d}.png')
+
+
+def process_samples(split_path, sample_idxs):
+    # Runs in a worker: processes the given samples of the split and writes them straight to their place in the output
+    cfg = _worker['cfg']
+    split = worker_split(split_path)
+    plan = split['plan']
+    jobs = split['jobs'][sample_idxs]
+    stats = DatasetStats() # of these samples, merged by the parent
+    for seq_id in np.unique(jobs[:, 0]):
+        in_seq = jobs[:, 0] == seq_id
+        seq = worker_sequence(plan['sequences'][seq_id])
+        for job in window_jobs(cfg, plan['grid_size'], seq, jobs[in_seq, 1], sample_idxs[in_seq]):
+            ret = process_data(job, plan['save_vis'])
+            save_sample(Path(split_path), split, ret)
+            split['metadata'].put(ret['frame_idx'], sample_metadata(ret['trajectory']))
+            stats.update(ret['trajectory'], ret)
+
+    # Marked done only once the samples are on disk, for resuming
+    if 'shards' in split:
+        split['shards'].flush()
+    split['metadata'].flush()
+    split['done'][sample_idxs] = 1
+    split['done'].flush()
+    return stats
+
+
+def sequence_path(cfg, sequence):
+    return DATA_PATH / Path(cfg['raw_data_dir'] + "/") / sequence
+
+
+def sequence_fingerprint(sequence_path):
+    # Raw data of a sequence from the names, sizes and modification times of its log files, nothing is read
+    fingerprint = hashlib.sha1()
+    for log_file in sorted(p for p in Path(sequence_path).rglob('*') if p.is_file()):
+        info = log_file.stat()
+        fingerprint.update(f'{log_file.relative_to(sequence_path)}:{info.st_size}:{info.st_mtime_ns}\n'.encode())
+    return fingerprint.hexdigest()
+
+
+def split_sequences(cfg, split, args):
+    # Names, paths and fingerprints of the sequences of a split. A fingerprint covers the raw data and the settings the
+    # samples of the sequence depend on: when it is unchanged, so are the samples, and the sequence is not processed again
+    settings = {k: cfg.get(k) for k in ['past_traj_len', 'future_traj_len', 'skip_frames', 'Map_config', 'bev_codec']}
+    settings.update(per_sample_files=args.per_sample_files, save_vis=args.save_vis, windowed=args.windowed, metadata=META_COLUMNS)
+    settings = json.dumps(settings, sort_keys=True)
+    names = [str(sequence) for sequence in cfg['split'][split]]
+    paths = [str(sequence_path(cfg, sequence)) for sequence in names]
+    fingerprints = [hashlib.sha1((settings + sequence_fingerprint(path)).encode()).hexdigest() for path in paths]
+    return names, paths, fingerprints
+
+
+def plan_split(cfg, split, paths, grid_size):
+    # (sequence, keyframe) of every sample of the given sequences of the split, in one array
+    jobs = [np.zeros((0, 2), dtype=np.int64)]
+    for seq_id, path in enumerate(paths):
+        print("\nPlanning split: %s, subdir: %s" % (split, Path(path).name))
+        seq = load_sequence(Path(path))
+        keyframes = plan_keyframes(
+            seq['states'], seq['reset'], cfg['past_traj_len'], cfg['future_traj_len'], cfg['skip_frames'],
+            grid_size, cfg['Map_config']['map_res'])
+        jobs.append(np.stack([np.full(len(keyframes), seq_id), keyframes], axis=1))
+    return np.concatenate(jobs).astype(np.int64)
+
+
+def scan_window_chunk(chunk):
+    return scan_stats(*chunk), scan_metadata(*chunk)
+
+
+def scan_windows(split_path, map_name, pool, chunk_size=1000):
+    # Stats and metadata of the windows of every stored sequence, kept next to the sequence: only the sequences that
+    # do not have them yet are scanned, the split's are merged from those of its sequences
+    window_dir = window_path(split_path)
+    reader = WindowReader(window_dir)
+    scanned = {}
+    chunks = []
+    for seq, name in enumerate(reader.sequences):
+        if (window_dir / name / 'stats.npy').is_file() and (window_dir / name / 'metadata.npz').is_file():
+            continue
+        scanned[seq] = (DatasetStats(), [])
+        start, stop = int(reader.offsets[seq]), int(reader.offsets[seq + 1])
+        chunks += [(seq, (split_path, i, min(i + chunk_size, stop))) for i in range(start, stop, chunk_size)]
+
+    if len(chunks) > 0:
+        print(f'\nScanning the windows of {len(scanned)} sequences...')
+    results = pool.imap(scan_window_chunk, [chunk for _, chunk in chunks])
+    for (seq, _), (chunk_stats, chunk_columns) in zip(chunks, tqdm.tqdm(results, total=len(chunks))):
+        scanned[seq][0].merge(chunk_stats)
+        scanned[seq][1].append(chunk_columns)
+    for seq, (seq_stats, seq_columns) in scanned.items():
+        columns = {column: np.concatenate([np.zeros(0, dtype=dtype)] + [c[column] for c in seq_columns])
+                   for column, dtype in META_COLUMNS.items() if column not in ('sequence', 'frame')}
+        np.savez(window_dir / reader.sequences[seq] / 'metadata.npz', **columns)
+        np.save(window_dir / reader.sequences[seq] / 'stats.npy', seq_stats, allow_pickle=True)
+
+    stats = DatasetStats()
+    columns = {column: [np.zeros(0, dtype=dtype)] for column, dtype in META_COLUMNS.items()}
+    for seq, name in enumerate(reader.sequences):
+        stats.merge(np.load(window_dir / name / 'stats.npy', allow_pickle=True).item())
+        seq_columns = np.load(window_dir / name / 'metadata.npz')
+        for column in seq_columns.files:
+            columns[column].append(seq_columns[column])
+        keyframes = np.load(window_dir / name / 'keyframes.npy')
+        columns['sequence'].append(np.full(len(keyframes), seq))
+        columns['frame'].append(keyframes)
+    save_metadata(split_path, {column: np.concatenate(values) for column, values in columns.items()},
+                  [{'name': name, 'map': map_name} for name in reader.sequences])
+    return stats
+
+
+def generate_windows(cfg, split, split_path, grid_size, pool, args):
+    # Store the sequences once, windows are sliced out of them by WindowDataset
+    window_dir = window_path(split_path)
+    shutil.rmtree(shard_path(split_path), ignore_errors=True)
+    (split_path / 'generation.json').unlink(missing_ok=True) # nothing left to resume
+    stored = {}
+    if has_windows(split_path):
+        index = read_shard_index(window_dir)
+        if (index['past_traj_len'], index['future_traj_len']) != (cfg['past_traj_len'], cfg['future_traj_len']):
+            shutil.rmtree(window_dir)
+        else:
+            stored = {s['name']: s.get('fingerprint') for s in index['sequences']}
+
+    names, paths, fingerprints = split_sequences(cfg, split, args)
+    for name in stored:
+        if name not in names:
+            print("\nRemoving split: %s, subdir: %s" % (split, name))
+            remove_sequence(window_dir, name)
+    for name, path, fingerprint in zip(names, paths, fingerprints):
+        if stored.get(name) == fingerprint:
+            print("\nUnchanged split: %s, subdir: %s, skipping..." % (split, name))
+            continue
+        print("\nProcessing split: %s, subdir: %s" % (split, name))
+        seq = load_sequence(Path(path))
+        keyframes = plan_keyframes(
+            seq['states'], seq['reset'], cfg['past_traj_len'], cfg['future_traj_len'], cfg['skip_frames'],
+            grid_size, cfg['Map_config']['map_res'])
+        save_sequence(
+            window_dir, name, cfg['past_traj_len'], cfg['future_traj_len'],
+            seq['timestamps'], seq['states'], seq['controls'], keyframes,
+            {bev_type: seq[bev_type] for bev_type in BEV_FIELDS}, fingerprint,
+        )
+    return scan_windows(split_path, cfg['Map_config'].get('map_name'), pool)
+
+
+def start_split(cfg, split_path, grid_size, args):
+    # Empty split, without the outputs of earlier runs
+    for name in ['shards', 'windows', 'metadata', 'trajectories', 'vis_images'] + BEV_FIELDS:
+        shutil.rmtree(split_path / name, ignore_errors=True)
+    (split_path / 'generation_stats.npy').unlink(missing_ok=True)
+    if args.per_sample_files:
+        for name in ['trajectories'] + BEV_FIELDS:
+            (split_path / name).mkdir()
+    if args.save_vis:
+        (split_path / 'vis_images').mkdir()
+    return {
+        'sequences': [],
+        'sequence_names': [],
+        'fingerprints': [],
+        'samples': 0,
+        'grid_size': grid_size,
+        'per_sample_files': args.per_sample_files,
+        'bev_codec': cfg.get('bev_codec'), # compression of per-sample bev files, e.g. {elev: float16, normal: oct16, color: png}
+        'save_vis': args.save_vis,
+        'shards': None,
+    }
+
+
+def append_sequences(cfg, split, split_path, grid_size, plan, names, paths, fingerprints, args):
+    # Plans the samples of new sequences after those of the split, and makes room for them in the outputs.
+    # The plan is written last: until then, the split is what it was before
+    num_old = plan['samples']
+    jobs = plan_split(cfg, split, paths, grid_size)
+    if len(jobs) > 0:
+        if not args.per_sample_files:
+            # Record layout from the first sample, processed here
+            seq = load_sequence(Path(paths[jobs[0, 0]]))
+            ret = process_data(window_jobs(cfg, grid_size, seq, jobs[:1, 1], [0])[0])
+            plan['shards'] = allocate_shards(
+                shard_path(split_path), field_spec(sample_record(ret)), len(jobs), args.samples_per_shard, plan['shards'])
+        # Metadata columns, the origins of the samples are known from the plan and the rest is filled by the workers
+        allocate_metadata(split_path, num_old + len(jobs), keep=num_old)
+        metadata = MetadataSlots(split_path)
+        metadata.column('sequence')[num_old:] = jobs[:, 0] + len(plan['sequences'])
+        metadata.column('frame')[num_old:] = jobs[:, 1]
+        metadata.flush()
+        del metadata
+
+    jobs[:, 0] += len(plan['sequences'])
+    old_jobs = np.load(split_path / 'generation_jobs.npy')[:num_old] if num_old > 0 else np.zeros((0, 2), dtype=np.int64)
+    old_done = np.load(split_path / 'generation_done.npy')[:num_old] if num_old > 0 else np.zeros(0, dtype=np.uint8)
+    np.save(split_path / 'generation_jobs.npy', np.concatenate((old_jobs, jobs)))
+    np.save(split_path / 'generation_done.npy', np.concatenate((old_done, np.zeros(len(jobs), dtype=np.uint8))))
+    plan['sequences'] += paths
+    plan['sequence_names'] += names
+    plan['fingerprints'] += fingerprints
+    plan['samples'] = num_old + len(jobs)
+    write_plan(split_path, plan)
+
+
+def generate_samples(cfg, split, split_path, grid_size, pool, args):
+    names, paths, fingerprints = split_sequences(cfg, split, args)
+
+    # Sequences already in the split with the same fingerprint are kept (and resumed if they were interrupted),
+    # new ones are appended after them. If any was changed or removed, the split is made again from scratch
+    plan = read_plan(split_path)
+    current = dict(zip(names, fingerprints))
+    if plan is None or 'fingerprints' not in plan or \
+            any(current.get(name) != fingerprint for name, fingerprint in zip(plan['sequence_names'], plan['fingerprints'])):
+        if plan is not None:
+            print(f'\nSequences of split {split} were changed or removed, or made with other settings: starting over')
+        plan = start_split(cfg, split_path, grid_size, args)
+        write_plan(split_path, plan)
+        np.save(split_path / 'generation_jobs.npy', np.zeros((0, 2), dtype=np.int64))
+        np.save(split_path / 'generation_done.npy', np.zeros(0, dtype=np.uint8))
+
+    new = [i for i, name in enumerate(names) if name not in plan['sequence_names']]
+    print(f'\nSplit {split}: {len(names) - len(new)} sequences kept, {len(new)} new')
+    if len(new) > 0:
+        append_sequences(
+            cfg, split, split_path, grid_size, plan,
+            [names[i] for i in new], [paths[i] for i in new], [fingerprints[i] for i in new], args)
+    if plan['samples'] == 0:
+        print(f'\nNo valid windows in split {split}, skipping...')
+        return
+
+    done = np.load(split_path / 'generation_done.npy')
+    pending = np.flatnonzero(done == 0)
+    chunks = [pending[i:i + args.job_chunk_size] for i in range(0, len(pending), args.job_chunk_size)]
+    print(f'\nProcessing split: {split}, {len(pending)} of {len(done)} samples')
+    # Stats of the samples done so far, kept for resuming and appending (they may lag behind the done flags after a crash)
+    stats_file = split_path / 'generation_stats.npy'
+    stats = np.load(stats_file, allow_pickle=True).item() if stats_file.is_file() else DatasetStats()
+    for chunk_stats in tqdm.tqdm(pool.imap_unordered(partial(process_samples, str(split_path)), chunks), total=len(chunks)):
+        stats.merge(chunk_stats)
+        np.save(stats_file, stats, allow_pickle=True)
+
+    if not args.per_sample_files:
+        write_shard_index(shard_path(split_path), plan['shards'])
+    write_metadata_index(split_path, plan['samples'], [{'name': name, 'map': cfg['Map_config'].get('map_name')} for name in plan['sequence_names']])
+
+    if split == 'train':
+        if stats.samples == plan['samples']:
+            stats.save(split_path.parent)
+        else:
+            calc_data_stats(split_path.parent, args.workers)
+
+
 def generate_dataset(args):
 
     n_workers = args.workers
-    save_vis = args.save_vis
     cfg_path = str(ROOT_PATH.parent) + "/Experiments/Configs/" + '{}.yaml'.format(args.cfg)
     cfg = yaml.load(open(cfg_path).read(), Loader=yaml.SafeLoader)
 
-    raw_data_dir = Path(cfg['raw_data_dir']+"/")
-    future_traj_len = cfg['future_traj_len']
-    past_traj_len = cfg['past_traj_len']
-    skip_frames = cfg['skip_frames']
     map_size = cfg['Map_config']['map_size']
     map_res = cfg['Map_config']['map_res']
     try:
@@ -146,136 +545,26 @@ def generate_dataset(args):
     with open(output_path / 'config.yaml', 'w') as outfile:
         yaml.dump(cfg, outfile, sort_keys=False)
 
-    # Loop through raw data
-    for split in cfg['split']:
-        split_path = output_path / split
-        split_path.mkdir(exist_ok=True)
-
-        # Create output subdirs
-        trajectory_path = split_path / 'trajectories'
-        bev_color_path = split_path / 'bev_color'
-        bev_elev_path = split_path / 'bev_elev'
-        bev_normal_path = split_path / 'bev_normal'
-        vis_path = split_path / 'vis_images'
-
-        trajectory_path.mkdir(exist_ok=True)
-        bev_color_path.mkdir(exist_ok=True)
-        bev_elev_path.mkdir(exist_ok=True)
-        bev_normal_path.mkdir(exist_ok=True)
-        vis_path.mkdir(exist_ok=True)
-
-        frame_idx = 0 # data element counter
-        for sequence in cfg['split'][split]:
-
-            print("\nProcessing split: %s, subdir: %s" % (split, sequence))
-
-            # Raw data sequence path, files
-            sequence_path = DATA_PATH / raw_data_dir / sequence
-
-            # Gather data
-            timestamps = load_timestamps('timestamps.npy', sequence_path)
-            states_seq = get_state_trajectory('state.npy', sequence_path, timestamps)
-            controls_seq = get_controls('state.npy', sequence_path)
-            bev_color_seq = load_bev_map('bev_color.npy', sequence_path)
-            bev_elev_seq = load_bev_map('bev_elev.npy', sequence_path)
-            bev_normal_seq = load_bev_map('bev_normal.npy', sequence_path)
-            reset_seq = load_reset_data('reset.npy', sequence_path)
-
-            # Define data elements for processing
-            job_args = []
-            num_frames = states_seq.shape[0]
-            for i in range(0, num_frames, skip_frames):
-                reset_encountered = True
-                while reset_encountered:
-                    keyframe_idx = i
-                    start_idx = i - past_traj_len
-                    data_idxs = [start_idx + k for k in range(past_traj_len + future_traj_len + 1)]
-                    reset_range = reset_seq[data_idxs[0]: data_idxs[0] + past_traj_len + future_traj_len + skip_frames]
-                    reset_encountered = False
-                    if reset_range.any():
-                        print("reset_encountered")
-                        reset_encountered = True
-                        i = data_idxs[-1] + np.where(reset_range)[0].max() + past_traj_len + future_traj_len + skip_frames
-                if data_idxs[0] < 0 or data_idxs[-1] >= num_frames:
-                    # Skip frame if idxs are out of range
-                    continue
-                # Base w.r.t world coord.
-                base_frame = states_seq[keyframe_idx, :6]
-
-                traj_ts = timestamps[data_idxs]
-                traj_controls = controls_seq[data_idxs]
-
-                # Base-frame Trajectory
-                traj_states = states_seq[data_idxs]
-                traj_states[:, :3] = traj_states[:, :3] - base_frame[:3]
-
-                # Verify trajectory does not exceed map limits
-                # mode = 'default'
-                mode = 'radius'
-                traj_img_proj, in_range = project_traj_to_map(
-                    traj_states, grid_size, map_res, mode)
-                if any(~in_range):
-                    print(f'\nTrajectory exceeds map limits. Skipping...')
-                    continue
-
-                job_args.append({
-                    'cfg': cfg,
-                    'grid_size': grid_size,
-                    'frame_idx': frame_idx,
-                    'base_frame': base_frame,
-                    'traj_img_proj': traj_img_proj,
-                    'traj_ts': traj_ts,
-                    'traj_states': traj_states,
-                    'traj_controls': traj_controls,
-                    'bev_color': bev_color_seq[keyframe_idx],
-                    'bev_elev': bev_elev_seq[keyframe_idx],
-                    'bev_normal': bev_normal_seq[keyframe_idx],
-                })
-                frame_idx += 1
-
-
-
-            # Chunk jobs
-            job_chunk_size = args.job_chunk_size
-            if len(job_args) > job_chunk_size:
-                jobs = []
-                for i in range(math.ceil(len(job_args) / job_chunk_size)):
-                    jobs.append(job_args[i*job_chunk_size:(i+1)*job_chunk_size])
-            else:
-                jobs = [job_args] # no chunking
-
-            for job_chunk_args in jobs:
-                manager = multiprocessing.Manager()
-                ctx = multiprocessing.get_context('spawn')
-
-                # Apply workers to a single chunk
-                with ctx.Pool(n_workers) as pool:
-                    gc.collect()
-                    async_results = [pool.apply_async(process_data, (job, save_vis)) for job in job_chunk_args]
+    # One pool for the whole run, see process_samples
+    pool = multiprocessing.get_context('spawn').Pool(n_workers, initializer=init_worker, initargs=(cfg,))
 
-                    for future in tqdm.tqdm(async_results):
-                        gc.collect()
-                        ret = future.get()
-
-                        # Save frame data
-                        frame_idx = int(ret['frame_idx'])
-                        trajectory = ret['trajectory']
-                        bev_color = ret['bev_color']
-                        bev_elev = ret['bev_elev']
-                        bev_normal = ret['bev_normal']
-
-                        np.save(trajectory_path / f'{frame_idx:05d}.npy', trajectory, allow_pickle=True)
-                        np.save(bev_color_path / f'{frame_idx:05d}.npy', bev_color)
-                        np.save(bev_elev_path / f'{frame_idx:05d}.npy', bev_elev)
-                        np.save(bev_normal_path / f'{frame_idx:05d}.npy', bev_normal)
-
-                        vis_image = ret['vis_image']
-                        if vis_image is not None:
-                            vis_image.save(vis_path / f'{frame_idx:05d}.png')
-
-        if split == 'train':
-            # Get standardization stats
-            calc_data_stats(output_path)
+    try:
+        # Loop through raw data
+        for split in cfg['split']:
+            split_path = output_path / split
+            split_path.mkdir(exist_ok=True)
+
+            if args.windowed:
+                # Get standardization stats, merged from those of the sequences
+                stats = generate_windows(cfg, split, split_path, grid_size, pool, args)
+                if split == 'train':
+                    stats.save(output_path)
+            else:
+                # Stats of the train split are gathered while processing
+                generate_samples(cfg, split, split_path, grid_size, pool, args)
+    finally:
+        pool.close()
+        pool.join()
 
 
 if __name__ == "__main__":
@@ -286,7 +575,23 @@ if __name__ == "__main__":
     parser.add_argument('--workers', type=int, default=8, help='num_workers')
     parser.add_argument('--job_chunk_size', type=int, default=100)
     parser.add_argument('--save_vis', type=bool, default=True)
+    parser.add_argument('--windowed', action='store_true', help='store every sequence once and slice the windows when training')
+    parser.add_argument('--per_sample_files', action='store_true', help='write one file per sample and bev layer instead of shards')
+    parser.add_argument('--samples_per_shard', type=int, default=4096)
+    parser.add_argument('--stats_only', action='store_true', help='only recompute input_stats.npy of the (existing) dataset')
+    parser.add_argument('--metadata_only', action='store_true', help='only recompute the per-sample metadata of the (existing) dataset')
 
     args = parser.parse_args()
 
-    generate_dataset(args)
+    if args.stats_only or args.metadata_only:
+        cfg_path = str(ROOT_PATH.parent) + "/Experiments/Configs/" + '{}.yaml'.format(args.cfg)
+        cfg = yaml.load(open(cfg_path).read(), Loader=yaml.SafeLoader)
+        dataset_path = DATASETS_PATH / cfg['dataset']['name']
+        if args.stats_only:
+            calc_data_stats(dataset_path, args.workers)
+        if args.metadata_only:
+            for split in cfg['split']:
+                if (dataset_path / split).is_dir():
+                    calc_metadata(dataset_path / split, cfg['Map_config'].get('map_name'), args.workers)
+    else:
+        generate_dataset(args)
@@ -13,22 +13,10 @@ import argparse
 from datetime import datetime
 from BeamNGRL import MPPI_CONFIG_PTH, DATA_PATH, ROOT_PATH
 import time
-from typing import List
+from BeamNGRL.utils.chunked_log import update_log
 import gc
 from pathlib import Path
 
-def update_npy_datafile(buffer: List, filepath):
-    buff_arr = np.array(buffer)
-    if filepath.is_file():
-        # Append to existing data file
-        data_arr = np.load(filepath, allow_pickle=True)
-        data_arr = np.concatenate((data_arr, buff_arr), axis=0)
-        np.save(filepath, data_arr)
-    else:
-        np.save(filepath, buff_arr)
-    return [] # empty buffer
-
-
 def collect_mppi_data(args):
 
     with open(MPPI_CONFIG_PTH / 'MPPI_config.yaml') as f:
@@ -149,13 +137,13 @@ def collect_mppi_data(args):
 
                 print("\nSaving data...")
                 print(f"time: {ts}")
-                timestamps = update_npy_datafile(timestamps, output_path / "timestamps.npy")
-                state_data = update_npy_datafile(state_data, output_path / "state.npy")
-                path_data = update_npy_datafile(path_data, output_path / "bev_path.npy")
-                color_data = update_npy_datafile(color_data, output_path / "bev_color.npy")
-                segmt_data = update_npy_datafile(segmt_data, output_path / "bev_segmt.npy")
-                elev_data = update_npy_datafile(elev_data, output_path / "bev_elev.npy")
-                normal_data = update_npy_datafile(normal_data, output_path / "bev_normal.npy")
+                timestamps = update_log(timestamps, output_path / "timestamps.npy")
+                state_data = update_log(state_data, output_path / "state.npy")
+                path_data = update_log(path_data, output_path / "bev_path.npy")
+                color_data = update_log(color_data, output_path / "bev_color.npy")
+                segmt_data = update_log(segmt_data, output_path / "bev_segmt.npy")
+                elev_data = update_log(elev_data, output_path / "bev_elev.npy")
+                normal_data = update_log(normal_data, output_path / "bev_normal.npy")
 
                 gc.collect()
                 save_prompt_time += float(args.save_every_n_sec)
@@ -2,6 +2,8 @@ import numpy as np
 import torch
 import os
 from typing import Dict, Tuple, Union
+from BeamNGRL.utils.chunked_log import load_log, log_codec
+from BeamNGRL.utils.bev_codec import decode_log
 
 
 
@@ -54,20 +56,20 @@ def get_full_traj(trajectory: Dict) -> Tuple[np.ndarray, np.ndarray]:
 
 
 def load_timestamps(file_name: str, file_path: os.PathLike) -> np.ndarray:
-    timestamp_arr = np.load(file_path / file_name, allow_pickle=True)
+    timestamp_arr = load_log(file_path / file_name, mmap=False)
     timestamp_arr -= timestamp_arr[0] # Start at t = 0.
     return timestamp_arr
 
 
 def get_state_trajectory(file_name: str, file_path: os.PathLike,
                          timestamps: np.ndarray) -> np.ndarray:
-    states_traj = np.load(file_path / file_name, allow_pickle=True)
+    states_traj = load_log(file_path / file_name)
     states_traj = states_traj[..., :15]
     return states_traj
 
 
 def get_controls(file_name: str, file_path: os.PathLike) -> np.ndarray:
-    states_arr = np.load(file_path / file_name, allow_pickle=True)
+    states_arr = load_log(file_path / file_name)
     steer = states_arr[:, [15]]
     throttle = states_arr[:, [16]]
     controls = np.concatenate((steer, throttle), axis=-1)
@@ -75,12 +77,12 @@ def get_controls(file_name: str, file_path: os.PathLike) -> np.ndarray:
 
 
 def load_bev_map(file_name: str, file_path: os.PathLike) -> np.ndarray:
-    map = np.load(file_path / file_name, allow_pickle=True)
-    return map
+    map = load_log(file_path / file_name) ## memory-mapped, frames are only read when used
+    return decode_log(map, log_codec(file_path / file_name)) ## frames of compressed logs are decoded when indexed
 
 
 def load_reset_data(file_name: str, file_path: os.PathLike) -> np.ndarray:
-    reset = np.load(file_path / file_name, allow_pickle=True)
+    reset = load_log(file_path / file_name)
     return reset
 
 
@@ -0,0 +1,195 @@
+import numpy as np
+import ast
+import os
+from functools import reduce
+from pathlib import Path
+from typing import Callable, Dict, List, Union
+from .shard_utils import read_shard_index, write_shard_index
+from .stats_utils import SplitSamples
+
+'''
+Per-sample metadata: one small column per statistic, so that subsets of a dataset (e.g. aggressive driving only) are
+selected from the table without reading any sample:
+
+    <split>/metadata/index.json    samples, columns (dtype) and sequences (name, map) the sequence column refers to
+    <split>/metadata/<column>.npy  [samples]
+
+    sequence, frame                raw sequence (index into the sequences) and keyframe the sample was cut from
+    timestamp                      time of the current state
+    min_vx, mean_vx, max_vx, ...   statistics of the future states (the prediction targets), see STAT_COLUMNS
+
+load_metadata adds the names of the sequences and maps as string columns ('sequence' and 'map', the indices are
+'sequence_id'), and select_samples turns a filter expression over the columns, e.g.
+    "min_vx >= 2 and mean_abs_ax >= 2 and map == 'small_island'"
+or a predicate on the table into sample indices.
+'''
+
+## state features, see network_utils.py
+STATE_IDX = {'roll': 3, 'pitch': 4, 'vx': 6, 'vy': 7, 'ax': 9, 'ay': 10, 'az': 11, 'wx': 12, 'wy': 13, 'wz': 14}
+
+STAT_COLUMNS = [
+    'min_vx', 'mean_vx', 'max_vx', 'mean_speed', 'max_speed',
+    'mean_abs_ax', 'mean_abs_ay', 'mean_abs_az', 'max_abs_ax', 'max_abs_ay',
+    'mean_abs_wx', 'mean_abs_wy', 'mean_abs_wz', 'max_abs_wz',
+    'mean_abs_roll', 'mean_abs_pitch', 'max_abs_roll', 'max_abs_pitch',
+    'mean_abs_steer', 'mean_throttle',
+]
+META_COLUMNS = dict({'sequence': '<i4', 'frame': '<i8', 'timestamp': '<f8'}, **{k: '<f4' for k in STAT_COLUMNS})
+
+
+def metadata_path(split_path: os.PathLike) -> Path:
+    return Path(split_path) / 'metadata'
+
+
+def has_metadata(split_path: os.PathLike) -> bool:
+    return (metadata_path(split_path) / 'index.json').is_file()
+
+
+def sample_metadata(trajectory: Dict) -> Dict:
+    # Statistic columns of a sample, from its future states and controls
+    states = np.asarray(trajectory['future_states'], dtype=np.float64)
+    controls = np.asarray(trajectory['future_controls'], dtype=np.float64)
+    f = {k: states[:, i] for k, i in STATE_IDX.items()}
+    speed = np.hypot(f['vx'], f['vy'])
+    return {
+        'timestamp': float(trajectory['timestamp']),
+        'min_vx': f['vx'].min(), 'mean_vx': f['vx'].mean(), 'max_vx': f['vx'].max(),
+        'mean_speed': speed.mean(), 'max_speed': speed.max(),
+        'mean_abs_ax': np.abs(f['ax']).mean(), 'mean_abs_ay': np.abs(f['ay']).mean(), 'mean_abs_az': np.abs(f['az']).mean(),
+        'max_abs_ax': np.abs(f['ax']).max(), 'max_abs_ay': np.abs(f['ay']).max(),
+        'mean_abs_wx': np.abs(f['wx']).mean(), 'mean_abs_wy': np.abs(f['wy']).mean(), 'mean_abs_wz': np.abs(f['wz']).mean(),
+        'max_abs_wz': np.abs(f['wz']).max(),
+        'mean_abs_roll': np.abs(f['roll']).mean(), 'mean_abs_pitch': np.abs(f['pitch']).mean(),
+        'max_abs_roll': np.abs(f['roll']).max(), 'max_abs_pitch': np.abs(f['pitch']).max(),
+        'mean_abs_steer': np.abs(controls[:, 0]).mean(), 'mean_throttle': controls[:, 1].mean(),
+    }
+
+
+def allocate_metadata(split_path: os.PathLike, num_samples: int, keep: int = 0):
+    '''
+    Creates the columns of num_samples samples, to be filled in any order with MetadataSlots.
+    The first `keep` rows of the existing columns are carried over, for samples appended to a dataset.
+    The table is only readable once write_metadata_index is called, when all the samples are in.
+    '''
+    meta_dir = metadata_path(split_path)
+    meta_dir.mkdir(parents=True, exist_ok=True)
+    (meta_dir / 'index.json').unlink(missing_ok=True)
+    for column, dtype in META_COLUMNS.items():
+        kept = np.load(meta_dir / f'{column}.npy')[:keep] if keep > 0 else None
+        column_file = np.lib.format.open_memmap(meta_dir / f'{column}.npy', mode='w+', dtype=dtype, shape=(num_samples,))
+        if kept is not None:
+            column_file[:keep] = kept
+            column_file.flush()
+        del column_file
+
+
+def write_metadata_index(split_path: os.PathLike, num_samples: int, sequences: List[Dict]):
+    ## sequences: name and map of the raw sequences, in the order of the sequence column
+    write_shard_index(metadata_path(split_path), {
+        'samples': int(num_samples),
+        'columns': META_COLUMNS,
+        'sequences': sequences,
+    })
+
+
+def save_metadata(split_path: os.PathLike, columns: Dict[str, np.ndarray], sequences: List[Dict]):
+    # Whole table at once, replacing the old one
+    meta_dir = metadata_path(split_path)
+    meta_dir.mkdir(parents=True, exist_ok=True)
+    (meta_dir / 'index.json').unlink(missing_ok=True)
+    num_samples = len(columns['sequence'])
+    for column, dtype in META_COLUMNS.items():
+        if len(columns[column]) != num_samples:
+            raise ValueError(f'metadata column {column} has {len(columns[column])} rows, not {num_samples}')
+        np.save(meta_dir / f'{column}.npy', np.asarray(columns[column], dtype=dtype))
+    write_metadata_index(split_path, num_samples, sequences)
+
+
+class MetadataSlots:
+    '''
+    Write access by sample index to the columns made by allocate_metadata, for workers filling them in parallel.
+    '''
+    def __init__(self, split_path: os.PathLike):
+        self.meta_dir = metadata_path(split_path)
+        self.columns = {}
+
+    def column(self, name: str) -> np.ndarray:
+        if name not in self.columns:
+            self.columns[name] = np.load(self.meta_dir / f'{name}.npy', mmap_mode='r+')
+        return self.columns[name]
+
+    def put(self, idx: int, row: Dict):
+        for name, value in row.items():
+            self.column(name)[idx] = value
+
+    def flush(self):
+        for column in self.columns.values():
+            column.flush()
+
+
+def scan_metadata(split_path: os.PathLike, start: int, stop: int) -> Dict[str, np.ndarray]:
+    # Timestamp and statistic columns of samples [start, stop) of a split, for one worker of a parallel scan
+    samples = SplitSamples(split_path)
+    rows = [sample_metadata(samples.get(idx)[0]) for idx in range(start, stop)]
+    return {column: np.array([row[column] for row in rows], dtype=META_COLUMNS[column]) for column in rows[0]}
+
+
+def load_metadata(split_path: os.PathLike) -> Dict[str, np.ndarray]:
+    meta_dir = metadata_path(split_path)
+    index = read_shard_index(meta_dir)
+    table = {column: np.load(meta_dir / f'{column}.npy') for column in index['columns']}
+    names = np.array([s['name'] for s in index['sequences']] + [''])
+    maps = np.array([s.get('map') or '' for s in index['sequences']] + [''])
+    table['sequence_id'] = table.pop('sequence')
+    table['sequence'] = names[table['sequence_id']] # -1 (unknown) -> ''
+    table['map'] = maps[table['sequence_id']]
+    return table
+
+
+class _VectorizeBool(ast.NodeTransformer):
+    ## and / or / not and chained comparisons of arrays -> elementwise numpy functions
+    def visit_BoolOp(self, node):
+        self.generic_visit(node)
+        func = '_all' if isinstance(node.op, ast.And) else '_any'
+        return ast.Call(func=ast.Name(id=func, ctx=ast.Load()), args=node.values, keywords=[])
+
+    def visit_UnaryOp(self, node):
+        self.generic_visit(node)
+        if isinstance(node.op, ast.Not):
+            return ast.Call(func=ast.Name(id='_not', ctx=ast.Load()), args=[node.operand], keywords=[])
+        return node
+
+    def visit_Compare(self, node):
+        self.generic_visit(node)
+        if len(node.ops) == 1:
+            return node
+        operands = [node.left] + node.comparators
+        parts = [ast.Compare(left=a, ops=[op], comparators=[b]) for a, op, b in zip(operands[:-1], node.ops, operands[1:])]
+        return ast.Call(func=ast.Name(id='_all', ctx=ast.Load()), args=parts, keywords=[])
+
+
+def select_samples(table: Dict[str, np.ndarray], sample_filter: Union[str, Callable]) -> np.ndarray:
+    '''
+    Indices of the samples of a metadata table that pass sample_filter: either a python expression over the columns
+    (and / or / not work elementwise, numpy is available as np) or a function of the table returning a boolean mask.
+    '''
+    num_samples = len(table['sequence_id'])
+    if callable(sample_filter):
+        mask = sample_filter(table)
+    else:
+        tree = _VectorizeBool().visit(ast.parse(sample_filter, mode='eval'))
+        code = compile(ast.fix_missing_locations(tree), '<sample_filter>', 'eval')
+        namespace = {
+            '__builtins__': {}, 'np': np, 'abs': np.abs,
+            '_all': lambda *a: reduce(np.logical_and, a), '_any': lambda *a: reduce(np.logical_or, a),
+            '_not': np.logical_not,
+        }
+        namespace.update(table)
+        try:
+            mask = eval(code, namespace)
+        except NameError as e:
+            raise ValueError(f'{e} in sample filter "{sample_filter}", metadata columns: {sorted(table)}')
+    mask = np.asarray(mask)
+    if mask.dtype != bool:
+        raise ValueError(f'sample filter {sample_filter} gives {mask.dtype} values, not a boolean mask')
+    return np.flatnonzero(np.broadcast_to(mask, (num_samples,)))
@@ -0,0 +1,201 @@
+import numpy as np
+import json
+import os
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+'''
+Packed dataset shards: every field of a sample (state, control, past/future trajectories, bev layers) is a fixed-shape
+record, and the records of up to `samples_per_shard` samples are stored back to back in one raw file per field:
+
+    <split>/shards/index.json           fields (dtype, record shape) and shards (name, first sample, number of samples)
+    <split>/shards/<shard>/<field>.bin  records of that field
+
+A sample is found with a binary search over the first-sample offsets, and its fields are views into memory-mapped files,
+so reading a sample opens no file and unpickles nothing.
+'''
+
+TRAJ_FIELDS = [
+    'timestamp', 'state', 'control',
+    'past_timestamps', 'past_states', 'past_controls',
+    'future_timestamps', 'future_states', 'future_controls',
+]
+BEV_FIELDS = ['bev_color', 'bev_elev', 'bev_normal']
+SHARD_FIELDS = TRAJ_FIELDS + BEV_FIELDS
+
+
+def shard_path(split_path: os.PathLike) -> Path:
+    return Path(split_path) / 'shards'
+
+
+def has_shards(split_path: os.PathLike) -> bool:
+    return (shard_path(split_path) / 'index.json').is_file()
+
+
+def read_shard_index(shard_dir: os.PathLike) -> Dict:
+    with open(Path(shard_dir) / 'index.json') as f:
+        return json.load(f)
+
+
+def write_shard_index(shard_dir: os.PathLike, index: Dict):
+    ## written next to the old one and renamed over it, so readers never see half an index
+    tmp_file = Path(shard_dir) / 'index.json.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump(index, f)
+    os.replace(tmp_file, Path(shard_dir) / 'index.json')
+
+
+def field_spec(sample: Dict) -> Dict:
+    return {k: {'dtype': np.asarray(v).dtype.str, 'shape': list(np.shape(v))} for k, v in sample.items()}
+
+
+def allocate_shards(shard_dir: os.PathLike, fields: Dict, num_samples: int, samples_per_shard: int = 4096,
+                    index: Dict = None) -> Dict:
+    '''
+    Creates (sparse) shard files for num_samples samples, to be filled in any order with ShardSlots.
+    Returns their index, which is only written to shard_dir once all the samples are in.
+    With the index of existing shards, the new shards come after them (samples index['samples'] onwards).
+    '''
+    shard_dir = Path(shard_dir)
+    if index is None:
+        index = {'fields': fields, 'shards': [], 'samples': 0}
+    elif index['fields'] != fields:
+        raise ValueError(f'samples with fields {fields} do not match the shards {index["fields"]}')
+    index = {'fields': fields, 'shards': list(index['shards']), 'samples': index['samples'] + int(num_samples)}
+    start = index['samples'] - int(num_samples)
+    for offset in range(start, index['samples'], samples_per_shard):
+        name = f'{len(index["shards"]):05d}'
+        samples = min(samples_per_shard, index['samples'] - offset)
+        (shard_dir / name).mkdir(parents=True, exist_ok=True)
+        for field, spec in fields.items():
+            row_bytes = np.dtype(spec['dtype']).itemsize * int(np.prod(spec['shape'], dtype=np.int64))
+            with open(shard_dir / name / f'{field}.bin', 'wb') as f:
+                f.truncate(samples * row_bytes)
+        index['shards'].append({'name': name, 'offset': offset, 'samples': samples})
+    return index
+
+
+class ShardWriter:
+    '''
+    Appends samples (dicts of arrays, the same fields and record shapes for all of them) to the shards in shard_dir.
+    Shards are preallocated, filled in place and trimmed to their number of samples when they are closed;
+    the index only lists closed shards, so an interrupted conversion leaves a readable (shorter) dataset behind.
+    '''
+    def __init__(self, shard_dir: os.PathLike, samples_per_shard: int = 4096):
+        self.shard_dir = Path(shard_dir)
+        self.shard_dir.mkdir(parents=True, exist_ok=True)
+        self.samples_per_shard = samples_per_shard
+        self.index = {'fields': None, 'shards': [], 'samples': 0}
+        self.shard = None
+        self.count = 0
+
+    def open_shard(self):
+        name = f'{len(self.index["shards"]):05d}'
+        (self.shard_dir / name).mkdir(exist_ok=True)
+        self.shard = {'name': name, 'memmaps': {}}
+        for field, spec in self.index['fields'].items():
+            self.shard['memmaps'][field] = np.memmap(
+                self.shard_dir / name / f'{field}.bin', dtype=np.dtype(spec['dtype']), mode='w+',
+                shape=(self.samples_per_shard,) + tuple(spec['shape']))
+        self.count = 0
+
+    def close_shard(self):
+        name = self.shard['name']
+        memmaps = self.shard.pop('memmaps')
+        row_bytes = {}
+        for field, memmap in memmaps.items():
+            memmap.flush()
+            row_bytes[field] = memmap.itemsize * int(np.prod(memmap.shape[1:], dtype=np.int64))
+        del memmaps, memmap # unmapped before trimming the files
+        for field, size in row_bytes.items():
+            os.truncate(self.shard_dir / name / f'{field}.bin', self.count * size)
+        self.index['shards'].append({'name': name, 'offset': self.index['samples'], 'samples': self.count})
+        self.index['samples'] += self.count
+        write_shard_index(self.shard_dir, self.index)
+        self.shard = None
+
+    def add(self, sample: Dict):
+        if self.index['fields'] is None:
+            self.index['fields'] = field_spec(sample)
+        elif field_spec(sample).keys() != self.index['fields'].keys() or \
+                any(list(np.shape(v)) != self.index['fields'][k]['shape'] for k, v in sample.items()):
+            raise ValueError(f'sample with fields {field_spec(sample)} does not match the shards {self.index["fields"]}')
+        if self.shard is None:
+            self.open_shard()
+        for field, value in sample.items():
+            self.shard['memmaps'][field][self.count] = value
+        self.count += 1
+        if self.count == self.samples_per_shard:
+            self.close_shard()
+
+    def close(self):
+        if self.shard is not None and self.count > 0:
+            self.close_shard()
+        elif self.shard is not None:
+            self.shard = None
+        if self.index['fields'] is not None:
+            write_shard_index(self.shard_dir, self.index)
+
+
+class ShardReader:
+    '''
+    Random access to the samples of the shards in shard_dir. The files are memory-mapped copy-on-write on first use
+    (in each dataloader worker): writing to a returned view never reaches the shards, but it does change what this
+    process reads for that sample afterwards, so treat the views as read-only.
+    '''
+    mode = 'c'
+
+    def __init__(self, shard_dir: os.PathLike, index: Dict = None):
+        self.shard_dir = Path(shard_dir)
+        self.index = read_shard_index(self.shard_dir) if index is None else index
+        self.fields = self.index['fields']
+        self.offsets = np.array([s['offset'] for s in self.index['shards']], dtype=np.int64)
+        self.memmaps = {}
+
+    def __len__(self) -> int:
+        return int(self.index['samples'])
+
+    def locate(self, idx: int) -> Tuple[int, int]:
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError(f'sample {idx} out of range for {len(self)} samples')
+        shard = int(np.searchsorted(self.offsets, idx, side='right')) - 1
+        return shard, idx - int(self.offsets[shard])
+
+    def field(self, shard: int, field: str) -> np.ndarray:
+        key = (shard, field)
+        if key not in self.memmaps:
+            spec = self.fields[field]
+            info = self.index['shards'][shard]
+            self.memmaps[key] = np.memmap(
+                self.shard_dir / info['name'] / f'{field}.bin', dtype=np.dtype(spec['dtype']), mode=self.mode,
+                shape=(info['samples'],) + tuple(spec['shape']))
+        return self.memmaps[key]
+
+    def get(self, idx: int, fields: List[str] = None) -> Dict[str, np.ndarray]:
+        shard, row = self.locate(idx)
+        fields = self.fields.keys() if fields is None else fields
+        return {f: np.asarray(self.field(shard, f)[row]) for f in fields} # plain ndarray views, no copy
+
+    def __getstate__(self):
+        ## memmaps are opened again in each dataloader worker
+        state = self.__dict__.copy()
+        state['memmaps'] = {}
+        return state
+
+
+class ShardSlots(ShardReader):
+    '''
+    Write access by sample index to shards made by allocate_shards, for workers filling them in parallel.
+    '''
+    mode = 'r+'
+
+    def put(self, idx: int, sample: Dict):
+        shard, row = self.locate(idx)
+        for field, value in sample.items():
+            self.field(shard, field)[row] = value
+
+    def flush(self):
+        for memmap in self.memmaps.values():
+            memmap.flush()
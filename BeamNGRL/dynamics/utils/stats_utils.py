@@ -0,0 +1,135 @@
+import numpy as np
+import os
+from glob import glob
+from pathlib import Path
+from typing import Dict, Tuple
+from .shard_utils import ShardReader, has_shards, shard_path, TRAJ_FIELDS, BEV_FIELDS
+from .window_utils import WindowReader, has_windows, window_path
+from BeamNGRL.utils.bev_codec import load_bev
+
+'''
+Dataset statistics (input_stats.npy, read by get_datasets and the FeatureNormalizer) from running moments:
+every sample updates the count, mean and sum of squared deviations (Welford/Chan), and partial results from
+different workers merge exactly, so the stats are those of all the data pooled together whatever the split into chunks.
+    mean:state, std:state      per state feature, over the full (past + current + future) trajectories of all samples
+    mean:control, std:control  same for the controls
+    mean:bev_X, std:bev_X      over all the pixels of all the bev_X maps
+'''
+
+
+class RunningMoments:
+
+    def __init__(self, shape: Tuple = ()):
+        self.n = 0
+        self.mean = np.zeros(shape)
+        self.m2 = np.zeros(shape)
+
+    def merge_moments(self, n: int, mean: np.ndarray, m2: np.ndarray):
+        if n == 0:
+            return
+        total = self.n + n
+        delta = mean - self.mean
+        self.mean = self.mean + delta * (n / total)
+        self.m2 = self.m2 + m2 + delta**2 * (self.n * n / total)
+        self.n = total
+
+    def update(self, x: np.ndarray, axis=0):
+        # x: batch of values, reduced over axis (None: all of them)
+        x = np.asarray(x, dtype=np.float64)
+        n = x.size if axis is None else x.shape[axis]
+        mean = x.mean(axis=axis, keepdims=True)
+        m2 = ((x - mean)**2).sum(axis=axis)
+        self.merge_moments(n, mean.reshape(m2.shape), m2)
+
+    def merge(self, other: 'RunningMoments'):
+        self.merge_moments(other.n, other.mean, other.m2)
+
+    def std(self) -> np.ndarray:
+        # population std, like np.std
+        return np.sqrt(self.m2 / max(self.n, 1))
+
+
+class DatasetStats:
+
+    def __init__(self):
+        self.samples = 0
+        self.moments = {
+            'state': RunningMoments(),
+            'control': RunningMoments(),
+        }
+        self.moments.update({bev_type: RunningMoments() for bev_type in BEV_FIELDS})
+
+    def update(self, trajectory: Dict, bev_maps: Dict):
+        states = np.concatenate((trajectory['past_states'], trajectory['state'][None], trajectory['future_states']), axis=0)
+        controls = np.concatenate((trajectory['past_controls'], trajectory['control'][None], trajectory['future_controls']), axis=0)
+        if self.moments['state'].n == 0:
+            self.moments['state'] = RunningMoments(states.shape[1:])
+            self.moments['control'] = RunningMoments(controls.shape[1:])
+        self.moments['state'].update(states)
+        self.moments['control'].update(controls)
+        for bev_type in BEV_FIELDS:
+            self.moments[bev_type].update(bev_maps[bev_type], axis=None)
+        self.samples += 1
+
+    def merge(self, other: 'DatasetStats'):
+        for name, moments in other.moments.items():
+            if self.moments[name].n == 0:
+                self.moments[name] = RunningMoments(moments.mean.shape)
+            self.moments[name].merge(moments)
+        self.samples += other.samples
+        return self
+
+    def input_stats(self) -> Dict:
+        stats = {}
+        for name, moments in self.moments.items():
+            mean, std = moments.mean, moments.std()
+            if name.startswith('bev_'):
+                mean, std = np.float64(mean), np.float64(std)
+            stats[f'mean:{name}'] = mean
+            stats[f'std:{name}'] = std
+        return stats
+
+    def save(self, dataset_path: os.PathLike):
+        stats = self.input_stats()
+        for name, value in stats.items():
+            print(f'{name} -- {value}')
+        np.save(Path(dataset_path) / 'input_stats.npy', stats, allow_pickle=True)
+
+
+class SplitSamples:
+    '''
+    (trajectory, bev maps) of every sample of a processed split, whichever way it was stored (shards, windows or files)
+    '''
+    def __init__(self, split_path: os.PathLike):
+        self.split_path = Path(split_path)
+        self.reader = None
+        if has_shards(split_path):
+            self.reader = ShardReader(shard_path(split_path))
+            self.num_samples = len(self.reader)
+        elif has_windows(split_path):
+            self.reader = WindowReader(window_path(split_path))
+            self.num_samples = len(self.reader)
+        else:
+            self.num_samples = len(glob(str(self.split_path / 'trajectories') + "/*.npy"))
+
+    def __len__(self) -> int:
+        return self.num_samples
+
+    def get(self, idx: int) -> Tuple[Dict, Dict]:
+        if isinstance(self.reader, ShardReader):
+            sample = self.reader.get(idx)
+            return {k: sample[k] for k in TRAJ_FIELDS}, {k: sample[k] for k in BEV_FIELDS}
+        if isinstance(self.reader, WindowReader):
+            return self.reader.get(idx)
+        name = f'{idx:05d}.npy'
+        trajectory = np.load(self.split_path / 'trajectories' / name, allow_pickle=True).item()
+        return trajectory, {k: load_bev(self.split_path / k / name) for k in BEV_FIELDS}
+
+
+def scan_stats(split_path: os.PathLike, start: int, stop: int) -> DatasetStats:
+    # Stats of samples [start, stop) of a split, for one worker of a parallel scan
+    samples = SplitSamples(split_path)
+    stats = DatasetStats()
+    for idx in range(start, stop):
+        stats.update(*samples.get(idx))
+    return stats
@@ -0,0 +1,152 @@
+import numpy as np
+import os
+import shutil
+from pathlib import Path
+from typing import Dict, Tuple
+from .shard_utils import read_shard_index, write_shard_index, BEV_FIELDS
+
+'''
+Windowed datasets: every raw sequence is stored once, and the past/current/future windows are sliced out of it when
+a sample is read, instead of being written out (and duplicated past_traj_len + future_traj_len + 1 times) per sample:
+
+    <split>/windows/index.json                 past/future lengths and the sequences (name, frames, keyframes, fingerprint)
+    <split>/windows/<sequence>/timestamps.npy  [frames]
+    <split>/windows/<sequence>/states.npy      [frames, 15]
+    <split>/windows/<sequence>/controls.npy    [frames, 2]
+    <split>/windows/<sequence>/keyframes.npy   [keyframes] frame of every valid window (resets and map limits checked)
+    <split>/windows/<sequence>/bev_*.npy       [keyframes, H, W, C] bev maps of the keyframes, the only frames read
+    <split>/windows/<sequence>/stats.npy       DatasetStats of the windows of the sequence (process_data_new.py)
+    <split>/windows/<sequence>/metadata.npz    metadata columns of the windows of the sequence (process_data_new.py)
+
+The fingerprint of a sequence identifies the raw data and settings it was made from, so that unchanged sequences are
+not processed again when more are added.
+'''
+
+BEV_CHUNK = 256 # keyframe bev maps copied at a time
+
+
+def window_path(split_path: os.PathLike) -> Path:
+    return Path(split_path) / 'windows'
+
+
+def has_windows(split_path: os.PathLike) -> bool:
+    return (window_path(split_path) / 'index.json').is_file()
+
+
+def save_sequence(
+        window_dir: os.PathLike, name: str, past_len: int, future_len: int,
+        timestamps: np.ndarray, states: np.ndarray, controls: np.ndarray, keyframes: np.ndarray,
+        bev_seqs: Dict, fingerprint: str = None,
+):
+    '''
+    Stores one raw sequence and its valid keyframes, replacing the sequence if it was stored before.
+    bev_seqs: bev_* -> per-frame bev maps of the whole sequence (memory-mapped logs), only the keyframes are copied.
+    '''
+    window_dir = Path(window_dir)
+    seq_dir = window_dir / name
+    index = read_shard_index(window_dir) if (window_dir / 'index.json').is_file() else \
+        {'past_traj_len': past_len, 'future_traj_len': future_len, 'sequences': []}
+    if (index['past_traj_len'], index['future_traj_len']) != (past_len, future_len):
+        raise ValueError(f'{window_dir} holds windows of {index["past_traj_len"]}/{index["future_traj_len"]} '
+                         f'past/future states, not {past_len}/{future_len}')
+    if seq_dir.exists():
+        remove_sequence(window_dir, name) # including the stats and metadata of the old windows
+        index['sequences'] = [s for s in index['sequences'] if s['name'] != name]
+    seq_dir.mkdir(parents=True)
+
+    keyframes = np.asarray(keyframes, dtype=np.int64)
+    np.save(seq_dir / 'timestamps.npy', np.asarray(timestamps))
+    np.save(seq_dir / 'states.npy', np.asarray(states))
+    np.save(seq_dir / 'controls.npy', np.asarray(controls))
+    np.save(seq_dir / 'keyframes.npy', keyframes)
+    for bev_type, bev_seq in bev_seqs.items():
+        h, w = bev_seq[0].shape[:2]
+        shape = (len(keyframes), h, w, int(np.prod(bev_seq[0].shape[2:])))
+        if len(keyframes) == 0:
+            np.save(seq_dir / f'{bev_type}.npy', np.zeros(shape, dtype=bev_seq[0].dtype))
+            continue
+        out = np.lib.format.open_memmap(seq_dir / f'{bev_type}.npy', mode='w+', dtype=bev_seq[0].dtype, shape=shape)
+        for i in range(0, len(keyframes), BEV_CHUNK):
+            chunk = keyframes[i:i + BEV_CHUNK]
+            out[i:i + len(chunk)] = np.asarray(bev_seq[chunk]).reshape((len(chunk),) + out.shape[1:])
+        out.flush()
+        del out
+
+    index['sequences'].append({'name': name, 'frames': len(states), 'keyframes': len(keyframes), 'fingerprint': fingerprint})
+    write_shard_index(window_dir, index)
+
+
+def remove_sequence(window_dir: os.PathLike, name: str):
+    ## out of the index first, so a sequence being removed is never read
+    window_dir = Path(window_dir)
+    if (window_dir / 'index.json').is_file():
+        index = read_shard_index(window_dir)
+        index['sequences'] = [s for s in index['sequences'] if s['name'] != name]
+        write_shard_index(window_dir, index)
+    shutil.rmtree(window_dir / name, ignore_errors=True)
+
+
+class WindowReader:
+    '''
+    Random access to the windows of a windowed dataset. The sequence files are memory-mapped copy-on-write on first use
+    (in each dataloader worker); windows are views into them except for the states, which are moved to the keyframe's
+    base frame (a copy of the window). Treat the views as read-only, see ShardReader.
+    '''
+    def __init__(self, window_dir: os.PathLike):
+        self.window_dir = Path(window_dir)
+        self.index = read_shard_index(self.window_dir)
+        self.past_len = self.index['past_traj_len']
+        self.future_len = self.index['future_traj_len']
+        self.sequences = [s['name'] for s in self.index['sequences']]
+        counts = np.array([s['keyframes'] for s in self.index['sequences']], dtype=np.int64)
+        self.offsets = np.concatenate(([0], np.cumsum(counts)))
+        self.arrays = {}
+
+    def __len__(self) -> int:
+        return int(self.offsets[-1])
+
+    def locate(self, idx: int) -> Tuple[int, int]:
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError(f'sample {idx} out of range for {len(self)} samples')
+        seq = int(np.searchsorted(self.offsets, idx, side='right')) - 1
+        return seq, idx - int(self.offsets[seq])
+
+    def array(self, seq: int, name: str) -> np.ndarray:
+        key = (seq, name)
+        if key not in self.arrays:
+            self.arrays[key] = np.load(self.window_dir / self.sequences[seq] / f'{name}.npy', mmap_mode='c')
+        return self.arrays[key]
+
+    def get(self, idx: int) -> Tuple[Dict, Dict]:
+        ## -> trajectory dict and bev maps of the sample, as process_data would have saved them
+        seq, k = self.locate(idx)
+        frame = int(self.array(seq, 'keyframes')[k])
+        start, stop = frame - self.past_len, frame + self.future_len + 1
+        curr = self.past_len
+
+        timestamps = np.asarray(self.array(seq, 'timestamps')[start:stop])
+        controls = np.asarray(self.array(seq, 'controls')[start:stop])
+        states = np.array(self.array(seq, 'states')[start:stop])
+        states[:, :3] -= states[curr, :3].copy() # base-frame trajectory
+
+        trajectory = {
+            'timestamp': timestamps[curr],
+            'state': states[curr],
+            'control': controls[curr],
+            'past_timestamps': timestamps[:curr],
+            'past_states': states[:curr],
+            'past_controls': controls[:curr],
+            'future_timestamps': timestamps[curr + 1:],
+            'future_states': states[curr + 1:],
+            'future_controls': controls[curr + 1:],
+        }
+        bev_maps = {bev_type: np.asarray(self.array(seq, bev_type)[k]) for bev_type in BEV_FIELDS}
+        return trajectory, bev_maps
+
+    def __getstate__(self):
+        ## memmaps are opened again in each dataloader worker
+        state = self.__dict__.copy()
+        state['arrays'] = {}
+        return state
@@ -1,6 +1,7 @@
 import gym
 from gym.envs.registration import register
 from BeamNGRL.gym.envs import OffroadSmallIsland, OffroadUtah
+from BeamNGRL.gym.vector_env import VectorEnv
 
 register(
     id='offroad-small-island-v0',
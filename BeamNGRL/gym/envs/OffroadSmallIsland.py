@@ -6,7 +6,7 @@ from BeamNGRL.utils.planning import update_goal
 from gym import spaces
 
 class OffroadSmallIsland(gym.Env):
-    def __init__(self, hal_config_path = None, config_path=None, args=None):
+    def __init__(self, hal_config_path = None, config_path=None, args=None, fake_beamng=None, port=64256):
         if config_path is None:
             print("no config file provided!")
             exit()
@@ -76,11 +76,16 @@ class OffroadSmallIsland(gym.Env):
             accel_config=hal_Config["mavros"],
             burn_time=Config["burn_time"],
             run_lockstep=Config["run_lockstep"],
+            fake_beamng=fake_beamng, ## stand-in simulator for benchmarking, see BeamNG/fake_beamngpy.py
+            port=port, ## one port per simulator instance when running several envs, see gym/vector_env.py
         )
         for i in range(10):
             self.bng_interface.send_ctrl(action)
             self.bng_interface.state_poll()
 
+    def close(self):
+        self.bng_interface.close() ## sensor threads and the simulator connections
+
     def reset(self):
         self.bng_interface.reset()
         obs, _, _, info = self.step(np.zeros(2,dtype=np.float64))
@@ -0,0 +1,188 @@
+import numpy as np
+
+import atexit
+import multiprocessing as mp
+import traceback
+from multiprocessing import shared_memory
+
+'''
+Runs M gym envs (OffroadSmallIsland, OffroadUtah, ...) in worker processes and steps them in parallel, so a step costs
+about as much as the slowest env instead of the sum of all of them.
+The observations are written by the workers straight into shared memory buffers of shape [M, *space.shape], allocated once
+from the envs' observation_space; only the actions, rewards, dones and infos go through the pipes.
+Every worker boots its own simulator connection: give the envs different ports (or hosts) to run against separate
+BeamNG instances, or fake_beamng to run without a simulator. For the headless backend use headless_sim directly,
+it already steps all of its cars in one call.
+An exception in a worker comes back as a RuntimeError from the call (with the worker's traceback), and the worker keeps
+running, so the env can still be reset or closed. close() closes every env, which closes its simulator connection.
+
+    env_fns = [functools.partial(OffroadSmallIsland, hal_config_path=..., config_path=..., args=args, port=64256 + i) for i in range(4)]
+    envs = VectorEnv(env_fns)
+    obs, infos = envs.reset()
+    obs, rewards, dones, infos = envs.step(actions) ## actions: [M, 2]
+'''
+
+def worker(index, env_fn, pipe):
+    env = None
+    blocks = []
+    try:
+        env = env_fn()
+        pipe.send(("ok", (env.observation_space, env.action_space)))
+        _, specs = pipe.recv()
+        buffers = {}
+        for key, (name, shape, dtype) in specs.items():
+            ## the workers share the parent's resource tracker, so unlinking stays with the parent (VectorEnv.close)
+            shm = shared_memory.SharedMemory(name=name)
+            blocks.append(shm)
+            buffers[key] = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+        def write(obs):
+            for key, buffer in buffers.items():
+                buffer[index] = np.asarray(obs[key]).reshape(buffer.shape[1:])
+
+        while True:
+            command, data = pipe.recv()
+            try:
+                if command == "step":
+                    result = env.step(data)
+                    if result is None:
+                        raise RuntimeError("env.step failed, the env printed the error above")
+                    obs, reward, done, info = result
+                    write(obs)
+                    pipe.send(("ok", (reward, done, info)))
+                elif command == "reset":
+                    obs, info = env.reset()
+                    write(obs)
+                    pipe.send(("ok", info))
+                elif command == "close":
+                    ## closed before answering, so that a failure to close gets back to the parent too
+                    closing, env = env, None
+                    closing.close()
+                    pipe.send(("ok", None))
+                    break
+                else:
+                    raise ValueError("unknown command {}".format(command))
+            except Exception:
+                ## the worker keeps serving after an error, the parent decides whether to reset or close the env
+                pipe.send(("error", traceback.format_exc()))
+                if command == "close":
+                    break
+    except Exception:
+        pipe.send(("error", traceback.format_exc()))
+    finally:
+        for shm in blocks:
+            shm.close()
+        if env is not None:
+            try:
+                env.close()
+            except Exception:
+                traceback.print_exc()
+
+
+class VectorEnv():
+    '''
+    env_fns: one callable per env that builds it inside the worker. With the default "spawn" start method they have
+             to be picklable (functools.partial of the env class, not a lambda).
+    copy: return copies of the observations. By default the returned arrays are views of the shared buffers,
+          which the next step/reset overwrites.
+    '''
+    def __init__(self, env_fns, copy=False, context="spawn"):
+        self.num_envs = len(env_fns)
+        self.copy = copy
+        self.closed = False
+        self.blocks = []
+        self.buffers = {}
+        ctx = mp.get_context(context)
+        self.pipes = []
+        self.processes = []
+        for index, env_fn in enumerate(env_fns):
+            parent_pipe, child_pipe = ctx.Pipe()
+            process = ctx.Process(target=worker, args=(index, env_fn, child_pipe), daemon=True)
+            process.start()
+            child_pipe.close()
+            self.pipes.append(parent_pipe)
+            self.processes.append(process)
+        atexit.register(self.close)
+
+        ## the envs boot their simulators in parallel, the first one to answer defines the spaces
+        spaces = self.receive_all()
+        self.observation_space, self.action_space = spaces[0]
+        specs = {}
+        for key, space in self.observation_space.spaces.items():
+            shape = (self.num_envs,) + tuple(space.shape)
+            dtype = np.dtype(space.dtype)
+            shm = shared_memory.SharedMemory(create=True, size=max(int(np.prod(shape))*dtype.itemsize, 1))
+            self.blocks.append(shm)
+            self.buffers[key] = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+            specs[key] = (shm.name, shape, dtype.str)
+        for pipe in self.pipes:
+            pipe.send(("buffers", specs))
+
+    def receive_all(self, indices=None):
+        indices = range(self.num_envs) if indices is None else indices
+        results = []
+        errors = []
+        for i in indices:
+            try:
+                status, data = self.pipes[i].recv()
+            except (EOFError, OSError):
+                status, data = "error", "the worker died"
+            if status == "error":
+                errors.append("env {}:\n{}".format(i, data))
+            results.append(data)
+        if len(errors):
+            raise RuntimeError("\n".join(errors))
+        return results
+
+    def observations(self):
+        if self.copy:
+            return {key: np.copy(buffer) for key, buffer in self.buffers.items()}
+        return self.buffers
+
+    def reset(self, indices=None):
+        ## resets all envs, or only the ones in indices (the others keep their last observation)
+        indices = range(self.num_envs) if indices is None else indices
+        for i in indices:
+            self.pipes[i].send(("reset", None))
+        infos = self.receive_all(indices)
+        return self.observations(), infos
+
+    def step_async(self, actions):
+        for i, pipe in enumerate(self.pipes):
+            pipe.send(("step", np.asarray(actions[i])))
+
+    def step_wait(self):
+        results = self.receive_all()
+        rewards = np.array([r[0] for r in results], dtype=np.float64)
+        dones = np.array([r[1] for r in results], dtype=bool)
+        infos = [r[2] for r in results]
+        return self.observations(), rewards, dones, infos
+
+    def step(self, actions):
+        self.step_async(actions)
+        return self.step_wait()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        for pipe, process in zip(self.pipes, self.processes):
+            try:
+                if process.is_alive():
+                    pipe.send(("close", None))
+                    status, data = pipe.recv()
+                    if status == "error":
+                        print("failed to close an env:\n" + data)
+            except (EOFError, OSError):
+                pass
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        self.buffers = {}
+        for shm in self.blocks:
+            try:
+                shm.close()
+            except BufferError:
+                pass ## the caller still holds a view, the mapping goes away with the process.
+            shm.unlink()
+        self.blocks = []
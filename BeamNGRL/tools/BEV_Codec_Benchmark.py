@@ -0,0 +1,84 @@
+import numpy as np
+import time
+import io
+import argparse
+from pathlib import Path
+from BeamNGRL import DATASETS_PATH
+from BeamNGRL.utils.bev_codec import bev_codec, decode, load_bev
+
+## Bytes per frame and encode/decode throughput of bev_codec settings, on frames of a processed dataset
+## (--dataset name, reads train/bev_*) or on synthetic terrain when no dataset is given.
+##   python BEV_Codec_Benchmark.py --dataset my_dataset --frames 200
+SETTINGS = {
+    "png/oct16": dict(normal="oct16", color="png"),
+    "png/oct8": dict(normal="oct8", color="png"),
+    "jpg95/oct8": dict(normal="oct8", color="jpg", jpeg_quality=95),
+}
+LAYERS = ["bev_color", "bev_elev", "bev_normal"]
+
+def synthetic_frames(n_frames, size=64, seed=0):
+    ## smooth random terrain with its normals and a color image that follows it, roughly what the sim produces
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0, 2*np.pi, size)
+    frames = {layer: [] for layer in LAYERS}
+    for i in range(n_frames):
+        a, b, c = rng.uniform(0.2, 1.5, 3)
+        elev = (a*np.sin(b*x)[None, :]*np.cos(c*x)[:, None] + 0.02*rng.standard_normal((size, size))).astype(np.float32)
+        gy, gx = np.gradient(elev, 0.25)
+        normal = np.stack([-gx, -gy, np.ones_like(elev)], axis=-1)
+        normal /= np.linalg.norm(normal, axis=-1, keepdims=True)
+        shade = np.clip(128 + 60*elev, 0, 255)
+        color = np.stack([shade*0.6, shade*0.8, shade], axis=-1) + rng.integers(0, 12, (size, size, 3))
+        frames["bev_color"].append(np.clip(color, 0, 255).astype(np.uint8))
+        frames["bev_elev"].append(elev[..., None])
+        frames["bev_normal"].append(normal.astype(np.float32))
+    return frames
+
+def dataset_frames(name, n_frames):
+    frames = {}
+    for layer in LAYERS:
+        layer_dir = DATASETS_PATH / name / "train" / layer
+        files = sorted(set(f.with_suffix("") for f in layer_dir.glob("*.np[yz]")))[:n_frames]
+        if len(files) == 0:
+            raise ValueError("no frames in {}".format(layer_dir))
+        frames[layer] = [load_bev(f) for f in files]
+    return frames
+
+def stored_bytes(fields):
+    ## size of the .npz bev_codec.save would write
+    buffer = io.BytesIO()
+    np.savez(buffer, **fields)
+    return buffer.getbuffer().nbytes
+
+def benchmark(frames, settings):
+    print("{:<12} {:<11} {:>12} {:>12} {:>8} {:>12} {:>12} {:>10}".format(
+        "setting", "layer", "raw B/frame", "enc B/frame", "ratio", "enc frame/s", "dec frame/s", "max error"))
+    for setting_name, setting in settings.items():
+        codec = bev_codec(**setting)
+        for layer in LAYERS:
+            layer_frames = frames[layer]
+            start = time.perf_counter()
+            encoded = [codec.encode(layer, frame) for frame in layer_frames]
+            encode_time = time.perf_counter() - start
+            start = time.perf_counter()
+            decoded = [decode(fields) for fields in encoded]
+            decode_time = time.perf_counter() - start
+            raw_bytes = np.mean([stored_bytes({"data": frame}) for frame in layer_frames])
+            enc_bytes = np.mean([stored_bytes(fields) for fields in encoded])
+            error = max(np.abs(d.astype(np.float64) - f).max() for d, f in zip(decoded, layer_frames))
+            print("{:<12} {:<11} {:>12.0f} {:>12.0f} {:>8.2f} {:>12.0f} {:>12.0f} {:>10.4f}".format(
+                setting_name, layer, raw_bytes, enc_bytes, raw_bytes/enc_bytes,
+                len(layer_frames)/encode_time, len(layer_frames)/decode_time, error))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dataset", type=str, default=None, help="processed dataset in data/datasets, synthetic frames if not given")
+    parser.add_argument("--frames", type=int, default=200, help="number of frames per layer")
+    parser.add_argument("--size", type=int, default=64, help="bev size in pixels of the synthetic frames")
+    args = parser.parse_args()
+    if args.dataset is None:
+        frames = synthetic_frames(args.frames, args.size)
+    else:
+        frames = dataset_frames(args.dataset, args.frames)
+    benchmark(frames, SETTINGS)
@@ -0,0 +1,203 @@
+import numpy as np
+import os
+import time
+import argparse
+from pathlib import Path
+from types import SimpleNamespace
+import BeamNGRL
+from BeamNGRL.utils.planning import update_goal
+
+ROOT_PATH = Path(BeamNGRL.__file__).parent
+DATA_PATH = ROOT_PATH.parent / 'data'
+
+## measures the overhead of the interface itself by running it against the fake simulator (BeamNG/fake_beamngpy.py).
+## Every number here is time spent in python, plus `latency` per request to the fake simulator.
+
+class timings():
+    def __init__(self):
+        self.samples = {}
+
+    def time(self, name, fn, *args, **kwargs):
+        start = time.perf_counter()
+        out = fn(*args, **kwargs)
+        self.samples.setdefault(name, []).append(time.perf_counter() - start)
+        return out
+
+    def report(self, title, ticks=None, wall_time=None, requests=None):
+        print("\n" + title)
+        for name, samples in self.samples.items():
+            ms = np.array(samples)*1e3
+            print("  {:<16} mean {:8.3f} ms   p50 {:8.3f} ms   p99 {:8.3f} ms   ({} calls)".format(
+                name, ms.mean(), np.percentile(ms, 50), np.percentile(ms, 99), len(ms)))
+        if ticks is not None and wall_time is not None:
+            print("  {} ticks in {:.2f} s: {:.1f} ticks/s".format(ticks, wall_time, ticks/wall_time))
+        if requests is not None and ticks:
+            print("  {:.1f} simulator requests per tick".format(requests/ticks))
+
+
+def get_map_config(args):
+    return {
+        "map_name": args.map_name,
+        "map_size": args.map_size,
+        "map_res": args.map_res,
+        "elevation_range": 4.0,
+        "rotate": args.rotate,
+    }
+
+def get_interface(args, fake_beamng):
+    if args.interface == "new":
+        from BeamNGRL.BeamNG.beamng_interface_new import get_beamng_default
+    else:
+        from BeamNGRL.BeamNG.beamng_interface import get_beamng_default
+    return get_beamng_default(
+        start_pos=np.array([-67, 336, 34.5]),
+        start_quat=np.array([0, 0, 0.3826834, 0.9238795]),
+        map_config=get_map_config(args),
+        path_to_maps=args.path_to_maps,
+        run_lockstep=True,
+        traffic_config=get_traffic_config(args),
+        fake_beamng=fake_beamng,
+    )
+
+def get_traffic_config(args):
+    ## parked traffic scattered over the map (the fake simulator doesn't drive them), only the interface's per tick cost matters
+    if args.traffic == 0:
+        return {"enable": False}
+    rng = np.random.default_rng(0)
+    half = 0.45*args.map_extent
+    return {
+        "enable": True,
+        "vids": ["traffic_{}".format(i) for i in range(args.traffic)],
+        "car_makes": ["sunburst"]*args.traffic,
+        "car_models": ["offroad"]*args.traffic,
+        "start_poses": [[x, y, 0.0] for x, y in rng.uniform(-half, half, (args.traffic, 2))],
+        "start_quats": [[0, 0, 0, 1]]*args.traffic,
+    }
+
+def bench_interface(args, fake_beamng):
+    bng = get_interface(args, fake_beamng)
+    t = timings()
+    action = np.array([0.2, 0.5])
+    requests = bng.bng.requests
+    start = time.perf_counter()
+    for _ in range(args.ticks):
+        t.time("send_ctrl", bng.send_ctrl, action, speed_ctrl=True, speed_max=20, Kp=2, Ki=0.05, Kd=0.0, FF_gain=0.0)
+        t.time("state_poll", bng.state_poll)
+    wall_time = time.perf_counter() - start
+    requests = bng.bng.requests - requests
+    for _ in range(args.ticks):
+        t.time("gen_BEVmap", bng.gen_BEVmap)
+    for _ in range(args.ticks//args.skips):
+        t.time("step_n({})".format(args.skips), bng.step_n, args.skips, action, record=True)
+    t.report("interface ({}), one tick = send_ctrl + state_poll".format(args.interface), args.ticks, wall_time, requests)
+
+def bench_gym(args, fake_beamng):
+    ## the envs read their configs and waypoints relative to the working directory, like the gym examples
+    from BeamNGRL.gym.envs import OffroadSmallIsland
+    env = OffroadSmallIsland(
+        hal_config_path=str(ROOT_PATH.parent) + "/Configs/offroad.yaml",
+        config_path=str(ROOT_PATH.parent) + "/Experiments/Configs/gym_experiment.yaml",
+        args=SimpleNamespace(host_IP=None, remote=False),
+        fake_beamng=fake_beamng,
+    )
+    t = timings()
+    t.time("reset", env.reset)
+    action = np.array([0.2, 0.5])
+    requests = env.bng_interface.bng.requests
+    start = time.perf_counter()
+    for _ in range(args.ticks):
+        t.time("env.step", env.step, action)
+    wall_time = time.perf_counter() - start
+    t.report("gym env (OffroadSmallIsland)", args.ticks, wall_time, env.bng_interface.bng.requests - requests)
+
+def bench_experiment(args, fake_beamng):
+    ## the simulator side of the Experiment_runner loop: skips physics steps per control step, BEV to torch and the speed controller.
+    ## The MPPI controller itself is not part of this, it doesn't depend on the interface.
+    import torch
+    bng = get_interface(args, fake_beamng)
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    dtype = torch.float
+    target_WP = np.array([[-67, 336], [0, 400], [100, 400]], dtype=np.float64)
+    goal, current_wp_index = None, 0
+    action = np.zeros(2)
+    t = timings()
+    requests = bng.bng.requests
+    start = time.perf_counter()
+    for _ in range(args.ticks//args.skips):
+        if args.poll_loop:
+            for _ in range(args.skips):
+                t.time("state_poll", bng.state_poll)
+        else:
+            t.time("step_n", bng.step_n, args.skips, record=True)
+        state = np.copy(bng.state)
+        goal, success, current_wp_index = update_goal(goal, state[:2], target_WP, current_wp_index, 6.0)
+        t.time("BEV to torch", lambda: (
+            torch.from_numpy(bng.BEV_heght).to(device=device, dtype=dtype),
+            torch.from_numpy(bng.BEV_normal).to(device=device, dtype=dtype),
+            torch.from_numpy(bng.BEV_path).to(device=device, dtype=dtype)/255,
+        ))
+        t.time("send_ctrl", bng.send_ctrl, action, speed_ctrl=True, speed_max=20, Kp=2, Ki=0.05, Kd=0.0, FF_gain=0.0)
+    wall_time = time.perf_counter() - start
+    control_steps = args.ticks//args.skips
+    t.report("experiment loop ({} per control step, {} physics steps each)".format("state_poll loop" if args.poll_loop else "step_n", args.skips),
+             control_steps, wall_time, bng.bng.requests - requests)
+
+def bench_headless(args):
+    ## num_vehicles cars on SimpleCarDynamics without any simulator (get_beamng_nobeam), one tick is one step of one car
+    import yaml
+    from BeamNGRL.BeamNG.beamng_interface import get_beamng_nobeam
+    from BeamNGRL.control.UW_mppi.Dynamics.SimpleCarDynamics import SimpleCarDynamics
+    with open(str(ROOT_PATH.parent) + "/Experiments/Configs/Control_Eval_Config.yaml") as f:
+        Dynamics_config = yaml.safe_load(f)["Dynamics_config"]
+    sim = get_beamng_nobeam(
+        SimpleCarDynamics,
+        start_pos=np.array([-67, 336, 34.5]),
+        start_quat=np.array([0, 0, 0.3826834, 0.9238795]),
+        map_config=get_map_config(args),
+        path_to_maps=args.path_to_maps,
+        Dynamics_config=Dynamics_config,
+        num_vehicles=args.num_vehicles,
+        device=args.device,
+    )
+    action = np.tile([0.2, 0.5], (args.num_vehicles, 1))
+    t = timings()
+    start = time.perf_counter()
+    for _ in range(args.ticks//args.skips):
+        t.time("step({})".format(args.skips), sim.step, action, steps=args.skips)
+    wall_time = time.perf_counter() - start
+    t.report("headless ({} cars on {})".format(args.num_vehicles, args.device), (args.ticks//args.skips)*args.skips*args.num_vehicles, wall_time)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--target", type=str, nargs='+', default=["interface", "gym", "experiment"], help="what to benchmark: interface, gym, experiment, headless")
+    parser.add_argument("--interface", type=str, default="new", help="new (beamng_interface_new) or default (beamng_interface)")
+    parser.add_argument("--ticks", type=int, default=500, help="number of physics steps to run for each benchmark")
+    parser.add_argument("--skips", type=int, default=5, help="physics steps per control step")
+    parser.add_argument("--poll_loop", action='store_true', help="experiment loop polls every physics step instead of using step_n")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every request to the fake simulator")
+    parser.add_argument("--states", type=str, default=None, help="npy file with recorded states [T, 17] to replay instead of the scripted vehicle")
+    parser.add_argument("--recording", type=str, default=None, help="sensor_recorder .npz to play back through the interface")
+    parser.add_argument("--num_vehicles", type=int, default=64, help="number of cars for the headless benchmark")
+    parser.add_argument("--device", type=str, default="cpu", help="torch device for the headless benchmark")
+    parser.add_argument("--traffic", type=int, default=0, help="number of traffic cars for the interface benchmarks")
+    parser.add_argument("--map_extent", type=float, default=1024, help="size of the map in meters, the traffic is spread over it")
+    parser.add_argument("--map_name", type=str, default="small_island", help="map to use for the BEV")
+    parser.add_argument("--map_size", type=int, default=16, help="BEV size in meters")
+    parser.add_argument("--map_res", type=float, default=0.25, help="BEV resolution in meters per pixel")
+    parser.add_argument("--rotate", action='store_true', help="rotate the BEV with the vehicle")
+    parser.add_argument("--path_to_maps", type=str, default=DATA_PATH.__str__(), help="directory containing map_data/")
+    args = parser.parse_args()
+
+    fake_beamng = {"latency": args.latency, "states": args.states, "recording": args.recording}
+    for target in args.target:
+        if target == "interface":
+            bench_interface(args, fake_beamng)
+        elif target == "gym":
+            bench_gym(args, fake_beamng)
+        elif target == "experiment":
+            bench_experiment(args, fake_beamng)
+        elif target == "headless":
+            bench_headless(args)
+        else:
+            print("unknown target {}, skipping..".format(target))
@@ -16,6 +16,7 @@ import json
 import BeamNGRL
 import zipfile
 import faulthandler
+from BeamNGRL.tools.Path_Distance import compute_path_distance
 
 faulthandler.enable()
 
@@ -223,6 +224,8 @@ def main(config_path, args):
                     except:
                         print("no nodes on line: ", i)
 
+            ## signed distance to the trails, from the sharp polylines before they get blurred
+            np.save(map_dir_name + '/path_distance.npy', compute_path_distance(path_map, resolution))
             path_map = cv2.blur(path_map, (32, 32))
 
             cv2.imwrite(map_dir_name + '/paths.png', path_map)
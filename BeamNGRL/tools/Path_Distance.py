@@ -0,0 +1,55 @@
+import cv2
+import numpy as np
+import os
+from pathlib import Path
+import argparse
+import BeamNGRL
+
+ROOT_PATH = Path(BeamNGRL.__file__).parent
+DATA_PATH = ROOT_PATH.parent / 'data'
+IMAGE_RESOLUTION = 0.1 ## resolution of the map images produced by Map_Extraction
+MAX_DISTANCE = 1e4 ## meters, float16 tops out at 65504 and we don't care about anything this far from a trail anyway
+
+def compute_path_distance(path_map, resolution=IMAGE_RESOLUTION, threshold=128):
+    '''
+    signed distance (in meters) to the trail network. Negative on the trail, positive off the trail.
+    path_map: paths.png as written by Map_Extraction, trails are dark on a white background.
+    The threshold picks the edge of the (blurred) trail, 128 is the middle of the blur, i.e. the edge of the original polyline.
+    '''
+    if path_map.ndim == 3:
+        path_map = path_map[..., 0]
+    trail = (path_map < threshold).astype(np.uint8)
+    if not trail.any():
+        print("no trails on this map, the path distance is MAX_DISTANCE everywhere")
+        return np.full(path_map.shape, MAX_DISTANCE, dtype=np.float16)
+    ## distanceTransform measures the distance of every non-zero pixel to the nearest zero pixel
+    outside = cv2.distanceTransform(1 - trail, cv2.DIST_L2, cv2.DIST_MASK_PRECISE)
+    inside = cv2.distanceTransform(trail, cv2.DIST_L2, cv2.DIST_MASK_PRECISE)
+    distance = (outside - inside)*resolution
+    return np.clip(distance, -MAX_DISTANCE, MAX_DISTANCE).astype(np.float16)
+
+def main(map_names, path_to_maps, overwrite=False):
+    for map_name in map_names:
+        map_dir_name = path_to_maps + f'/map_data/{map_name}'
+        if not os.path.exists(map_dir_name + '/paths.png'):
+            print("no paths.png for {}, skipping..".format(map_name))
+            continue
+        if os.path.exists(map_dir_name + '/path_distance.npy') and not overwrite:
+            print("path distance for {} exists, skipping...".format(map_name))
+            continue
+        path_map = cv2.imread(map_dir_name + '/paths.png')
+        distance = compute_path_distance(path_map)
+        np.save(map_dir_name + '/path_distance.npy', distance)
+        print("saved path distance for {}".format(map_name))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--map_name", type=str, nargs='+', default=None, help="map(s) to process, all maps in map_data by default")
+    parser.add_argument("--path_to_maps", type=str, default=DATA_PATH.__str__(), help="directory containing map_data/")
+    parser.add_argument("--overwrite", action='store_true', help="recompute the distance field even if it already exists")
+    args = parser.parse_args()
+    map_names = args.map_name
+    if map_names is None:
+        map_names = sorted(os.listdir(args.path_to_maps + '/map_data'))
+    main(map_names, args.path_to_maps, args.overwrite)
@@ -0,0 +1,83 @@
+import numpy as np
+import os
+import argparse
+import tempfile
+from pathlib import Path
+import BeamNGRL
+from BeamNGRL.BeamNG.session_pool import session_pool
+
+ROOT_PATH = Path(BeamNGRL.__file__).parent
+DATA_PATH = ROOT_PATH.parent / 'data'
+
+## runs session_pool (BeamNG/session_pool.py) against the fake simulator (BeamNG/fake_beamngpy.py): reusing a session,
+## replacing it when the setup changes, and closing it. Fails with an AssertionError if the pool misbehaves.
+
+def get_kwargs(args, start_pos, map_size=16, camera=False):
+    camera_config = {
+        "enable": camera, "fps": 30, "pos": [0, 0, 0.5], "dir": [0, -1, 0], "up": [0, 0, 1], "fov": 87,
+        "width": 64, "height": 48, "annotation": False,
+    }
+    return dict(
+        start_pos=np.array(start_pos, dtype=np.float64),
+        start_quat=np.array([0, 0, 0.3826834, 0.9238795]),
+        map_config={"map_name": args.map_name, "map_size": map_size, "map_res": 0.25, "elevation_range": 4.0},
+        path_to_maps=args.path_to_maps,
+        camera_config=camera_config,
+        run_lockstep=True,
+        traffic_config={"enable": False},
+        fake_beamng={"latency": 0.0},
+        async_mode=camera,
+    )
+
+def check_reuse(args, pool, tmp_dir):
+    ## same setup: the running session comes back, at the new start pose and without anything from the previous run
+    bng = pool.get(**get_kwargs(args, [-67, 336, 0]))
+    recording = os.path.join(tmp_dir, "previous_run.npz")
+    bng.start_recording(recording)
+    for _ in range(20):
+        bng.step_n(5, np.array([0.3, 0.8]))
+    assert np.linalg.norm(bng.state[6:9]) > 1, "the car should be moving before the reuse"
+
+    start_pos = [-60, 330, 0]
+    reused = pool.get(**get_kwargs(args, start_pos))
+    assert reused is bng and pool.created == 1 and pool.reused == 1
+    assert bng.recorder is None and os.path.exists(recording), "the previous run's recording should be saved and stopped"
+    assert bng.state is None and np.allclose(bng.A, bng.Gravity) and np.allclose(bng.last_vel_wf, 0)
+    assert np.isclose(bng.start_pos[2], bng.get_height(start_pos)), "the start pose should be put on the ground"
+    states, timestamps = bng.step_n(5, record=True)
+    assert np.allclose(states, states[-1]), "no frames interpolated from the previous run"
+    assert np.allclose(states[-1][:2], start_pos[:2], atol=0.5)
+    print("reuse: ok")
+    return bng
+
+def check_mismatch(args, pool, bng):
+    ## a different setup on the same simulator closes the old session and builds a new one
+    other = pool.get(**get_kwargs(args, [-67, 336, 0], map_size=32))
+    assert other is not bng and pool.created == 2
+    assert bng.bng.closed, "the replaced session should be closed"
+    assert len(pool.sessions) == 1
+    print("setup mismatch: ok")
+
+def check_close(args, pool):
+    ## closing stops the sensor threads along with the simulator connection
+    bng = pool.get(**get_kwargs(args, [-67, 336, 0], camera=True))
+    threads = list(bng.sensor_threads.values())
+    assert len(threads) == 1 and threads[0].thread.is_alive()
+    bng.step_n(5)
+    pool.close()
+    assert not pool.sessions and bng.bng.closed and bng.sensor_bng.closed
+    assert bng.sensor_threads == {} and not threads[0].thread.is_alive()
+    print("close: ok")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--map_name", type=str, default="small_island", help="map to use for the BEV")
+    parser.add_argument("--path_to_maps", type=str, default=DATA_PATH.__str__(), help="directory containing map_data/")
+    args = parser.parse_args()
+
+    pool = session_pool()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        bng = check_reuse(args, pool, tmp_dir)
+        check_mismatch(args, pool, bng)
+        check_close(args, pool)
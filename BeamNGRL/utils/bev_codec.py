@@ -0,0 +1,205 @@
+import numpy as np
+import cv2
+
+from pathlib import Path
+
+'''
+Compact storage for BEV frames (color, elev, normal, segmt, path layers):
+    elevation: float16, refused (ValueError) if that moves any value by more than max_error (meters)
+    normals: octahedral encoding, 2 values per unit vector instead of 3, as int16 ("oct16", ~0.03 deg error)
+             or int8 ("oct8", ~1 deg error)
+    color/segmentation/path: lossless PNG ("png") or JPEG ("jpg", near lossless at high quality)
+Every option can also be None to keep the layer as it is.
+bev_codec.save(path, layer, bev) writes path.npz with the encoded fields and what is needed to decode them,
+load_bev(path) reads those back (or a plain .npy), whatever codec options were used to write them.
+The fixed size encodings (float16, oct16, oct8) also work on whole stacks of frames [N, H, W, C] for the chunked logs,
+which keep the name of the encoding in their index (chunked_log's codec) for decode_log to dispatch on.
+'''
+
+IMAGE_FORMATS = ["png", "jpg"]
+NORMAL_FORMATS = {"oct16": np.int16, "oct8": np.int8}
+
+def layer_kind(layer):
+    ## "bev_elev" -> "elev"
+    return layer[4:] if layer.startswith("bev_") else layer
+
+def sign_not_zero(x):
+    return np.where(x >= 0, 1.0, -1.0).astype(np.float32)
+
+def encode_elev(elev, max_error=0.01):
+    ## max_error None skips the check, for frames that already went through check_elev
+    elev = np.asarray(elev)
+    encoded = elev.astype(np.float16)
+    if max_error is not None:
+        check_elev(elev, max_error, encoded)
+    return encoded
+
+def check_elev(elev, max_error=0.01, encoded=None):
+    elev = np.asarray(elev)
+    if encoded is None:
+        encoded = elev.astype(np.float16)
+    finite = np.isfinite(elev)
+    if np.any(finite):
+        error = np.max(np.abs(encoded[finite].astype(np.float64) - elev[finite]))
+        if error > max_error:
+            raise ValueError("float16 elevation is off by up to {:.4f} m, more than the allowed {} m. Store it relative to the car or keep float32".format(error, max_error))
+
+def decode_elev(encoded):
+    return np.asarray(encoded).astype(np.float32)
+
+def encode_normal(normal, fmt="oct16"):
+    ## unit vectors [..., 3] -> octahedral coordinates [..., 2]
+    normal = np.asarray(normal, dtype=np.float32)
+    n = normal/np.maximum(np.sum(np.abs(normal), axis=-1, keepdims=True), 1e-12)
+    x, y, z = n[..., 0], n[..., 1], n[..., 2]
+    folded_x = (1 - np.abs(y))*sign_not_zero(x)
+    folded_y = (1 - np.abs(x))*sign_not_zero(y)
+    oct = np.stack([np.where(z < 0, folded_x, x), np.where(z < 0, folded_y, y)], axis=-1)
+    dtype = NORMAL_FORMATS[fmt]
+    scale = np.iinfo(dtype).max
+    return np.round(np.clip(oct, -1, 1)*scale).astype(dtype)
+
+def decode_normal(encoded):
+    encoded = np.asarray(encoded)
+    oct = encoded.astype(np.float32)/np.iinfo(encoded.dtype).max
+    x, y = oct[..., 0], oct[..., 1]
+    z = 1 - np.abs(x) - np.abs(y)
+    t = np.maximum(-z, 0)
+    normal = np.stack([x - t*sign_not_zero(x), y - t*sign_not_zero(y), z], axis=-1)
+    return normal/np.linalg.norm(normal, axis=-1, keepdims=True)
+
+def encode_image(image, fmt="png", quality=95):
+    image = np.asarray(image)
+    if image.dtype != np.uint8:
+        raise ValueError("{} needs uint8 images, got {}".format(fmt, image.dtype))
+    params = [cv2.IMWRITE_JPEG_QUALITY, quality] if fmt == "jpg" else [cv2.IMWRITE_PNG_COMPRESSION, 1]
+    ok, buffer = cv2.imencode("." + fmt, image, params)
+    if not ok:
+        raise ValueError("failed to encode a {} image of shape {}".format(fmt, image.shape))
+    return buffer.reshape(-1)
+
+def decode_image(buffer, shape):
+    image = cv2.imdecode(np.asarray(buffer, dtype=np.uint8), cv2.IMREAD_UNCHANGED)
+    return image.reshape(shape)
+
+
+class bev_codec():
+    def __init__(self, elev="float16", elev_max_error=0.01, normal="oct16", color="png", segmt="png", path="png", jpeg_quality=95):
+        self.formats = {"elev": elev, "normal": normal, "color": color, "segmt": segmt, "path": path}
+        self.elev_max_error = elev_max_error
+        self.jpeg_quality = jpeg_quality
+        for kind, fmt in self.formats.items():
+            allowed = ["float16"] if kind == "elev" else list(NORMAL_FORMATS) if kind == "normal" else IMAGE_FORMATS
+            if fmt is not None and fmt not in allowed:
+                raise ValueError("unknown format {} for the {} layer, use one of {} or None".format(fmt, kind, allowed))
+
+    @classmethod
+    def from_config(cls, config):
+        ## config: None (no compression) or a dict of the constructor's arguments, e.g. from a dataset yaml
+        if config is None:
+            return None
+        return cls(**config)
+
+    def encode(self, layer, bev):
+        ## -> dict of arrays, enough to decode the layer without knowing the codec options
+        kind = layer_kind(layer)
+        fmt = self.formats.get(kind)
+        bev = np.asarray(bev)
+        if fmt is None:
+            return {"format": np.array("raw"), "data": bev}
+        if kind == "elev":
+            data = encode_elev(bev, self.elev_max_error)
+        elif kind == "normal":
+            data = encode_normal(bev, fmt)
+        else:
+            data = encode_image(bev, fmt, self.jpeg_quality)
+        return {"format": np.array(fmt), "data": data, "shape": np.array(bev.shape)}
+
+    def frames_format(self, layer):
+        ## encoding encode_frames uses for the layer, None if it stays raw (only the fixed size encodings apply to logs)
+        kind = layer_kind(layer)
+        return self.formats.get(kind) if kind in ["elev", "normal"] else None
+
+    def check_frame(self, layer, frame):
+        ## raises ValueError if encode_frames can't store the frame, so that it fails where the frame is handed in
+        ## (background_log_writer.write) rather than on the writer thread
+        if self.frames_format(layer) == "float16":
+            check_elev(frame, self.elev_max_error)
+
+    def encode_frames(self, layer, frames):
+        ## stack of frames [N, ...] for a chunked log, the frames are expected to have passed check_frame
+        fmt = self.frames_format(layer)
+        if fmt is None:
+            return frames
+        if fmt == "float16":
+            return encode_elev(frames, max_error=None)
+        return encode_normal(frames, fmt)
+
+    def save(self, path, layer, bev):
+        np.savez(Path(path).with_suffix(".npz"), **self.encode(layer, bev))
+
+
+def decode(fields):
+    fmt = str(fields["format"])
+    data = fields["data"]
+    if fmt == "raw":
+        return np.asarray(data)
+    shape = tuple(fields["shape"])
+    if fmt == "float16":
+        return decode_elev(data).reshape(shape)
+    if fmt in NORMAL_FORMATS:
+        return decode_normal(data).reshape(shape)
+    return decode_image(data, shape)
+
+def load_bev(path):
+    ## path with or without suffix: the .npz written by bev_codec.save if there is one, the plain .npy otherwise
+    path = Path(path)
+    if path.with_suffix(".npz").is_file():
+        with np.load(path.with_suffix(".npz")) as fields:
+            return decode(fields)
+    return np.load(path.with_suffix(".npy"))
+
+def save_bev(path, layer, bev, codec=None):
+    path = Path(path)
+    if codec is None:
+        np.save(path.with_suffix(".npy"), bev)
+    else:
+        codec.save(path, layer, bev)
+    ## a frame left over from a run with the other setting would shadow (or be shadowed by) this one
+    stale = path.with_suffix(".npz" if codec is None else ".npy")
+    if stale.is_file():
+        stale.unlink()
+
+def decode_frames(frames, fmt):
+    ## fmt: the encoding the frames were written with (bev_codec.frames_format), None for raw frames
+    if fmt is None:
+        return frames
+    if fmt == "float16":
+        return decode_elev(frames)
+    if fmt in NORMAL_FORMATS:
+        return decode_normal(frames)
+    raise ValueError("unknown frame encoding {}".format(fmt))
+
+
+class decoded_log():
+    '''
+    read-only view of a (memory-mapped) log written with bev_codec.encode_frames, frames are decoded when indexed
+    '''
+    def __init__(self, frames, fmt):
+        self.frames = frames
+        self.fmt = fmt
+        first = decode_frames(np.asarray(frames[:1]), fmt)
+        self.dtype = first.dtype
+        self.shape = (len(frames),) + first.shape[1:]
+
+    def __len__(self):
+        return len(self.frames)
+
+    def __getitem__(self, idx):
+        return decode_frames(np.asarray(self.frames[idx]), self.fmt)
+
+def decode_log(frames, fmt):
+    ## fmt: the codec stored with the log (chunked_log.log_codec), None for raw logs
+    if fmt is not None:
+        return decoded_log(frames, fmt)
+    return frames
@@ -0,0 +1,102 @@
+import numpy as np
+
+import json
+import os
+from pathlib import Path
+
+'''
+Append-only storage for the data collection logs (state, timestamps, reset, bev_* ...).
+A log "state.npy" lives in the directory "state.chunks/": data.bin holds the rows of every flush back to back
+(raw bytes of a fixed dtype and row shape), index.json holds the dtype, the row shape and the number of rows of every chunk,
+and the name of the encoding of the rows for logs of encoded frames (codec, see bev_codec.py).
+An append writes only the new rows and then replaces the index, so flushing costs O(new data) however long the log is.
+load_log returns the whole log as one read-only memory-mapped array (and still reads the old single-file .npy logs).
+'''
+
+def chunk_dir(filepath):
+    filepath = Path(filepath)
+    return filepath.parent / (filepath.stem + ".chunks")
+
+def read_index(directory):
+    index_file = Path(directory) / "index.json"
+    if not index_file.is_file():
+        return None
+    with open(index_file) as f:
+        return json.load(f)
+
+def write_index(directory, index):
+    ## written next to the old one and renamed over it, so readers never see half an index
+    tmp_file = Path(directory) / "index.json.tmp"
+    with open(tmp_file, "w") as f:
+        json.dump(index, f)
+    os.replace(tmp_file, Path(directory) / "index.json")
+
+
+class chunked_log():
+    def __init__(self, filepath, codec=None):
+        self.directory = chunk_dir(filepath)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.data_file = self.directory / "data.bin"
+        self.codec = codec
+        self.index = read_index(self.directory)
+        if self.index is not None and self.index.get("codec") != codec:
+            raise ValueError("{}: the log is stored as {}, can't append {} rows to it".format(self.directory, self.index.get("codec"), codec))
+
+    def rows(self):
+        return 0 if self.index is None else sum(self.index["chunks"])
+
+    def append(self, buffer):
+        buff_arr = np.asarray(buffer)
+        if buff_arr.dtype == object:
+            raise ValueError("{}: can only log arrays of a fixed dtype and shape, got ragged data".format(self.directory))
+        if len(buff_arr) == 0:
+            return
+        if self.index is None:
+            self.index = {"dtype": buff_arr.dtype.str, "shape": list(buff_arr.shape[1:]), "chunks": []}
+            if self.codec is not None:
+                self.index["codec"] = self.codec
+        elif list(buff_arr.shape[1:]) != self.index["shape"]:
+            raise ValueError("{}: rows of shape {} don't match the log's {}".format(self.directory, list(buff_arr.shape[1:]), self.index["shape"]))
+        buff_arr = np.ascontiguousarray(buff_arr, dtype=np.dtype(self.index["dtype"]))
+
+        row_bytes = buff_arr.itemsize*int(np.prod(self.index["shape"], dtype=np.int64))
+        mode = "r+b" if self.data_file.is_file() else "wb"
+        with open(self.data_file, mode) as f:
+            ## drops whatever a crash left behind after the last indexed chunk
+            f.truncate(self.rows()*row_bytes)
+            f.seek(0, os.SEEK_END)
+            f.write(buff_arr.tobytes())
+        self.index["chunks"].append(len(buff_arr))
+        write_index(self.directory, self.index)
+
+
+def update_log(buffer, filepath):
+    ## appends the buffer to the log at filepath and returns an empty buffer, like update_npy_datafile used to
+    if len(buffer):
+        chunked_log(filepath).append(buffer)
+    return []
+
+def load_log(filepath, mmap=True):
+    '''
+    the whole log at filepath as one array, memory-mapped read-only unless mmap is False.
+    Falls back to np.load for logs written as a single .npy file.
+    '''
+    directory = chunk_dir(filepath)
+    index = read_index(directory)
+    if index is None:
+        return np.load(filepath, allow_pickle=True)
+    shape = (sum(index["chunks"]),) + tuple(index["shape"])
+    if shape[0] == 0:
+        return np.zeros(shape, dtype=np.dtype(index["dtype"]))
+    data = np.memmap(directory / "data.bin", dtype=np.dtype(index["dtype"]), mode="r", shape=shape)
+    return data if mmap else np.array(data)
+
+def log_codec(filepath):
+    ## encoding of the rows (bev_codec.frames_format) the log was written with, None for raw rows
+    index = read_index(chunk_dir(filepath))
+    return None if index is None else index.get("codec")
+
+def log_chunks(filepath):
+    ## row counts of the flushes that make up the log
+    index = read_index(chunk_dir(filepath))
+    return [] if index is None else list(index["chunks"])
@@ -0,0 +1,139 @@
+import numpy as np
+
+import queue
+import threading
+import traceback
+from pathlib import Path
+
+from BeamNGRL.utils.chunked_log import chunked_log
+
+'''
+Streams data collection frames to chunked logs (see chunked_log.py) from a background thread.
+write({"state": state, "bev_elev": BEV_height, ...}) copies one frame into a bounded queue and returns; the thread
+gathers `chunk_rows` frames per log and appends them. Memory stays at about queue_size + chunk_rows frames however
+long the session runs. When the disk can't keep up and the queue is full, policy decides what happens:
+    "block": write() waits for a free slot (backpressure on the control loop, nothing is lost)
+    "drop_newest": the new frame is dropped
+    "drop_oldest": the oldest queued frame is dropped to make room
+A frame is always kept or dropped as a whole, so all the logs keep the same number of rows.
+With a codec (bev_codec.py) the bev_elev/bev_normal chunks are stored float16/octahedral, encoded on the writer thread.
+write() checks the frames against the codec first, so a frame it can't store raises ValueError in the caller.
+'''
+
+POLICIES = ["block", "drop_newest", "drop_oldest"]
+_FLUSH = "flush"
+_CLOSE = "close"
+
+class background_log_writer():
+    def __init__(self, output_path, queue_size=64, chunk_rows=32, policy="block", codec=None):
+        if policy not in POLICIES:
+            raise ValueError("unknown policy {}, use one of {}".format(policy, POLICIES))
+        self.output_path = Path(output_path)
+        self.chunk_rows = chunk_rows
+        self.policy = policy
+        self.codec = codec
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.buffers = {}
+        self.logs = {}
+        self.pending = 0 ## frames in the buffers
+        self.written = 0 ## frames appended to the logs
+        self.dropped = 0
+        self.error = None
+        self.flushed = threading.Event()
+        self.closed = False
+        self.thread = threading.Thread(target=self.write_loop, name="log_writer", daemon=True)
+        self.thread.start()
+
+    def write(self, frame):
+        ## frame: {log name: array of this frame}, the arrays are copied so the caller can reuse them
+        if self.error is not None:
+            raise RuntimeError("the log writer failed:\n" + self.error)
+        frame = {name: np.array(value) for name, value in frame.items()}
+        if self.codec is not None:
+            for name, value in frame.items():
+                if name.startswith("bev_"):
+                    self.codec.check_frame(name, value) ## ValueError here rather than on the writer thread
+        if self.policy == "block":
+            self.queue.put(frame)
+            return True
+        while True:
+            try:
+                self.queue.put_nowait(frame)
+                return True
+            except queue.Full:
+                if self.policy == "drop_newest":
+                    self.dropped += 1
+                    return False
+            ## drop_oldest, the writer may have emptied a slot in the meantime
+            if self.drop_oldest_frame():
+                self.dropped += 1
+            elif self.queue.full():
+                self.queue.put(frame) ## nothing but flush and close requests queued, wait for the writer
+                return True
+
+    def drop_oldest_frame(self):
+        ## removes the oldest queued frame where it is, flush and close requests keep their place in the queue
+        with self.queue.mutex:
+            for i, item in enumerate(self.queue.queue):
+                if type(item) == dict:
+                    del self.queue.queue[i]
+                    self.queue.not_full.notify()
+                    return True
+        return False
+
+    def flush(self, wait=False):
+        ## writes the partial chunks out after the frames queued so far, waits for it with wait=True
+        self.flushed.clear()
+        self.queue.put(_FLUSH)
+        if wait:
+            self.flushed.wait()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.put(_CLOSE)
+        self.thread.join()
+        if self.error is not None:
+            print("the log writer failed:\n" + self.error)
+
+    def write_loop(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is _FLUSH or item is _CLOSE:
+                    self.write_chunks()
+                    self.flushed.set()
+                    if item is _CLOSE:
+                        return
+                    continue
+                for name, value in item.items():
+                    self.buffers.setdefault(name, []).append(value)
+                self.pending += 1
+                if max(len(buffer) for buffer in self.buffers.values()) >= self.chunk_rows:
+                    self.write_chunks()
+            except Exception:
+                self.error = traceback.format_exc()
+                self.flushed.set()
+                if item is _CLOSE:
+                    return
+
+    def write_chunks(self):
+        ## everything is encoded before anything is appended, so a frame that fails to encode doesn't leave the logs
+        ## with different numbers of rows. The buffers are emptied either way
+        try:
+            chunks = {}
+            for name, buffer in self.buffers.items():
+                if len(buffer):
+                    if self.codec is not None and name.startswith("bev_"):
+                        buffer = self.codec.encode_frames(name, np.stack(buffer))
+                    chunks[name] = buffer
+            for name, chunk in chunks.items():
+                if name not in self.logs:
+                    codec = self.codec.frames_format(name) if self.codec is not None and name.startswith("bev_") else None
+                    self.logs[name] = chunked_log(self.output_path / (name + ".npy"), codec=codec)
+                self.logs[name].append(chunk)
+            self.written += self.pending
+        finally:
+            self.buffers = {name: [] for name in self.buffers}
+            self.pending = 0
@@ -0,0 +1,93 @@
+import numpy as np
+
+## quaternions are [w, x, y, z]. Every function works on a single quaternion of shape [4] as well as on a batch of shape [N, 4],
+## the leading dimensions are carried through to the output ([N, 3] for rpy, [N, 3, 3] for rotation matrices).
+
+def rpy_from_quat(quat):
+    quat = np.asarray(quat, dtype=np.float64)
+    w, x, y, z = quat[..., 0], quat[..., 1], quat[..., 2], quat[..., 3]
+    rpy = np.empty(quat.shape[:-1] + (3,))
+    rpy[..., 0] = np.arctan2(2.0*(y*z + w*x), w**2 - x**2 - y**2 + z**2)
+    rpy[..., 1] = -np.arcsin(np.clip(2.0*(x*z - w*y), -1.0, 1.0))
+    rpy[..., 2] = np.arctan2(2.0*(x*y + w*z), w**2 + x**2 - y**2 - z**2)
+    return rpy
+
+def quat_from_rpy(rpy):
+    rpy = np.asarray(rpy, dtype=np.float64)
+    u1 = np.cos(0.5*rpy[..., 0])
+    u2 = np.cos(0.5*rpy[..., 1])
+    u3 = np.cos(0.5*rpy[..., 2])
+    u4 = np.sin(0.5*rpy[..., 0])
+    u5 = np.sin(0.5*rpy[..., 1])
+    u6 = np.sin(0.5*rpy[..., 2])
+    quat = np.empty(rpy.shape[:-1] + (4,))
+    quat[..., 0] = u1*u2*u3 + u4*u5*u6
+    quat[..., 1] = u4*u2*u3 - u1*u5*u6
+    quat[..., 2] = u1*u5*u3 + u4*u2*u6
+    quat[..., 3] = u1*u2*u6 - u4*u5*u3
+    return quat
+
+def quat_multiply(q, r):
+    ## hamilton product q*r
+    q = np.asarray(q, dtype=np.float64)
+    r = np.asarray(r, dtype=np.float64)
+    qw, qx, qy, qz = q[..., 0], q[..., 1], q[..., 2], q[..., 3]
+    rw, rx, ry, rz = r[..., 0], r[..., 1], r[..., 2], r[..., 3]
+    return np.stack([
+        qw*rw - qx*rx - qy*ry - qz*rz,
+        qw*rx + qx*rw + qy*rz - qz*ry,
+        qw*ry - qx*rz + qy*rw + qz*rx,
+        qw*rz + qx*ry - qy*rx + qz*rw,
+    ], axis=-1)
+
+def quat_inverse(q):
+    q = np.asarray(q, dtype=np.float64)
+    inv = q * np.array([1.0, -1.0, -1.0, -1.0])
+    return inv / np.sum(q**2, axis=-1, keepdims=True)
+
+def quat_divide(q, r):
+    ## q*r^-1, same as pyquaternion's q/r
+    return quat_multiply(q, quat_inverse(r))
+
+_BEAMNG_TO_REP103 = np.array([0, np.sqrt(2)/2, np.sqrt(2)/2, 0])
+
+def convert_beamng_to_REP103(rot):
+    ## beamng gives [x, y, z, w] in its own frame, this returns [w, x, y, z] in the REP103 (x forward, y left, z up) frame
+    rot = np.asarray(rot, dtype=np.float64)
+    rot = np.stack([rot[..., 2], -rot[..., 0], -rot[..., 1], -rot[..., 3]], axis=-1)
+    new = quat_multiply(_BEAMNG_TO_REP103, rot)
+    return -new[..., [1, 3, 0, 2]]
+
+def convert_REP103_to_beamng(quat):
+    ## inverse of convert_beamng_to_REP103, [w, x, y, z] in REP103 -> beamng's [x, y, z, w]
+    quat = np.asarray(quat, dtype=np.float64)
+    new = -quat[..., [2, 0, 3, 1]]
+    rot = quat_multiply(quat_inverse(_BEAMNG_TO_REP103), new)
+    return np.stack([-rot[..., 1], -rot[..., 2], rot[..., 0], -rot[..., 3]], axis=-1)
+
+def calc_Transform(quat):
+    quat = np.asarray(quat, dtype=np.float64)
+    q00 = quat[..., 0]**2
+    q11 = quat[..., 1]**2
+    q22 = quat[..., 2]**2
+    q33 = quat[..., 3]**2
+    q01 = quat[..., 0]*quat[..., 1]
+    q02 = quat[..., 0]*quat[..., 2]
+    q03 = quat[..., 0]*quat[..., 3]
+    q12 = quat[..., 1]*quat[..., 2]
+    q13 = quat[..., 1]*quat[..., 3]
+    q23 = quat[..., 2]*quat[..., 3]
+
+    Tbn = np.empty(quat.shape[:-1] + (3, 3)) # transform body->ned
+    Tbn[..., 0, 0] = q00 + q11 - q22 - q33
+    Tbn[..., 1, 1] = q00 - q11 + q22 - q33
+    Tbn[..., 2, 2] = q00 - q11 - q22 + q33
+    Tbn[..., 0, 1] = 2*(q12 - q03)
+    Tbn[..., 0, 2] = 2*(q13 + q02)
+    Tbn[..., 1, 0] = 2*(q12 + q03)
+    Tbn[..., 1, 2] = 2*(q23 - q01)
+    Tbn[..., 2, 0] = 2*(q13 - q02)
+    Tbn[..., 2, 1] = 2*(q23 + q01)
+
+    Tnb = np.swapaxes(Tbn, -1, -2) # transform ned->body
+    return Tnb, Tbn
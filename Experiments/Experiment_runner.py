@@ -1,4 +1,5 @@
 from BeamNGRL.BeamNG.beamng_interface import *
+from BeamNGRL.BeamNG.session_pool import get_session, close_sessions
 from BeamNGRL.control.UW_mppi.MPPI import MPPI
 from BeamNGRL.control.UW_mppi.Dynamics.SimpleCarNetworkDyn import SimpleCarNetworkDyn
 from BeamNGRL.control.UW_mppi.Dynamics.SimpleCarDynamicsCUDA import SimpleCarDynamics
@@ -7,7 +8,7 @@ from BeamNGRL.control.UW_mppi.Sampling.Delta_Sampling import Delta_Sampling
 from BeamNGRL.utils.visualisation import costmap_vis
 from BeamNGRL.utils.planning import update_goal
 from BeamNGRL import DATA_PATH, LOGS_PATH
-from typing import List
+from BeamNGRL.utils.chunked_log import update_log
 import torch
 import yaml
 import os
@@ -15,18 +16,6 @@ import argparse
 import cv2
 
 
-def update_npy_datafile(buffer: List, filepath):
-    buff_arr = np.array(buffer)
-    if filepath.is_file():
-        # Append to existing data file
-        data_arr = np.load(filepath, allow_pickle=True)
-        data_arr = np.concatenate((data_arr, buff_arr), axis=0)
-        np.save(filepath, data_arr)
-    else:
-        np.save(filepath, buff_arr)
-    return []  # empty buffer
-
-
 ## TODO: move this to some kind of utils folder because this is used both in the loop as well as open-loop.
 def get_dynamics(model, Config):
     Dynamics_config = Config["Dynamics_config"]
@@ -148,7 +137,8 @@ def main(config_path=None, hal_config_path=None, args=None):
     if Config["run_lockstep"]:
         print("Running in lockstep mode")
 
-    bng_interface = get_beamng_default(
+    ## reuses the simulator session of the previous run if there is one with the same setup, see session_pool.py
+    bng_interface = get_session(
         car_model=vehicle["model"],
         start_pos=start_pos,
         start_quat=start_quat,
@@ -249,14 +239,15 @@ def main(config_path=None, hal_config_path=None, args=None):
                     )
 
                     while ts < time_limit:
-                        for _ in range(int(skips)):
-                            bng_interface.state_poll()
-                            state = np.copy(bng_interface.state)
-                            ts = bng_interface.timestamp - last_reset_time
-                            timestamps.append(ts)
+                        ## advance by one control step (skips physics steps) and poll once; the skipped frames are interpolated
+                        skipped_states, skipped_timestamps = bng_interface.step_n(int(skips), record=True)
+                        for state, stamp in zip(skipped_states, skipped_timestamps):
+                            timestamps.append(stamp - last_reset_time)
                             state_data.append(state)
                             reset_data.append(False)
                             ## append extra data to these lists
+                        state = np.copy(bng_interface.state)
+                        ts = bng_interface.timestamp - last_reset_time
                         pos = np.copy(
                             state[:2]
                         )  # example of how to get car position in world frame. All data points except for dt are 3 dimensional.
@@ -283,6 +274,11 @@ def main(config_path=None, hal_config_path=None, args=None):
                         )
                         controller.Dynamics.set_BEV(BEV_heght, BEV_normal)
                         controller.Costs.set_BEV(BEV_heght, BEV_normal, BEV_path)
+                        controller.Costs.set_path_distance(
+                            torch.from_numpy(bng_interface.BEV_path_distance).to(
+                                device=device, dtype=dtype
+                            )
+                        )
                         controller.Costs.set_goal(
                             torch.from_numpy(np.copy(goal) - np.copy(pos)).to(
                                 device=device, dtype=dtype
@@ -373,13 +369,13 @@ def main(config_path=None, hal_config_path=None, args=None):
 
                     if Config["save_data"]:
                         np.save(filename, result_states)
-                        timestamps = update_npy_datafile(
+                        timestamps = update_log(
                             timestamps, output_path / "timestamps.npy"
                         )
-                        state_data = update_npy_datafile(
+                        state_data = update_log(
                             state_data, output_path / "state.npy"
                         )
-                        reset_data = update_npy_datafile(
+                        reset_data = update_log(
                             reset_data, output_path / "reset.npy"
                         )
 
@@ -391,11 +387,15 @@ def main(config_path=None, hal_config_path=None, args=None):
         pass
     except Exception as e:
         print(e)
-        bng_interface.bng.close()
         cv2.destroyAllWindows()
+        close_sessions()
+        if getattr(args, "keep_session", False):
+            raise ## let Run_queue.py move on to the next job with a fresh session
         os._exit(1)
-    bng_interface.bng.close()
     cv2.destroyAllWindows()
+    if getattr(args, "keep_session", False):
+        return ## the session stays open for the next job
+    close_sessions()
     os._exit(1)
 
 
@@ -7,7 +7,7 @@ from BeamNGRL.control.UW_mppi.Sampling.Delta_Sampling import Delta_Sampling
 from BeamNGRL.utils.visualisation import costmap_vis
 from BeamNGRL.utils.planning import update_goal
 from BeamNGRL import DATA_PATH, LOGS_PATH
-from typing import List
+from BeamNGRL.utils.chunked_log import update_log
 import torch
 import yaml
 import os
@@ -17,18 +17,6 @@ import cv2
 torch.manual_seed(0)
 
 
-def update_npy_datafile(buffer: List, filepath):
-    buff_arr = np.array(buffer)
-    if filepath.is_file():
-        # Append to existing data file
-        data_arr = np.load(filepath, allow_pickle=True)
-        data_arr = np.concatenate((data_arr, buff_arr), axis=0)
-        np.save(filepath, data_arr)
-    else:
-        np.save(filepath, buff_arr)
-    return []  # empty buffer
-
-
 def get_dynamics(model, Config):
     Dynamics_config = Config["Dynamics_config"]
     MPPI_config = Config["MPPI_config"]
@@ -334,13 +322,13 @@ def main(config_path=None, args=None):
                     state_data.append(state)
                     reset_data.append(True)
 
-                    timestamps = update_npy_datafile(
+                    timestamps = update_log(
                         timestamps, output_path / "timestamps.npy"
                     )
-                    state_data = update_npy_datafile(
+                    state_data = update_log(
                         state_data, output_path / "state.npy"
                     )
-                    reset_data = update_npy_datafile(
+                    reset_data = update_log(
                         reset_data, output_path / "reset.npy"
                     )
 
@@ -1,4 +1,5 @@
 from BeamNGRL.BeamNG.beamng_interface import *
+from BeamNGRL.BeamNG.session_pool import get_session, close_sessions
 from BeamNGRL.control.UW_mppi.MPPI import MPPI
 from BeamNGRL.control.UW_mppi.Dynamics.SimpleCarNetworkDyn import SimpleCarNetworkDyn
 from BeamNGRL.control.UW_mppi.Dynamics.SimpleCarDynamicsCUDA import SimpleCarDynamics
@@ -7,7 +8,7 @@ from BeamNGRL.control.UW_mppi.Sampling.Delta_Sampling import Delta_Sampling
 from BeamNGRL.utils.visualisation import costmap_vis
 from BeamNGRL.utils.planning import update_goal
 from BeamNGRL import DATA_PATH, LOGS_PATH
-from typing import List
+from BeamNGRL.utils.chunked_log import update_log
 import torch
 import yaml
 import os
@@ -15,18 +16,6 @@ import argparse
 import cv2
 
 
-def update_npy_datafile(buffer: List, filepath):
-    buff_arr = np.array(buffer)
-    if filepath.is_file():
-        # Append to existing data file
-        data_arr = np.load(filepath, allow_pickle=True)
-        data_arr = np.concatenate((data_arr, buff_arr), axis=0)
-        np.save(filepath, data_arr)
-    else:
-        np.save(filepath, buff_arr)
-    return []  # empty buffer
-
-
 ## TODO: move this to some kind of utils folder because this is used both in the loop as well as open-loop.
 def get_dynamics(model, Config):
     Dynamics_config = Config["Dynamics_config"]
@@ -158,7 +147,8 @@ def main(config_path=None, hal_config_path=None, args=None):
         merged_config.update(hal_Config)
         yaml.dump(merged_config, yaml_file, default_flow_style=True)
 
-    bng_interface = get_beamng_default(
+    ## reuses the simulator session of the previous run if there is one with the same setup, see session_pool.py
+    bng_interface = get_session(
         car_model=vehicle["model"],
         start_pos=start_pos,
         start_quat=start_quat,
@@ -310,6 +300,11 @@ def main(config_path=None, hal_config_path=None, args=None):
                         )
                         controller.Dynamics.set_BEV(BEV_heght, BEV_normal)
                         controller.Costs.set_BEV(BEV_heght, BEV_normal, BEV_path)
+                        controller.Costs.set_path_distance(
+                            torch.from_numpy(bng_interface.BEV_path_distance).to(
+                                device=device, dtype=dtype
+                            )
+                        )
                         controller.Costs.set_goal(
                             torch.from_numpy(np.copy(goal) - np.copy(pos)).to(
                                 device=device, dtype=dtype
@@ -427,28 +422,28 @@ def main(config_path=None, hal_config_path=None, args=None):
                             break  ## break the for loop
 
                     if Config["save_data"]:
-                        timestamps = update_npy_datafile(
+                        timestamps = update_log(
                             timestamps, output_path / "timestamps.npy"
                         )
-                        state_data = update_npy_datafile(
+                        state_data = update_log(
                             state_data, output_path / "state.npy"
                         )
-                        reset_data = update_npy_datafile(
+                        reset_data = update_log(
                             reset_data, output_path / "reset.npy"
                         )
-                        path_data = update_npy_datafile(
+                        path_data = update_log(
                             path_data, output_path / "bev_path.npy"
                         )
-                        color_data = update_npy_datafile(
+                        color_data = update_log(
                             color_data, output_path / "bev_color.npy"
                         )
-                        segmt_data = update_npy_datafile(
+                        segmt_data = update_log(
                             segmt_data, output_path / "bev_segmt.npy"
                         )
-                        elev_data = update_npy_datafile(
+                        elev_data = update_log(
                             elev_data, output_path / "bev_elev.npy"
                         )
-                        normal_data = update_npy_datafile(
+                        normal_data = update_log(
                             normal_data, output_path / "bev_normal.npy"
                         )
 
@@ -460,11 +455,15 @@ def main(config_path=None, hal_config_path=None, args=None):
         pass
     except Exception as e:
         print(e)
-        bng_interface.bng.close()
         cv2.destroyAllWindows()
+        close_sessions()
+        if getattr(args, "keep_session", False):
+            raise ## let Run_queue.py move on to the next job with a fresh session
         os._exit(1)
-    bng_interface.bng.close()
     cv2.destroyAllWindows()
+    if getattr(args, "keep_session", False):
+        return ## the session stays open for the next job
+    close_sessions()
     os._exit(1)
 
 
@@ -19,6 +19,9 @@ import sys
 
 ## the job of this script is to take ground-truth data for controls and states, run the controls through the dynamics model and compare the predicted states to the ground-truth states
 
+## samples evaluated, selected from the dataset's per-sample metadata (statistics of the future states, see BeamNGRL/dynamics/utils/meta_utils.py)
+SAMPLE_FILTER = "min_vx >= 2 and mean_abs_ax >= 2 and mean_abs_ay >= 2 and mean_abs_wx >= 0.05 and mean_abs_wy >= 0.05 and mean_abs_roll >= 0.05 and mean_abs_pitch >= 0.05"
+
 
 def get_dynamics(model, Config):
     Dynamics_config = Config["Dynamics_config"]
@@ -90,7 +93,6 @@ def evaluator(
     if TIMESTEPS != int(100 / skip):
         print("dynamics timesteps not equal to dataset timesteps after skipping frames")
         exit()
-    count = 0
     np.set_printoptions(threshold=sys.maxsize)
     for model in config["models"]:
         dynamics = get_dynamics(model, config)
@@ -105,22 +107,6 @@ def evaluator(
             controls_tn = controls_tn.to(**tn_args)[:, ::skip, :]
             ctx_tn_dict = {k: tn.to(**tn_args) for k, tn in ctx_tn_dict.items()}
             gt_states = states_tn.clone().cpu().numpy()
-            vel_condition = np.min(gt_states[0, :, 6]) < 2
-            acc_condition = (
-                np.mean(np.abs(gt_states[0, :, 9])) < 2
-                or np.mean(np.abs(gt_states[0, :, 10])) < 2
-            )
-            rat_condition = (
-                np.mean(np.abs(gt_states[0, :, 12])) < 0.05
-                or np.mean(np.abs(gt_states[0, :, 13])) < 0.05
-            )
-            rp_condition = (
-                np.mean(np.abs(gt_states[0, :, 3])) < 0.05
-                or np.mean(np.abs(gt_states[0, :, 4])) < 0.05
-            )
-            if vel_condition or acc_condition or rat_condition or rp_condition:
-                count += 1
-                continue
             BEV_heght = ctx_tn_dict["bev_elev"].squeeze(0).squeeze(0)
             BEV_normal = ctx_tn_dict["bev_normal"].squeeze(0).squeeze(0)
             dynamics.set_BEV(BEV_heght, BEV_normal)
@@ -156,7 +142,6 @@ def evaluator(
                 print("NaN error")
                 print(pred_states)
                 exit()
-        print(count)
         dir_name = (
             str(Path(os.getcwd()).parent.absolute())
             + "/Experiments/Results/Accuracy/"
@@ -183,6 +168,9 @@ if __name__ == "__main__":
     parser.add_argument(
         "--batchsize", type=int, required=False, default=1, help="training batch size"
     )
+    parser.add_argument(
+        "--sample_filter", type=str, required=False, default=SAMPLE_FILTER, help="filter expression on the sample metadata, \"\" for all samples"
+    )
 
     args = parser.parse_args()
 
@@ -201,7 +189,8 @@ if __name__ == "__main__":
         ).read(),
         Loader=yaml.SafeLoader,
     )
-    # Dataloaders
+    # Dataloaders, the config's dataset filter if it has one
+    config["dataset"].setdefault("sample_filter", args.sample_filter or None)
     train_loader, valid_loader, stats, data_cfg = get_dataloaders(args, config)
     with torch.no_grad():
         evaluator(train_loader, config, tensor_args)
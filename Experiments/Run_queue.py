@@ -0,0 +1,54 @@
+import argparse
+import importlib
+import os
+import traceback
+from pathlib import Path
+
+import torch
+
+from BeamNGRL.BeamNG.session_pool import get_pool, close_sessions
+
+## Runs several experiment jobs one after the other in this process. The scripts get their simulator session from
+## session_pool, so jobs with the same map, car and sensors share one running simulator and only reset the car.
+## A job is script:config_name[:hal_config_name], e.g.
+##   python Run_queue.py --jobs Experiment_runner:Test_Config.yaml MPPI_data_collection:Data_Collection_Config.yaml:hound.yaml
+SCRIPTS = ["Experiment_runner", "Rollover_in_the_loop", "MPPI_data_collection", "CCIL_Eval"]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--jobs", type=str, nargs='+', required=True, help="script:config_name[:hal_config_name] for every job")
+    parser.add_argument("--hal_config_name", type=str, default="offroad.yaml", help="hal config for the jobs that don't name one")
+    parser.add_argument("--remote", type=bool, default=False, help="whether to connect to a remote beamng server")
+    parser.add_argument("--host_IP", type=str, default="169.254.216.9", help="host ip address if using remote beamng")
+    args = parser.parse_args()
+
+    jobs = []
+    for job in args.jobs:
+        parts = job.split(":")
+        if parts[0] not in SCRIPTS or len(parts) not in [2, 3]:
+            raise ValueError("job {} should be script:config_name[:hal_config_name] with script one of {}".format(job, SCRIPTS))
+        jobs.append((parts[0], parts[1], parts[2] if len(parts) == 3 else args.hal_config_name))
+
+    root = str(Path(os.getcwd()).parent.absolute())
+    failed = []
+    for script, config_name, hal_config_name in jobs:
+        print("running {} with {} ({})".format(script, config_name, hal_config_name))
+        job_args = argparse.Namespace(config_name=config_name, hal_config_name=hal_config_name, remote=args.remote,
+                                      host_IP=args.host_IP, keep_session=True)
+        try:
+            with torch.no_grad():
+                importlib.import_module(script).main(
+                    config_path=root + "/Experiments/Configs/" + config_name,
+                    hal_config_path=root + "/Configs/" + hal_config_name,
+                    args=job_args,
+                )
+        except Exception:
+            print(traceback.format_exc())
+            failed.append(script + ":" + config_name)
+
+    pool = get_pool()
+    print("{} jobs, {} simulator sessions started, {} reused".format(len(jobs), pool.created, pool.reused))
+    if len(failed):
+        print("failed jobs: {}".format(", ".join(failed)))
+    close_sessions()
+    os._exit(0)
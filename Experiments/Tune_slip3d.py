@@ -19,6 +19,9 @@ import sys
 
 ## the job of this script is to take ground-truth data for controls and states, run the controls through the dynamics model and compare the predicted states to the ground-truth states
 
+## samples evaluated, selected from the dataset's per-sample metadata (statistics of the future states, see BeamNGRL/dynamics/utils/meta_utils.py)
+SAMPLE_FILTER = "mean_abs_ax >= 2 and mean_abs_ay >= 2 and mean_vx >= 2"
+
 
 def get_dynamics(model, Config):
     Dynamics_config = Config["Dynamics_config"]
@@ -70,7 +73,6 @@ def evaluator(
     if TIMESTEPS != int(100 / skip):
         print("dynamics timesteps not equal to dataset timesteps after skipping frames")
         exit()
-    count = 0
     np.set_printoptions(threshold=sys.maxsize)
     for model in config["models"]:
         dynamics = get_dynamics(model, config)
@@ -80,13 +82,6 @@ def evaluator(
             controls_tn = controls_tn.to(**tn_args)[:, ::skip, :]
             ctx_tn_dict = {k: tn.to(**tn_args) for k, tn in ctx_tn_dict.items()}
             gt_states = states_tn.clone().cpu().numpy()
-            if (
-                np.mean(np.abs(gt_states[0, :, 9])) < 2
-                or np.mean(np.abs(gt_states[0, :, 10])) < 2
-                or np.mean(gt_states[0, :, 6]) < 2
-            ):
-                count += 1
-                continue
             BEV_heght = ctx_tn_dict["bev_elev"].squeeze(0).squeeze(0)
             BEV_normal = ctx_tn_dict["bev_normal"].squeeze(0).squeeze(0)
             dynamics.set_BEV(BEV_heght, BEV_normal)
@@ -106,7 +101,6 @@ def evaluator(
                 print("NaN error")
                 print(pred_states)
                 exit()
-        print(count)
         dir_name = (
             str(Path(os.getcwd()).parent.absolute())
             + "/Experiments/Results/Accuracy/"
@@ -133,6 +127,9 @@ if __name__ == "__main__":
     parser.add_argument(
         "--batchsize", type=int, required=False, default=1, help="training batch size"
     )
+    parser.add_argument(
+        "--sample_filter", type=str, required=False, default=SAMPLE_FILTER, help="filter expression on the sample metadata, \"\" for all samples"
+    )
 
     args = parser.parse_args()
 
@@ -151,7 +148,8 @@ if __name__ == "__main__":
         ).read(),
         Loader=yaml.SafeLoader,
     )
-    # Dataloaders
+    # Dataloaders, the config's dataset filter if it has one
+    config["dataset"].setdefault("sample_filter", args.sample_filter or None)
     train_loader, valid_loader, stats, data_cfg = get_dataloaders(args, config)
     with torch.no_grad():
         evaluator(train_loader, config, tensor_args)
@@ -144,7 +144,7 @@ def main(args):
             # get robot_centric BEV (not rotated into robot frame)
             # TODO: this could be optimized away with the utils functionality.
             # TODO: move minimal example to the "examples" folder.
-            BEV_color = bng_interface.BEV_color
+            BEV_color = bng_interface.get_BEV_overlay() ## BEV_color with the vehicle markers drawn on top
             BEV_heght = (bng_interface.BEV_heght + Map_config["elevation_range"]) / (
                 2 * Map_config["elevation_range"]
             )  #  BEV normalization